@@ -2,18 +2,34 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import hashlib
+import io
 import sys
 if sys.version_info > (3, 0):
     from six.moves import xrange
 
 from bashlint import bparser, grammar, tokenizer
-from bashlint import bash, lint, nast
+from bashlint import bash, corpus, flat, lint, nast
 
-bg = grammar.bg
+get_grammar = grammar.get_grammar
+get_yaccparser = bparser.get_yaccparser
 parse = bparser.parse
 parsesingle = bparser.parsesingle
 split = bparser.split
 
+enable_ast_cache = lint.enable_ast_cache
+disable_ast_cache = lint.disable_ast_cache
+precheck = lint.precheck
+
+
+def __getattr__(name):
+    # bashlint.bg is loaded on first use (Python 3.7+), see grammar.get_grammar
+    if name == 'bg':
+        return get_grammar()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
+
 
 flag_suffix = '<FLAG_SUFFIX>'
 
@@ -32,6 +48,76 @@ def bash_parser(cmd, use_shallow_parser=False, recover_quotation=True, verbose=F
         return ast
 
 
+def ast_cache_info():
+    """
+    Return the hit/miss/eviction counters of the AST cache, or None if the
+    cache is disabled.
+    """
+    if lint.ast_cache is None:
+        return None
+    return lint.ast_cache.info()
+
+
+def clear_ast_cache():
+    if lint.ast_cache is not None:
+        lint.ast_cache.clear()
+
+
+# Returned by parse_many in place of a command whose processing raised an
+# unexpected exception.
+ParseFailure = collections.namedtuple('ParseFailure', ['cmd', 'error'])
+
+_worker_fun = None
+_worker_kwargs = None
+
+
+def _init_worker(tokenize, kwargs):
+    global _worker_fun, _worker_kwargs
+    _worker_fun = bash_tokenizer if tokenize else bash_parser
+    _worker_kwargs = kwargs
+    # set up the parser and the grammar once per worker
+    lint.normalize_ast('true')
+
+
+def _parse_one(cmd):
+    try:
+        return _worker_fun(cmd, **_worker_kwargs)
+    except Exception as e:
+        return ParseFailure(cmd, '{}: {}'.format(type(e).__name__, e))
+
+
+def parse_many(cmds, workers=None, chunksize=64, tokenize=False, **kwargs):
+    """
+    Parse a batch of commands in a pool of worker processes.
+
+    :param cmds: list of bash commands.
+    :param workers: number of worker processes, defaults to the number of
+        CPUs. If set to 1, the commands are parsed in the calling process.
+    :param chunksize: number of commands sent to a worker at a time.
+    :param tokenize: if set, run bash_tokenizer instead of bash_parser.
+    :param kwargs: keyword arguments of bash_parser or bash_tokenizer.
+    :return: list of the results of bash_parser (or bash_tokenizer) in the
+        order of the input commands. Commands that fail to parse give None
+        (or []) as usual, unexpected exceptions are returned as ParseFailure
+        values instead of being raised.
+    """
+    import multiprocessing
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1 or len(cmds) <= chunksize:
+        _init_worker(tokenize, kwargs)
+        return [_parse_one(cmd) for cmd in cmds]
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(tokenize, kwargs))
+    try:
+        return list(pool.imap(_parse_one, cmds, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+
+
 def bash_tokenizer(cmd, recover_quotation=True, loose_constraints=False,
         ignore_flag_order=False, arg_type_only=False, keep_common_args=False, with_flag_head=False,
         with_flag_argtype=False, with_prefix=False, verbose=False):
@@ -47,185 +133,258 @@ def bash_tokenizer(cmd, recover_quotation=True, loose_constraints=False,
                       with_prefix=with_prefix, with_flag_argtype=with_flag_argtype)
 
 
-def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
-               arg_type_only=False, keep_common_args=False,
-               with_arg_type=False, with_flag_head=False,
-               with_flag_argtype=False, with_prefix=False,
-               indexing_args=False):
+class token_view(object):
     """
-    Convert a bash ast into a list of tokens.
-
-    :param loose_constraints: If set, do not check semantic coherence between
-        flags and arguments.
-    :param ignore_flag_order: If set, output flags in alphabetical order.
-    :param arg_type_only: If set, output argument semantic types instead of the
-        actual value.
-    :param: keep_common_args: If set, keep common arguments such as "/", "."
-        and do not replace them with semantic types. Effective only when
-        arg_type_only is set.
-    :param with_arg_type: If set, append argument type to argument token.
-    :param with_flag_head: If set, add utility prefix to flag token.
-    :param with_flag_argtype: If set, append argument type suffix to flag token.
-    :param with_prefix: If set, add node kind prefix to token.
-    :param indexing_args: If set, append order index to argument token.
+    Options of one token list produced by ast2views. See ast2tokens for the
+    meaning of the options.
     """
-    if not node:
-        return []
+    def __init__(self, ignore_flag_order=False, arg_type_only=False,
+                 keep_common_args=False, with_arg_type=False,
+                 with_flag_head=False, with_flag_argtype=False,
+                 with_prefix=False, indexing_args=False):
+        self.ignore_flag_order = ignore_flag_order
+        self.arg_type_only = arg_type_only
+        self.keep_common_args = keep_common_args
+        self.with_arg_type = with_arg_type
+        self.with_flag_head = with_flag_head
+        self.with_flag_argtype = with_flag_argtype
+        self.with_prefix = with_prefix
+        self.indexing_args = indexing_args
+
+    def utility_token(self, node):
+        token = node.value
+        if self.with_prefix:
+            token = node.prefix + token
+        return token
+
+    def flag_token(self, node, value):
+        token = value
+        if self.with_flag_head:
+            if node.parent:
+                token = node.utility.value + "@@" + token
+        if self.with_prefix:
+            token = node.prefix + token
+        if self.with_flag_argtype:
+            suffix = ''
+            for child in node.children:
+                if child.is_argument():
+                    suffix += child.arg_type
+                elif child.is_utility():
+                    suffix += 'UTILITY'
+            token = token + flag_suffix + suffix
+        return token
+
+    def argument_token(self, node):
+        if self.arg_type_only and node.is_open_vocab():
+            if (self.keep_common_args and node.parent.is_utility() and
+                node.parent.value == 'find' and node.value in bash.find_common_args):
+                # keep frequently-occurred arguments in the vocabulary
+                # TODO: define the criteria for "common args"
+                token = node.value
+            else:
+                if node.arg_type in bash.quantity_argument_types:
+                    if node.value.startswith('+'):
+                        token = '+{}'.format(node.arg_type)
+                    elif node.value.startswith('-'):
+                        token = '-{}'.format(node.arg_type)
+                    else:
+                        token = node.arg_type
+                else:
+                    token = node.arg_type
+        else:
+            token = node.value
+        if self.with_prefix:
+            token = node.prefix + token
+        if self.with_arg_type:
+            token = token + "_" + node.arg_type
+        if self.indexing_args and node.to_index():
+            token = token + "-{:02d}".format(node.index)
+        return token
+
+
+# the views passed to linearize differ in ignore_flag_order
+MIXED_FLAG_ORDER = 2
 
+
+def linearize(node, views, loose_constraints=False):
+    """
+    Convert a bash ast into one list of tokens per token_view in a single
+    traversal.
+    """
     lc = loose_constraints
 
-    def to_tokens_fun(node):
-        tokens = []
+    def emit(outputs, token):
+        for view, tokens in outputs:
+            tokens.append(token)
+
+    def to_tokens_fun(node, outputs, flag_order):
         if node.is_root():
             assert(loose_constraints or node.get_num_of_children() == 1)
             if lc:
                 for child in node.children:
-                    tokens += to_tokens_fun(child)
+                    to_tokens_fun(child, outputs, flag_order)
             else:
-                tokens = to_tokens_fun(node.children[0])
+                to_tokens_fun(node.children[0], outputs, flag_order)
         elif node.kind == "pipeline":
             assert(loose_constraints or node.get_num_of_children() > 1)
             if lc and node.get_num_of_children() < 1:
-                tokens.append("|")
+                emit(outputs, "|")
             elif lc and node.get_num_of_children() == 1:
                 # treat "singleton-pipe" as atomic command
-                tokens += to_tokens_fun(node.children[0])
+                to_tokens_fun(node.children[0], outputs, flag_order)
             else:
                 for child in node.children[:-1]:
-                    tokens += to_tokens_fun(child)
-                    tokens.append("|")
-                tokens += to_tokens_fun(node.children[-1])
+                    to_tokens_fun(child, outputs, flag_order)
+                    emit(outputs, "|")
+                to_tokens_fun(node.children[-1], outputs, flag_order)
         elif node.kind == "commandsubstitution":
             assert(loose_constraints or node.get_num_of_children() == 1)
             if lc and node.get_num_of_children() < 1:
-                tokens += ["$(", ")"]
+                emit(outputs, "$(")
+                emit(outputs, ")")
             else:
-                tokens.append("$(")
-                tokens += to_tokens_fun(node.children[0])
-                tokens.append(")")
+                emit(outputs, "$(")
+                to_tokens_fun(node.children[0], outputs, flag_order)
+                emit(outputs, ")")
         elif node.kind == "processsubstitution":
             assert(loose_constraints or node.get_num_of_children() == 1)
             if lc and node.get_num_of_children() < 1:
-                tokens.append(node.value + "(")
-                tokens.append(")")
+                emit(outputs, node.value + "(")
+                emit(outputs, ")")
             else:
-                tokens.append(node.value + "(")
-                tokens += to_tokens_fun(node.children[0])
-                tokens.append(")")
+                emit(outputs, node.value + "(")
+                to_tokens_fun(node.children[0], outputs, flag_order)
+                emit(outputs, ")")
         elif node.is_utility():
-            token = node.value
-            if with_prefix:
-                token = node.prefix + token
-            tokens.append(token)
+            if flag_order == MIXED_FLAG_ORDER:
+                # the views which output the flags in alphabetical order
+                # visit the children in a different order than the others
+                for ignore_flag_order in (True, False):
+                    to_tokens_fun(node, [(view, tokens)
+                                         for view, tokens in outputs
+                                         if view.ignore_flag_order == ignore_flag_order],
+                                  ignore_flag_order)
+                return
+            for view, tokens in outputs:
+                tokens.append(view.utility_token(node))
             children = sorted(node.children, key=lambda x:x.value) \
-                if ignore_flag_order else node.children
+                if flag_order else node.children
             for child in children:
-                tokens += to_tokens_fun(child)
+                to_tokens_fun(child, outputs, flag_order)
         elif node.is_option():
             assert(loose_constraints or node.parent)
             if '::' in node.value and (node.value.startswith('-exec') or
                                        node.value.startswith('-ok')):
                 value, op = node.value.split('::')
-                token = value
             else:
-                token = node.value
-            if with_flag_head:
-                if node.parent:
-                    token = node.utility.value + "@@" + token
-                else:
-                    token = token
-            if with_prefix:
-                token = node.prefix + token
-            if with_flag_argtype:
-                suffix = ''
-                if node.children:
-                    for child in node.children:
-                        if child.is_argument():
-                            suffix += child.arg_type
-                        elif child.is_utility():
-                            suffix += 'UTILITY'
-                token = token + flag_suffix + suffix
-            tokens.append(token)
+                value, op = node.value, None
+            for view, tokens in outputs:
+                tokens.append(view.flag_token(node, value))
             for child in node.children:
-                tokens += to_tokens_fun(child)
-            if '::' in node.value and (node.value.startswith('-exec') or
-                                       node.value.startswith('-ok')):
+                to_tokens_fun(child, outputs, flag_order)
+            if op is not None:
                 if op == ';':
                     op = "\\;"
-                tokens.append(op)
+                emit(outputs, op)
         elif node.kind == 'operator':
-            tokens.append(node.value)
+            emit(outputs, node.value)
         elif node.kind == "binarylogicop":
             assert(loose_constraints or node.get_num_of_children() == 0)
             if lc and node.get_num_of_children() > 0:
                 for child in node.children[:-1]:
-                    tokens += to_tokens_fun(child)
-                    tokens.append(node.value)
-                tokens += to_tokens_fun(node.children[-1])
+                    to_tokens_fun(child, outputs, flag_order)
+                    emit(outputs, node.value)
+                to_tokens_fun(node.children[-1], outputs, flag_order)
             else:
-                tokens.append(node.value)
+                emit(outputs, node.value)
         elif node.kind == "unarylogicop":
             assert(loose_constraints or node.get_num_of_children() == 0)
             if lc and node.get_num_of_children() > 0:
                 if node.associate == nast.UnaryLogicOpNode.RIGHT:
-                    tokens.append(node.value)
-                    tokens += to_tokens_fun(node.children[0])
+                    emit(outputs, node.value)
+                    to_tokens_fun(node.children[0], outputs, flag_order)
                 else:
-                    tokens += to_tokens_fun(node.children[0])
-                    tokens.append(node.value)
+                    to_tokens_fun(node.children[0], outputs, flag_order)
+                    emit(outputs, node.value)
             else:
-                tokens.append(node.value)
+                emit(outputs, node.value)
         elif node.kind == "bracket":
             assert(loose_constraints or node.get_num_of_children() >= 1)
             if lc and node.get_num_of_children() < 2:
                 for child in node.children:
-                    tokens += to_tokens_fun(child)
+                    to_tokens_fun(child, outputs, flag_order)
             else:
-                tokens.append("\\(")
-                for i in xrange(len(node.children)-1):
-                    tokens += to_tokens_fun(node.children[i])
-                tokens += to_tokens_fun(node.children[-1])
-                tokens.append("\\)")
+                emit(outputs, "\\(")
+                for child in node.children:
+                    to_tokens_fun(child, outputs, flag_order)
+                emit(outputs, "\\)")
         elif node.kind == "nt":
             assert(loose_constraints or node.get_num_of_children() > 0)
-            tokens.append("(")
+            emit(outputs, "(")
             for child in node.children:
-                tokens += to_tokens_fun(child)
-            tokens.append(")")
+                to_tokens_fun(child, outputs, flag_order)
+            emit(outputs, ")")
         elif node.is_argument() or node.kind in ["t"]:
             assert(loose_constraints or node.get_num_of_children() == 0)
-            if arg_type_only and node.is_open_vocab():
-                if (keep_common_args and node.parent.is_utility() and
-                    node.parent.value == 'find' and node.value in bash.find_common_args):
-                    # keep frequently-occurred arguments in the vocabulary
-                    # TODO: define the criteria for "common args"
-                    token = node.value
-                else:
-                    if node.arg_type in bash.quantity_argument_types:
-                        if node.value.startswith('+'):
-                            token = '+{}'.format(node.arg_type)
-                        elif node.value.startswith('-'):
-                            token = '-{}'.format(node.arg_type)
-                        else:
-                            token = node.arg_type
-                    else:
-                        token = node.arg_type
-            else:
-                token = node.value
-            if with_prefix:
-                token = node.prefix + token
-            if with_arg_type:
-                token = token + "_" + node.arg_type
-            if indexing_args and node.to_index():
-                token = token + "-{:02d}".format(node.index)
-
-            tokens.append(token)
+            for view, tokens in outputs:
+                tokens.append(view.argument_token(node))
             if lc:
                 for child in node.children:
-                    tokens += to_tokens_fun(child)
-        return tokens
+                    to_tokens_fun(child, outputs, flag_order)
+
+    outputs = [(view, []) for view in views]
+    if node and views:
+        flag_order = views[0].ignore_flag_order
+        for view in views[1:]:
+            if view.ignore_flag_order != flag_order:
+                flag_order = MIXED_FLAG_ORDER
+        to_tokens_fun(node, outputs, flag_order)
+    return [tokens for view, tokens in outputs]
 
-    return to_tokens_fun(node)
+
+def ast2views(node, views, loose_constraints=False):
+    """
+    Convert a bash ast into several lists of tokens in one traversal.
+
+    :param views: dictionary which maps the name of each list of tokens to
+        the ast2tokens options used to produce it, e.g.
+        {'template': {'arg_type_only': True}, 'tokens': {}}.
+    :param loose_constraints: If set, do not check semantic coherence between
+        flags and arguments.
+    :return: dictionary which maps the name of each view to its tokens.
+    """
+    names = list(views)
+    outputs = linearize(node, [token_view(**views[name]) for name in names],
+                        loose_constraints)
+    return dict(zip(names, outputs))
+
+
+def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
+               arg_type_only=False, keep_common_args=False,
+               with_arg_type=False, with_flag_head=False,
+               with_flag_argtype=False, with_prefix=False,
+               indexing_args=False):
+    """
+    Convert a bash ast into a list of tokens.
+
+    :param loose_constraints: If set, do not check semantic coherence between
+        flags and arguments.
+    :param ignore_flag_order: If set, output flags in alphabetical order.
+    :param arg_type_only: If set, output argument semantic types instead of the
+        actual value.
+    :param: keep_common_args: If set, keep common arguments such as "/", "."
+        and do not replace them with semantic types. Effective only when
+        arg_type_only is set.
+    :param with_arg_type: If set, append argument type to argument token.
+    :param with_flag_head: If set, add utility prefix to flag token.
+    :param with_flag_argtype: If set, append argument type suffix to flag token.
+    :param with_prefix: If set, add node kind prefix to token.
+    :param indexing_args: If set, append order index to argument token.
+    """
+    view = token_view(ignore_flag_order, arg_type_only, keep_common_args,
+                      with_arg_type, with_flag_head, with_flag_argtype,
+                      with_prefix, indexing_args)
+    return linearize(node, [view], loose_constraints)[0]
 
 
 def ast2command(node, loose_constraints=False, ignore_flag_order=False):
@@ -246,6 +405,65 @@ def ast2template(node, loose_constraints=False, ignore_flag_order=False,
                         keep_common_args=keep_common_args)
     return ' '.join(tokens)
 
+def ast_hash(node, arg_type_only=True, ignore_flag_order=True):
+    """
+    Compute a canonical structural hash of a bash AST.
+
+    The hash of a node covers its kind, its token (as output by ast2tokens)
+    and the hashes of its children, so two ASTs have the same hash iff they
+    have the same shape and tokens. The hash of a tree rooted at a RootNode
+    is cached on the root, hence the tree must not be modified afterwards.
+
+    :param arg_type_only: If set, hash the argument semantic types instead
+        of the actual values.
+    :param ignore_flag_order: If set, order the flags of the utilities by
+        their tokens. The arguments keep their positions.
+    :return: hexadecimal digest of the AST.
+    """
+    key = (arg_type_only, ignore_flag_order)
+    if isinstance(node, nast.RootNode) and node.hashes is not None \
+            and key in node.hashes:
+        return node.hashes[key]
+
+    view = token_view(arg_type_only=arg_type_only)
+
+    def to_bytes(s):
+        if not isinstance(s, bytes):
+            s = s.encode('utf-8')
+        return s
+
+    def hash_fun(node):
+        if node.is_argument() or node.kind == "t":
+            token = view.argument_token(node)
+        else:
+            token = node.value
+        child_hashes = [hash_fun(child) for child in node.children]
+        if node.is_utility() and ignore_flag_order:
+            # reorder the flags among the slots they occupy, by the tokens
+            # the view outputs for them (and by hash between equal tokens)
+            slots = [i for i, child in enumerate(node.children)
+                     if child.is_option()]
+            flags = sorted((view.flag_token(node.children[i],
+                                            node.children[i].value),
+                            child_hashes[i]) for i in slots)
+            for i, (_, child_hash) in zip(slots, flags):
+                child_hashes[i] = child_hash
+        digest = hashlib.sha1(to_bytes(node.kind))
+        digest.update(b'\0' + to_bytes(token) + b'\0')
+        for child_hash in child_hashes:
+            digest.update(child_hash)
+        return digest.digest()
+
+    if not node:
+        return hashlib.sha1().hexdigest()
+    node_hash = hashlib.sha1(hash_fun(node)).hexdigest()
+    if isinstance(node, nast.RootNode):
+        if node.hashes is None:
+            node.hashes = {}
+        node.hashes[key] = node_hash
+    return node_hash
+
+
 def cmd2template(cmd, recover_quotation=True, arg_type_only=True,
                 loose_constraints=False, verbose=False):
     """
@@ -288,8 +506,52 @@ def ast2list(node, order='dfs', _list=None, ignore_flag_order=False,
     return _list
 
 
+def ast2flat(node, strings=None):
+    """
+    Convert a bash AST to an array-backed FlatTree.
+
+    :param strings: flat.StringTable shared by the flattened trees.
+    """
+    return flat.FlatTree.from_tree(node, strings)
+
+
+def load_parsed_corpus(path, recover_quotation=True, workers=None):
+    """
+    Load the ASTs of the commands of a corpus file (one command per line).
+
+    The ASTs are parsed once and saved in a memory-mapped store next to the
+    file, which is reused as long as the content of the file, the grammar and
+    the normalizer do not change.
+
+    :param workers: number of processes used to parse the commands if the
+        store has to be rebuilt, see parse_many.
+    :return: a corpus.ParsedCorpus, whose i-th item is the AST of the i-th
+        line of the file (None if it failed to parse).
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    key = corpus.store_key(content, recover_quotation=recover_quotation,
+                           grammar=grammar.grammar_stamp(),
+                           normalizer=lint.normalizer_stamp())
+    saved_file = corpus.store_path(path)
+    if corpus.read_key(saved_file) == key:
+        try:
+            return corpus.ParsedCorpus.open(saved_file, key)
+        except (IOError, OSError, ValueError):
+            # replaced or corrupted concurrently
+            pass
+
+    cmds = [line.strip() for line in io.TextIOWrapper(
+        io.BytesIO(content), encoding='utf-8')]
+    asts = parse_many(cmds, workers=workers,
+                      recover_quotation=recover_quotation)
+    if corpus.save_store(saved_file, key, asts):
+        return corpus.ParsedCorpus.open(saved_file, key)
+    return corpus.in_memory_store(key, asts)
+
+
 def utility_stats(u):
-    return bg[u].num_compound_flags
+    return get_grammar()[u].num_compound_flags
 
 
 def get_utilities(ast):
@@ -347,7 +609,7 @@ def shallow_parser(line):
         line = line + " )"
     words = line.strip().split()
 
-    root = nast.Node(kind="root", value="root")
+    root = nast.RootNode(value="root")
     stack = [root]
 
     i = 0
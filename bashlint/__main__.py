@@ -0,0 +1,68 @@
+"""
+Lint bash commands, one per line, and write one JSON record per command.
+
+Usage:
+    python -m bashlint [-o OUTPUT] [-w WORKERS] [INPUT]
+
+The commands are read from INPUT, or from the standard input if it is
+omitted or "-". See bashlint.batch for the fields of the records.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import io
+import sys
+
+from bashlint import batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bashlint',
+        description='Lint bash commands, one per line, and write one JSON '
+                    'record per command in the order of the input.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='file of commands (default: standard input)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON lines file (default: standard output)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number '
+                             'of CPUs)')
+    parser.add_argument('--chunksize', type=int, default=256,
+                        help='number of commands sent to a worker at a time')
+    parser.add_argument('--no-recover-quotation', dest='recover_quotation',
+                        action='store_false',
+                        help='drop the quotation marks of the arguments')
+    args = parser.parse_args(argv)
+
+    # shell histories are not always valid UTF-8
+    if args.input == '-':
+        lines = io.open(sys.stdin.fileno(), encoding='utf-8',
+                        errors='replace', closefd=False)
+    else:
+        lines = io.open(args.input, encoding='utf-8', errors='replace')
+    if args.output == '-':
+        out = sys.stdout
+    else:
+        out = io.open(args.output, 'w', encoding='utf-8')
+    try:
+        errors = batch.lint_stream(lines, out, workers=args.workers,
+                                   chunksize=args.chunksize,
+                                   recover_quotation=args.recover_quotation)
+    finally:
+        lines.close()
+        if out is not sys.stdout:
+            out.close()
+
+    print('{} commands, {} normalized'.format(
+        sum(errors.values()), errors[None]), file=sys.stderr)
+    for error, count in errors.most_common():
+        if error is not None:
+            print('{:<24s} {}'.format(error, count), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
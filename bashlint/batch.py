@@ -0,0 +1,139 @@
+"""
+Lint a stream of bash commands, e.g. a shell history or a corpus file with
+one command per line, in a pool of worker processes.
+
+One JSON record is written per command, in the order of the input:
+
+    cmd         the command
+    template    the template of the normalized AST (see ast2template)
+    tokens      the tokens of the normalized AST (see ast2tokens)
+    utilities   the sorted utilities the command invokes
+    error       None if the command was normalized, otherwise the reason
+                why it was not (see lint.normalize_ast_with_error) or the
+                type of the exception raised while processing it
+    time        seconds spent parsing and normalizing the command
+
+The commands are read and sent to the workers in chunks, and only a few
+chunks per worker are in flight at a time, so the memory use does not
+depend on the size of the input.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import timeit
+
+import bashlint
+from bashlint import lint
+
+
+def lint_command(cmd, recover_quotation=True):
+    """
+    The JSON record of a command.
+    """
+    record = {'cmd': cmd, 'template': None, 'tokens': None, 'utilities': [],
+              'error': None, 'time': 0.0}
+    start = timeit.default_timer()
+    try:
+        tree, error = lint.normalize_ast_with_error(cmd, recover_quotation)
+        record['time'] = timeit.default_timer() - start
+        if tree is None:
+            record['error'] = error
+        else:
+            record['template'] = bashlint.ast2template(tree)
+            record['tokens'] = bashlint.ast2tokens(tree)
+            record['utilities'] = sorted(bashlint.get_utilities(tree))
+    except Exception as e:
+        # a command which breaks the normalizer or the linearization must
+        # not stop the whole run
+        record['error'] = type(e).__name__
+        record['template'] = record['tokens'] = None
+    return record
+
+
+_recover_quotation = True
+
+
+def _init_worker(recover_quotation):
+    global _recover_quotation
+    _recover_quotation = recover_quotation
+    # set up the parser and the grammar once per worker
+    lint.normalize_ast('true')
+
+
+def _lint_chunk(cmds):
+    """
+    :return: the JSON lines of the commands and the number of commands of
+        each error category.
+    """
+    lines = []
+    errors = collections.Counter()
+    for cmd in cmds:
+        record = lint_command(cmd, _recover_quotation)
+        errors[record['error']] += 1
+        lines.append(json.dumps(record, sort_keys=True) + '\n')
+    return ''.join(lines), errors
+
+
+def _chunks(lines, chunksize):
+    chunk = []
+    for line in lines:
+        chunk.append(line.rstrip('\n'))
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def lint_stream(lines, out, workers=None, chunksize=256,
+                recover_quotation=True):
+    """
+    Lint commands and write their JSON records to out.
+
+    :param lines: iterable of commands, one per line.
+    :param out: text file object the JSON lines are written to.
+    :param workers: number of worker processes, defaults to the number of
+        CPUs. If set to 1, the commands are linted in the calling process.
+    :param chunksize: number of commands sent to a worker at a time.
+    :return: Counter of the error categories, None for the commands which
+        were normalized.
+    """
+    import multiprocessing
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    errors = collections.Counter()
+    if workers <= 1:
+        _init_worker(recover_quotation)
+        for chunk in _chunks(lines, chunksize):
+            text, chunk_errors = _lint_chunk(chunk)
+            out.write(text)
+            errors.update(chunk_errors)
+        return errors
+
+    # Pool.imap would read the whole input ahead, keep a bounded window of
+    # chunks in flight instead and write them out in order
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(recover_quotation,))
+    try:
+        pending = collections.deque()
+
+        def write_oldest():
+            text, chunk_errors = pending.popleft().get()
+            out.write(text)
+            errors.update(chunk_errors)
+
+        for chunk in _chunks(lines, chunksize):
+            if len(pending) >= 2 * workers:
+                write_oldest()
+            pending.append(pool.apply_async(_lint_chunk, (chunk,)))
+        while pending:
+            write_oldest()
+    finally:
+        pool.close()
+        pool.join()
+    return errors
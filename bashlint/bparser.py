@@ -1,4 +1,4 @@
-import os, copy
+import os, sys, threading
 
 from bashlint import yacc, tokenizer, state, bast, subst, flags, errors, heredoc
 
@@ -538,47 +538,74 @@ def p_error(p):
         raise errors.ParsingError('unexpected token %r' % p.value,
                                   p.lexer.source, p.lexpos)
 
-yaccparser = yacc.yacc(tabmodule='bashlint.parsetab',
-              outputdir=os.path.dirname(__file__),
-              debug=False)
+# the LALR tables are shipped prebuilt in parsetab.pickle. the file is stamped
+# with the yacc table version and a signature of the grammar (start symbol,
+# precedence, tokens and the p_* docstrings); yacc only rebuilds and rewrites
+# it when either no longer matches, e.g. after a production is edited.
+tabfile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'parsetab.pickle')
+
+# the parser is built on first use, see get_yaccparser
+yaccparser = None
+_yaccparser_lock = threading.Lock()
 
 # some hack to fix yacc's reduction on command substitutions:
 # which state to fix is derived from static transition tables
 # as states are changeable among python versions and architectures
 # the only state that is considered fixed is the initial state: 0
-def get_correction_states():
+def get_correction_states(yaccparser):
     reduce = yaccparser.goto[0]['simple_list'] #~10
     state2 = yaccparser.action[reduce]['NEWLINE'] #63
     state1 = yaccparser.goto[reduce]['simple_list_terminator'] #~10
     return state1, state2
 
-def get_correction_rightparen_states():
+def get_correction_rightparen_states(yaccparser):
     state1 = yaccparser.goto[0]['pipeline_command']
     state2 = yaccparser.goto[0]['simple_list1'] #11
     state_temp = yaccparser.action[state2]['SEMICOLON'] #65
     state3 = yaccparser.goto[state_temp]['simple_list1']
     return state1, state2, state3
 
-for tt in tokenizer.tokentype:
-    states = get_correction_states()
-    yaccparser.action[states[0]][tt.name] = -1
-    yaccparser.action[states[1]][tt.name] = -141
-
-states = get_correction_rightparen_states()
-yaccparser.action[states[0]]['RIGHT_PAREN'] = -155
-yaccparser.action[states[1]]['RIGHT_PAREN'] = -148
-yaccparser.action[states[2]]['RIGHT_PAREN'] = -154
-
-def parsesingle(s, strictmode=True, expansionlimit=None, convertpos=False):
+def _make_yaccparser():
+    yaccparser = yacc.yacc(module=sys.modules[__name__], picklefile=tabfile,
+                           debug=False)
+
+    for tt in tokenizer.tokentype:
+        states = get_correction_states(yaccparser)
+        yaccparser.action[states[0]][tt.name] = -1
+        yaccparser.action[states[1]][tt.name] = -141
+
+    states = get_correction_rightparen_states(yaccparser)
+    yaccparser.action[states[0]]['RIGHT_PAREN'] = -155
+    yaccparser.action[states[1]]['RIGHT_PAREN'] = -148
+    yaccparser.action[states[2]]['RIGHT_PAREN'] = -154
+    return yaccparser
+
+def get_yaccparser():
+    '''return the corrected LALR parser, building it on first use. the
+    parser returned is shared, parse with a clone of it'''
+    global yaccparser
+    if yaccparser is None:
+        with _yaccparser_lock:
+            if yaccparser is None:
+                yaccparser = _make_yaccparser()
+    return yaccparser
+
+def parsesingle(s, strictmode=True, expansionlimit=None, convertpos=False,
+                budget=None):
     '''like parse, but only consumes a single top level node, e.g. parsing
     'a\nb' will only return a node for 'a', leaving b unparsed'''
-    p = _parser(s, strictmode=strictmode, expansionlimit=expansionlimit)
+    if budget is not None:
+        budget = budget.forinput(s)
+    p = _parser(s, strictmode=strictmode, expansionlimit=expansionlimit,
+                budget=budget)
     tree = p.parse()
     if convertpos:
         bast.posconverter(s).visit(tree)
     return tree
 
-def parse(s, strictmode=True, expansionlimit=None, convertpos=False):
+def parse(s, strictmode=True, expansionlimit=None, convertpos=False,
+          budget=None):
     '''parse the input string, returning a list of nodes
     top level node kinds are:
     - command - a simple command
@@ -591,27 +618,28 @@ def parse(s, strictmode=True, expansionlimit=None, convertpos=False):
     - skip reading a heredoc if we're at the end of the input
     expansionlimit is used to limit the amount of recursive parsing done due to
     command substitutions found during word expansion.
+    budget is a state.parsebudget which bounds the work done by the parse,
+    which raises an errors.ParseBudgetError if it goes over it.
     '''
-    p = _parser(s, strictmode=strictmode, expansionlimit=expansionlimit)
+    if budget is not None:
+        budget = budget.forinput(s)
+    p = _parser(s, strictmode=strictmode, expansionlimit=expansionlimit,
+                budget=budget)
     parts = [p.parse()]
 
-    class endfinder(bast.nodevisitor):
-        def __init__(self):
-            self.end = -1
-        def visitheredoc(self, node, value):
-            self.end = node.pos[1]
-
     # find the 'real' end incase we have a heredoc in there
     ef = _endfinder()
     ef.visit(parts[-1])
     index = max(parts[-1].pos[1], ef.end) + 1
     while index < len(s):
-        part = _parser(s[index:], strictmode=strictmode).parse()
+        # parse the next top level node in place, positions come out relative
+        # to the start of s so there is no need to slice or shift anything
+        p.reset(index)
+        part = p.parse()
 
         if not isinstance(part, bast.node):
             break
 
-        bast.posshifter(index).visit(part)
         parts.append(part)
         ef = _endfinder()
         ef.visit(parts[-1])
@@ -650,12 +678,16 @@ class _parser(object):
     when we're in the middle of parsing. as a hack, we shove it into the
     YaccProduction context attribute to make it accessible.
     '''
-    def __init__(self, s, strictmode=True, expansionlimit=None, tokenizerargs=None):
+    def __init__(self, s, strictmode=True, expansionlimit=None, tokenizerargs=None,
+                 budget=None, depth=0):
         assert expansionlimit is None or isinstance(expansionlimit, int)
 
         self.s = s
         self._strictmode = strictmode
         self._expansionlimit = expansionlimit
+        self._budget = budget
+        # number of substitutions this parse is nested in
+        self._depth = depth
 
         if tokenizerargs is None:
             tokenizerargs = {}
@@ -664,19 +696,49 @@ class _parser(object):
         self.tok = tokenizer.tokenizer(s,
                                        parserstate=self.parserstate,
                                        strictmode=strictmode,
+                                       budget=budget,
                                        **tokenizerargs)
 
         self.redirstack = self.tok.redirstack
 
+    def reset(self, index=0):
+        '''rewind the parser to parse another top level node of the same
+        input, starting at index'''
+        self.parserstate = state.parserstate()
+        self.tok.reset(self.parserstate, index)
+        self.redirstack = self.tok.redirstack
+
     def parse(self):
-        # yacc.yacc returns a parser object that is not reentrant, it has
-        # some mutable state. we make a shallow copy of it so no
-        # state spills over to the next call to parse on it
-        theparser = copy.copy(yaccparser)
-        tree = theparser.parse(lexer=self.tok, context=self)
+        # the parser object returned by yacc.yacc is not reentrant, it keeps
+        # the stacks of the parse in progress. we take one from the pool of
+        # the current thread so no state spills over to the next call to
+        # parse or to a parse nested in this one (command substitutions)
+        theparser = _pool.acquire()
+        try:
+            tree = theparser.parse(lexer=self.tok, context=self)
+        finally:
+            _pool.release(theparser)
 
         return tree
 
+class _parserpool(threading.local):
+    '''a free list of parser objects per thread. a parser is taken for the
+    duration of a single parse and reset when it is given back, nested parses
+    take a parser of their own so the pool only grows with nesting depth'''
+    def __init__(self):
+        self.free = []
+
+    def acquire(self):
+        if self.free:
+            return self.free.pop()
+        return get_yaccparser().clone()
+
+    def release(self, theparser):
+        theparser.reset()
+        self.free.append(theparser)
+
+_pool = _parserpool()
+
 class _endfinder(bast.nodevisitor):
     '''helper class to find the "real" end pos of a node that contains
     a heredoc. this is a hack because heredoc aren't really part of any node
@@ -1,6 +1,8 @@
-import collections
+import collections, threading
 
 class typedset(collections.MutableSet):
+    __slots__ = ('_s', '_type')
+
     def __init__(self, type_, iterable=[]):
         self._s = set()
         self._type = type_
@@ -67,3 +69,54 @@ class frozendict(collections.Mapping):
 
     def __repr__(self):
         return '<frozendict %s>' % repr(self.__dict)
+
+class lrucache(object):
+    '''a dict-like cache that holds at most maxsize entries, evicting the least
+    recently used one first. keeps hit, miss and eviction counters'''
+    def __init__(self, maxsize=10000):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self._d = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._d.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # re-insert to mark the entry as most recently used
+            self._d[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._d.pop(key, None)
+            self._d[key] = value
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return cacheinfo(self.hits, self.misses, self.evictions, self.maxsize,
+                         len(self._d))
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def __len__(self):
+        return len(self._d)
+
+    def __repr__(self):
+        return '<lrucache %r>' % (self.info(),)
+
+cacheinfo = collections.namedtuple(
+    'cacheinfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
@@ -0,0 +1,297 @@
+"""
+On-disk store of the Normalized Bash ASTs of a command corpus.
+
+The ASTs of all commands of a corpus file (one command per line) are
+flattened with a shared string table and saved column by column next to the
+file, in "<file>.ast". The store is memory-mapped when it is opened and a
+tree is only read and rebuilt when it is accessed, so the scripts which
+process the same corpus many times (filtering, statistics, feature
+extraction, evaluation) parse it only once.
+
+The store records a key computed from the content of the corpus file and the
+parser options; a store whose key does not match is stale and is rebuilt.
+
+Layout (all integers are native int32 except the node kinds, which are
+bytes):
+
+    header                      magic, version, key and section sizes
+    tree offsets                num_trees + 1 node offsets
+    arg count offsets           num_trees + 1 arg count offsets
+    node columns                values, arg_types, list_separators, indices,
+                                parents, ends (num_nodes each)
+    arg count columns           utilities, keys, types, counts (num_args each)
+    string offsets              num_strings + 1 byte offsets
+    node kinds                  num_nodes bytes
+    strings                     UTF-8 encoded strings
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import hashlib
+import io
+import mmap
+import os
+import struct
+import sys
+
+from bashlint import flat, nast
+
+STORE_VERSION = 1
+
+MAGIC = b'BASHAST\0'
+# version, key, num_trees, num_nodes, num_args, num_strings, num_bytes
+HEADER = struct.Struct('<I40sIIIII')
+
+node_columns = ('values', 'arg_types', 'list_separators', 'indices',
+                'parents', 'ends')
+arg_count_columns = ('arg_count_utilities', 'arg_count_keys',
+                     'arg_count_types', 'arg_counts')
+
+INT_SIZE = array.array('i').itemsize
+
+
+def store_path(path):
+    return path + '.ast'
+
+
+def store_key(content, **options):
+    """
+    Key of the store of a corpus.
+
+    :param content: content of the corpus file in bytes.
+    :param options: the parser options the ASTs were computed with and the
+        stamps of the grammar and the normalizer that computed them.
+    """
+    digest = hashlib.sha1()
+    # the arrays are saved in the native format
+    digest.update('{} {} {}\0'.format(STORE_VERSION, sys.byteorder,
+                                      INT_SIZE).encode('ascii'))
+    for name, value in sorted(options.items()):
+        digest.update('{}={}\0'.format(name, value).encode('utf-8'))
+    digest.update(content)
+    return digest.hexdigest().encode('ascii')
+
+
+def _to_bytes(a):
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def _from_bytes(typecode, data):
+    a = array.array(typecode)
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    return a
+
+
+def write_store(out, key, asts):
+    """
+    Save a list of ASTs.
+
+    :param out: binary file object.
+    :param asts: the ASTs, None for the commands which failed to parse.
+    """
+    strings = flat.StringTable()
+    tree_offsets = array.array('i', [0])
+    arg_offsets = array.array('i', [0])
+    columns = flat.FlatTree(strings)
+    for ast in asts:
+        tree = flat.FlatTree.from_tree(
+            ast if isinstance(ast, nast.Node) else None, strings)
+        for name in flat.array_names:
+            getattr(columns, name).extend(getattr(tree, name))
+        tree_offsets.append(len(columns.kinds))
+        arg_offsets.append(len(columns.arg_counts))
+
+    encoded = [s.encode('utf-8') for s in strings.strings]
+    string_offsets = array.array('i', [0])
+    for s in encoded:
+        string_offsets.append(string_offsets[-1] + len(s))
+
+    out.write(MAGIC)
+    out.write(HEADER.pack(STORE_VERSION, key, len(asts), len(columns.kinds),
+                          len(columns.arg_counts), len(encoded),
+                          string_offsets[-1]))
+    out.write(_to_bytes(tree_offsets))
+    out.write(_to_bytes(arg_offsets))
+    for name in node_columns + arg_count_columns:
+        out.write(_to_bytes(getattr(columns, name)))
+    out.write(_to_bytes(string_offsets))
+    out.write(_to_bytes(columns.kinds))
+    out.write(b''.join(encoded))
+
+
+def read_key(path):
+    """
+    Key of a saved store, None if the file is missing or is not a store.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(len(MAGIC) + HEADER.size)
+    except (IOError, OSError):
+        return None
+    if len(header) < len(MAGIC) + HEADER.size or \
+            not header.startswith(MAGIC):
+        return None
+    version, key = HEADER.unpack_from(header, len(MAGIC))[:2]
+    return key if version == STORE_VERSION else None
+
+
+class StoredStrings(object):
+    """
+    Read-only string table whose strings are decoded on first access.
+    """
+    def __init__(self, buffer, offsets, start):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.start = start
+        self.cache = {}
+
+    def __getitem__(self, string_id):
+        try:
+            return self.cache[string_id]
+        except KeyError:
+            start = self.start + self.offsets[string_id]
+            end = self.start + self.offsets[string_id + 1]
+            s = self.buffer[start:end].decode('utf-8')
+            self.cache[string_id] = s
+            return s
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class ParsedCorpus(object):
+    def __init__(self, buffer, key=None):
+        """
+        :param buffer: the content of a store (bytes or mmap).
+        :param key: if given, raise a ValueError unless the store has this key.
+
+        :member key: key of the store
+        :member tree_offsets: index of the first node of each tree
+        :member arg_offsets: index of the first arg count entry of each tree
+        :member sections: offset of each column in the buffer
+        :member strings: string table shared by the trees
+        """
+        self.buffer = buffer
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a bash AST store')
+        version, self.key, num_trees, num_nodes, num_args, num_strings, _ = \
+            HEADER.unpack_from(buffer, len(MAGIC))
+        if version != STORE_VERSION:
+            raise ValueError('Unsupported bash AST store version {}'.format(
+                version))
+        if key is not None and key != self.key:
+            raise ValueError('Stale bash AST store')
+
+        position = len(MAGIC) + HEADER.size
+        self.tree_offsets = self._read('i', position, num_trees + 1)
+        position += (num_trees + 1) * INT_SIZE
+        self.arg_offsets = self._read('i', position, num_trees + 1)
+        position += (num_trees + 1) * INT_SIZE
+        self.sections = {}
+        for name in node_columns:
+            self.sections[name] = position
+            position += num_nodes * INT_SIZE
+        for name in arg_count_columns:
+            self.sections[name] = position
+            position += num_args * INT_SIZE
+        string_offsets = self._read('i', position, num_strings + 1)
+        position += (num_strings + 1) * INT_SIZE
+        self.sections['kinds'] = position
+        position += num_nodes
+        self.strings = StoredStrings(buffer, string_offsets, position)
+
+    @classmethod
+    def open(cls, path, key=None):
+        """
+        Memory-map a saved store.
+        """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(buffer, key)
+        except Exception:
+            buffer.close()
+            raise
+
+    def _read(self, typecode, start, count):
+        size = array.array(typecode).itemsize
+        return _from_bytes(typecode, self.buffer[start:start + count * size])
+
+    def flat(self, i):
+        """
+        The FlatTree of the i-th command, read from the store.
+        """
+        tree = flat.FlatTree(self.strings)
+        start, end = self.tree_offsets[i], self.tree_offsets[i + 1]
+        tree.kinds = self._read('b', self.sections['kinds'] + start,
+                                end - start)
+        for name in node_columns:
+            setattr(tree, name, self._read(
+                'i', self.sections[name] + start * INT_SIZE, end - start))
+        start, end = self.arg_offsets[i], self.arg_offsets[i + 1]
+        for name in arg_count_columns:
+            setattr(tree, name, self._read(
+                'i', self.sections[name] + start * INT_SIZE, end - start))
+        return tree
+
+    def __getitem__(self, i):
+        """
+        The AST of the i-th command, None if it failed to parse.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('AST index out of range')
+        return self.flat(i).to_tree()
+
+    def __len__(self):
+        return len(self.tree_offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_store(path, key, asts):
+    """
+    Save a store atomically.
+
+    :return: True if the store was saved.
+    """
+    # write to a temporary file first and move it into place so that
+    # concurrent readers never see a partially written store
+    tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            write_store(f, key, asts)
+        if os.path.exists(path) and sys.platform.startswith('win'):
+            os.remove(path)
+        os.rename(tmp_file, path)
+        return True
+    except (IOError, OSError):
+        # the store is simply not saved if the directory is read-only
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return False
+
+
+def in_memory_store(key, asts):
+    out = io.BytesIO()
+    write_store(out, key, asts)
+    return ParsedCorpus(out.getvalue(), key)
@@ -4,10 +4,17 @@ class ParsingError(Exception):
         self.s = s
         self.position = position
 
-        assert position <= s
+        assert position <= len(s)
         super(ParsingError, self).__init__('%s (position %d)' % (message, position))
 
 
+class ParseBudgetError(ParsingError):
+    """
+    The parse exceeded its state.parsebudget.
+    """
+    pass
+
+
 class LintParsingError(Exception):
     def __init__(self, message, s, position):
         self.message = message
@@ -0,0 +1,247 @@
+"""
+Array-backed view of the Normalized Bash AST.
+
+A FlatTree stores the nodes of an AST in preorder in parallel arrays: the
+kind, value and argument type of every node together with the index of its
+parent and the end of its subtree. The children of node i are the nodes
+i + 1, ends[i + 1], ... up to ends[i]. Strings are interned in a string
+table which may be shared by many trees so that the ids are comparable
+across trees.
+
+The arrays support the buffer protocol, so they can be wrapped by NumPy
+without copying, and a FlatTree pickles to a compact form suitable for
+sending ASTs between processes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import collections
+import sys
+if sys.version_info > (3, 0):
+    from six.moves import xrange
+
+from bashlint import nast
+
+kinds = ('root', 'pipeline', 'utility', 'flag', 'argument', 'operator',
+         'unarylogicop', 'binarylogicop', 'bracket', 'redirect',
+         'commandsubstitution', 'processsubstitution',
+         # nodes created by the shallow parser
+         'nt', 't')
+kind_ids = dict((kind, i) for i, kind in enumerate(kinds))
+
+# id of a missing string or node
+NO_ID = -1
+
+# node arrays of a FlatTree
+array_names = ('kinds', 'values', 'arg_types', 'list_separators', 'indices',
+               'parents', 'ends', 'arg_count_utilities', 'arg_count_keys',
+               'arg_count_types', 'arg_counts')
+
+
+class StringTable(object):
+    """
+    Map strings to consecutive integer ids.
+    """
+    def __init__(self, strings=()):
+        self.strings = []
+        self.ids = {}
+        for s in strings:
+            self.intern(s)
+
+    def intern(self, s):
+        try:
+            return self.ids[s]
+        except KeyError:
+            self.ids[s] = string_id = len(self.strings)
+            self.strings.append(s)
+            return string_id
+
+    def get(self, s, default=NO_ID):
+        return self.ids.get(s, default)
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class FlatTree(object):
+    def __init__(self, strings=None):
+        """
+        :member strings: string table of the values, argument types and
+            list separators
+        :member kinds: kind id of each node (index into flat.kinds)
+        :member values: string id of the value of each node
+        :member arg_types: string id of the argument type of each argument
+            node, NO_ID for the other nodes
+        :member list_separators: string id of the separator of each list
+            argument, NO_ID for the other nodes
+        :member indices: index of each argument node among the arguments of
+            the same type taken by its parent, 0 for the other nodes
+        :member parents: index of the parent of each node, NO_ID for the root
+        :member ends: index of the node following the subtree of each node
+        :member arg_count_utilities, arg_count_keys, arg_count_types,
+            arg_counts: the entries of the arg_dict of the utility nodes:
+            node index, string id of the flag (or ''), string id of the
+            argument type and number of arguments
+        """
+        self.strings = StringTable() if strings is None else strings
+        self.kinds = array.array('b')
+        self.values = array.array('i')
+        self.arg_types = array.array('i')
+        self.list_separators = array.array('i')
+        self.indices = array.array('i')
+        self.parents = array.array('i')
+        self.ends = array.array('i')
+        self.arg_count_utilities = array.array('i')
+        self.arg_count_keys = array.array('i')
+        self.arg_count_types = array.array('i')
+        self.arg_counts = array.array('i')
+
+    @classmethod
+    def from_tree(cls, node, strings=None):
+        """
+        Flatten the AST rooted at node in one traversal.
+
+        :param strings: string table shared with other trees.
+        """
+        tree = cls(strings)
+        if node is None:
+            return tree
+        intern = tree.strings.intern
+        kinds, values, arg_types, list_separators, indices, parents, ends = \
+            tree.kinds, tree.values, tree.arg_types, tree.list_separators, \
+            tree.indices, tree.parents, tree.ends
+
+        stack = [(node, NO_ID)]
+        while stack:
+            node, parent = stack.pop()
+            if node is None:
+                # all descendants of the parent have been visited
+                ends[parent] = len(kinds)
+                continue
+            if not node.kind in kind_ids:
+                raise ValueError('Unrecognized node kind "{}"'.format(node.kind))
+            i = len(kinds)
+            kinds.append(kind_ids[node.kind])
+            values.append(intern(node.value))
+            if node.kind == 'argument':
+                arg_types.append(intern(node.arg_type))
+                list_separators.append(NO_ID if node.list_separator is None
+                                       else intern(node.list_separator))
+                indices.append(node.index)
+            else:
+                arg_types.append(NO_ID)
+                list_separators.append(NO_ID)
+                indices.append(0)
+                if node.kind == 'utility':
+                    for key, counts in node.arg_dict.items():
+                        for arg_type, count in counts.items():
+                            tree.arg_count_utilities.append(i)
+                            tree.arg_count_keys.append(intern(key))
+                            tree.arg_count_types.append(intern(arg_type))
+                            tree.arg_counts.append(count)
+            parents.append(parent)
+            ends.append(i + 1)
+            if node.children:
+                stack.append((None, i))
+                stack.extend((child, i) for child in reversed(node.children))
+        return tree
+
+    def to_tree(self):
+        """
+        Rebuild the pointer-linked AST.
+        """
+        strings = self.strings
+        nodes = []
+        for i in xrange(len(self)):
+            kind = kinds[self.kinds[i]]
+            value = strings[self.values[i]]
+            if kind == 'argument':
+                arg_type = strings[self.arg_types[i]]
+                separator = self.list_separators[i]
+                separator = None if separator == NO_ID else strings[separator]
+            else:
+                arg_type, separator = '', None
+            node = nast.make_node(kind, value, arg_type, separator)
+            parent = self.parents[i]
+            if parent != NO_ID:
+                parent = nodes[parent]
+                node.parent = parent
+                node.lsb = parent.get_right_child()
+                parent.add_child(node)
+            nodes.append(node)
+
+        # restore the argument counters as they were in the flattened tree
+        for i in xrange(len(self)):
+            if self.kinds[i] == kind_ids['argument']:
+                nodes[i].index = self.indices[i]
+            elif self.kinds[i] == kind_ids['utility']:
+                nodes[i].arg_dict = {'': collections.defaultdict(int)}
+        for i, key, arg_type, count in zip(
+                self.arg_count_utilities, self.arg_count_keys,
+                self.arg_count_types, self.arg_counts):
+            arg_dict = nodes[i].arg_dict
+            key = strings[key]
+            if not key in arg_dict:
+                arg_dict[key] = collections.defaultdict(int)
+            arg_dict[key][strings[arg_type]] = count
+        return nodes[0] if nodes else None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def kind(self, i):
+        return kinds[self.kinds[i]]
+
+    def value(self, i):
+        return self.strings[self.values[i]]
+
+    def arg_type(self, i):
+        arg_type = self.arg_types[i]
+        return None if arg_type == NO_ID else self.strings[arg_type]
+
+    # node label used for evaluation ONLY
+    def label(self, i):
+        return self.kind(i).upper() + "_" + self.value(i)
+
+    def children(self, i):
+        """
+        Indices of the children of node i.
+        """
+        children = []
+        j, end = i + 1, self.ends[i]
+        while j < end:
+            children.append(j)
+            j = self.ends[j]
+        return children
+
+    def count(self, kind):
+        """
+        Number of nodes of the given kind.
+        """
+        return self.kinds.count(kind_ids[kind])
+
+    def value_counts(self, kind):
+        """
+        Number of occurrences of each value among the nodes of a kind.
+        """
+        kind_id = kind_ids[kind]
+        strings = self.strings
+        return collections.Counter(
+            strings[value] for k, value in zip(self.kinds, self.values)
+            if k == kind_id)
+
+    def as_numpy(self):
+        """
+        Wrap the node arrays in NumPy arrays without copying them.
+        """
+        import numpy as np
+        return dict(
+            (name, np.frombuffer(getattr(self, name),
+                                 dtype=np.int8 if name == 'kinds' else np.intc))
+            for name in array_names)
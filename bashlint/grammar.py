@@ -10,9 +10,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import os, sys
+import hashlib, os, sys, threading
 if sys.version_info > (3, 0):
     from six.moves import xrange
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 UTIL_S = 0
 COMPOUND_FLAG_S = 1
@@ -24,6 +28,13 @@ ARG_S = 6
 OPERATOR_S = 7
 EOF_S = 8
 
+# Version of the compiled grammar file format. Increase it whenever the state
+# classes below change so that grammar files compiled before are rebuilt.
+COMPILED_GRAMMAR_VERSION = 3
+
+# Maximum number of flag tokens whose match is memoized per utility.
+MAX_CACHED_MATCHES = 4096
+
 
 class BashGrammarState(object):
     def __init__(self, type):
@@ -64,7 +75,6 @@ class UtilityState(BashGrammarState):
         self.compound_flag = CompoundFlagState(self)
         self.positional_arguments = []
         self.eof = EOFState()
-        self.argument_only = False
 
     def add_flag(self, flag):
         self.compound_flag.add_flag(flag)
@@ -73,13 +83,17 @@ class UtilityState(BashGrammarState):
         self.positional_arguments.append(arg)
         arg.parent = self
 
-    def next_states(self):
-        if self.argument_only:
+    def next_states(self, filled=(), argument_only=False):
+        """
+        :param filled: positional argument states that have been filled.
+        :param argument_only: If set, no more flags are accepted.
+        """
+        if argument_only:
             next_states = []
         else:
             next_states = [self.compound_flag]
         for arg_state in self.positional_arguments:
-            if not arg_state.filled or (arg_state.is_list
+            if not arg_state in filled or (arg_state.is_list
                     and arg_state.list_separator == ' '):
                 next_states.append(arg_state)
         next_states.append(self.eof)
@@ -102,10 +116,129 @@ class CompoundFlagState(BashGrammarState):
         super(CompoundFlagState, self).__init__(COMPOUND_FLAG_S)
         self.parent = parent
         self.flag_index = {}
+        self.matches = {}           # memoized results of match()
 
     def add_flag(self, flag):
         self.flag_index[flag.flag_name] = flag
         flag.parent = self
+        self.matches.clear()
+
+    def match(self, token):
+        """
+        Match a token against the flags of the utility. The result only
+        depends on the token, so it is computed once per token.
+
+        :return: (flags, open_argument, argument_only), where flags is the
+            list of (flag, argument) pairs specified by the token, or None if
+            the token is not a flag of the utility; open_argument is the
+            argument state to be filled by the next token, if any;
+            argument_only is set if the token ends the flags of the utility.
+        :raise ValueError: if the token is a malformed flag of the utility.
+        """
+        try:
+            match = self.matches[token]
+        except KeyError:
+            try:
+                match = self._match(token)
+            except ValueError as e:
+                match = e
+            if len(self.matches) >= MAX_CACHED_MATCHES:
+                self.matches.clear()
+            self.matches[token] = match
+        if isinstance(match, ValueError):
+            raise ValueError(*match.args)
+        return match
+
+    def _match(self, token):
+        flag_index = self.flag_index
+        if token.startswith('--'):
+            # long option
+            if '=' in token:
+                flag_token, flag_arg = token.split('=', 1)
+            else:
+                flag_token, flag_arg = token, ''
+            if flag_token in flag_index:
+                flag_state = flag_index[flag_token]
+                if flag_state.argument:
+                    arg_state = flag_state.argument
+                    if not flag_arg:
+                        return [(flag_token, '__OPEN__')], arg_state, False
+                    else:
+                        return [(flag_token, self._attached_argument(
+                            flag_token, flag_arg))], None, False
+                else:
+                    if not flag_arg:
+                        return [(flag_token, None)], None, False
+                    else:
+                        raise ValueError('Unexpected flag argument "{}"'.format(token))
+            else:
+                if flag_token == '--':
+                    return None, None, True
+                else:
+                    raise ValueError('Unrecognized long flag "{}"'.format(flag_token))
+        elif token in flag_index:
+            flag_state = flag_index[token]
+            if flag_state.argument and not flag_state.argument.no_space:
+                return [(token, '__OPEN__')], flag_state.argument, False
+            else:
+                return [(token, None)], None, False
+        else:
+            flag_token = token[:2]
+            if flag_token in flag_index:
+                flag_state = flag_index[flag_token]
+                if flag_state.argument:
+                    # Case 1: flag has an argument
+                    flag_arg = token[2:]
+                    return [(flag_token, self._attached_argument(
+                        flag_token, flag_arg))], None, False
+                elif len(token) > 2:
+                    # Case 2: multiple flags specified at the same time
+                    flag_list = [(flag_token, None)]
+                    for j in xrange(2, len(token)):
+                        flag_token = '-' + token[j]
+                        if flag_token in flag_index:
+                            if not flag_index[flag_token].argument:
+                                flag_list.append((flag_token, None))
+                            else:
+                                if j < len(token) - 1:
+                                    flag_list.append((flag_token, self._attached_argument(
+                                        flag_token, token[j+1:])))
+                                    break
+                                else:
+                                    flag_list.append((flag_token, None))
+                        else:
+                            raise ValueError('Unrecognized flag "{}"'.format(flag_token))
+                    return flag_list, None, False
+                else:
+                    # Case 5: the token does not match any flag state
+                    return None, None, False
+            # Case 3: argument specified with a single '-'
+            elif flag_token.startswith('-') and '-' in flag_index \
+                    and flag_index['-'].argument:
+                return [('-', self._attached_argument('-', token[1:]))], \
+                       None, False
+            # Case 4: argument specified with a single '+'
+            elif flag_token.startswith('+') and '+' in flag_index \
+                    and flag_index['+'].argument:
+                return [('+', self._attached_argument('+', token[1:]))], \
+                       None, False
+            else:
+                # Case 5: the token does not match any flag state
+                return None, None, False
+
+    def _attached_argument(self, flag_token, flag_arg):
+        """
+        The (argument, type) pair of a flag whose argument is written in the
+        same token.
+
+        :raise ValueError: if the flag takes a command, which cannot be
+            written in the same token.
+        """
+        arg_state = self.flag_index[flag_token].argument
+        if arg_state.is_command():
+            raise ValueError('Flag "{}" takes a command as a separate '
+                             'argument'.format(flag_token))
+        return flag_arg, arg_state.arg_type
 
     def serialize(self):
         header = ''
@@ -154,7 +287,6 @@ class ArgumentState(BashGrammarState):
             the argument.
         :member no_space: No space between the argument and the flag it is
             attached to.
-        :member filled: If set, at least
         :member parent: Parent state.
         :member rsb: Right sibling state.
         """
@@ -166,7 +298,6 @@ class ArgumentState(BashGrammarState):
         self.list_separator = list_separator
         self.regex_format = regex_format
         self.no_space = no_space
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -188,7 +319,6 @@ class ArgCommandState(BashGrammarState):
     def __init__(self):
         super(ArgCommandState, self).__init__(ARG_COMMAND_S)
         self.no_space = False
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -201,7 +331,6 @@ class ExecCommandState(BashGrammarState):
         super(ExecCommandState, self).__init__(EXEC_COMMAND_S)
         self.stop_tokens = stop_tokens
         self.no_space = False
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -212,7 +341,6 @@ class ExecCommandState(BashGrammarState):
 class CommandState(BashGrammarState):
     def __init__(self):
         super(CommandState, self).__init__(COMMAND_S)
-        self.filled = False
         self.parent = None
         self.rsb = None
 
@@ -226,10 +354,31 @@ class EOFState(BashGrammarState):
 
 
 class BashGrammar(object):
+    """
+    The grammar states are never modified once the grammar is built, so they
+    can be shared. The progress of parsing a command is kept in a BashGrammar
+    object created with cursor(), which holds the current position in the
+    grammar tree as well as the filled arguments.
+    """
     def __init__(self):
         self.name2type = {}
         self.grammar = {}
         self.next_states = None     # pointer on the current position in the grammar tree
+        self.filled = set()         # argument states filled so far
+        self.argument_only = set()  # utility states which stopped accepting flags
+
+    def cursor(self):
+        """
+        Return a new parsing cursor sharing the states of this grammar.
+        """
+        cursor = BashGrammar()
+        cursor.name2type = self.name2type
+        cursor.grammar = self.grammar
+        return cursor
+
+    def utility_next_states(self, utility_state):
+        return utility_state.next_states(
+            self.filled, utility_state in self.argument_only)
 
     def allow_eof(self):
         for state in self.next_states:
@@ -245,7 +394,7 @@ class BashGrammar(object):
     def consume(self, token):
         if token in self.grammar:
             utility_state = self.grammar[token]
-            self.next_states = utility_state.next_states()
+            self.next_states = self.utility_next_states(utility_state)
             return True
         else:
             return False
@@ -253,106 +402,73 @@ class BashGrammar(object):
     def push(self, token, state_type):
         state = self.get_next_state(state_type)
         if state_type == COMPOUND_FLAG_S:
-            if token.startswith('--'):
-                # long option
-                if '=' in token:
-                    flag_token, flag_arg = token.split('=', 1)
-                else:
-                    flag_token, flag_arg = token, ''
-                if flag_token in state.flag_index:
-                    flag_state = state.flag_index[flag_token]
-                    if flag_state.argument:
-                        arg_state = flag_state.argument
-                        if not flag_arg:
-                            self.next_states = [arg_state]
-                            return [(flag_token, '__OPEN__')]
-                        else:
-                            return [(flag_token, (flag_arg, arg_state.arg_type))]
-                    else:
-                        if not flag_arg:
-                            return [(flag_token, None)]
-                        else:
-                            raise ValueError('Unexpected flag argument "{}"'.format(token))
-                else:
-                    if flag_token == '--':
-                        state.parent.argument_only = True
-                    else:
-                        raise ValueError('Unrecognized long flag "{}"'.format(flag_token))
-            elif token in state.flag_index:
-                flag_token = token
-                state = state.flag_index[flag_token]
-                if state.argument and not state.argument.no_space:
-                    self.next_states = [state.argument]
-                    return [(flag_token, '__OPEN__')]
-                else:
-                    return [(flag_token, None)]
-            else:
-                flag_token = token[:2]
-                if flag_token in state.flag_index:
-                    flag_state = state.flag_index[flag_token]
-                    if flag_state.argument:
-                        # Case 1: flag has an argument
-                        flag_arg = token[2:]
-                        arg_state = flag_state.argument
-                        return [(flag_token, (flag_arg, arg_state.arg_type))]
-                    else:
-                        if len(token) > 2:
-                            # Case 2: multiple flags specified at the same time
-                            flag_list = [(flag_token, None)]
-                            for j in xrange(2, len(token)):
-                                flag_token = '-' + token[j]
-                                if flag_token in state.flag_index:
-                                    if not state.flag_index[flag_token].argument:
-                                        flag_list.append((flag_token, None))
-                                    else:
-                                        if j < len(token) - 1:
-                                            arg_state = state.flag_index[flag_token].argument
-                                            flag_list.append((flag_token, (token[j+1:], arg_state.arg_type)))
-                                            break
-                                        else:
-                                            flag_list.append((flag_token, None))
-                                else:
-                                    raise ValueError('Unrecognized flag "{}"'.format(flag_token))
-                            return flag_list
-                        else:
-                            # Case 5: the token does not match any flag state
-                            return None
-                else:
-                    # Case 3: argument specified with a single '-'
-                    if flag_token.startswith('-') and '-' in state.flag_index \
-                            and state.flag_index['-'].argument:
-                        flag_arg = token[1:]
-                        arg_state = state.flag_index['-'].argument
-                        return [('-', (flag_arg, arg_state.arg_type))]
-                    # Case 4: argument specified with a single '+'
-                    elif flag_token.startswith('+') and '+' in state.flag_index \
-                            and state.flag_index['+'].argument:
-                        flag_arg = token[1:]
-                        arg_state = state.flag_index['+'].argument
-                        return [('+', (flag_arg, arg_state.arg_type))]
-                    else:
-                        # Case 5: the token does not match any flag state
-                        return None
+            flags, open_argument, argument_only = state.match(token)
+            if open_argument is not None:
+                self.next_states = [open_argument]
+            if argument_only:
+                self.argument_only.add(state.parent)
+            if flags is not None:
+                # the matched flags are shared, hand out a copy
+                return list(flags)
         elif state_type == COMMAND_S:
-            self.next_states = state.get_utility().next_states()
+            self.next_states = self.utility_next_states(state.get_utility())
         elif state_type == ARG_COMMAND_S:
-            self.next_states = state.get_utility().next_states()
+            self.next_states = self.utility_next_states(state.get_utility())
         elif state_type == EXEC_COMMAND_S:
-            self.next_states = state.get_utility().next_states()
+            self.next_states = self.utility_next_states(state.get_utility())
         elif state_type == OPERATOR_S:
             for i, next_state in enumerate(self.next_states):
                 if next_state.is_compound_flag():
                     del(self.next_states[i])
         elif state.type == ARG_S:
-            state.filled = True
+            self.filled.add(state)
             if state.rsb:
                 # continue interpreting the next argument of the same parent state
                 self.next_states = [state.rsb]
                 return '__SAME_PARENT__'
             else:
-                self.next_states = state.get_utility().next_states()
+                self.next_states = self.utility_next_states(state.get_utility())
                 return '__PARENT_CHANGE__'
 
+    def load_grammar(self, input_file):
+        """
+        Load utility grammar from the compiled copy of the man-page synopsis
+        file, which is saved next to it. The compiled copy is rebuilt from
+        input_file whenever it is missing or input_file has been modified
+        since it was compiled.
+        """
+        compiled_file = os.path.splitext(input_file)[0] + '.pickle'
+        input_stat = os.stat(input_file)
+        stamp = (COMPILED_GRAMMAR_VERSION, input_stat.st_mtime,
+                 input_stat.st_size)
+        try:
+            with open(compiled_file, 'rb') as f:
+                if pickle.load(f) == stamp:
+                    self.name2type, self.grammar = pickle.load(f)
+                    return
+        except Exception:
+            # missing, truncated or incompatible compiled file
+            pass
+
+        self.make_grammar(input_file)
+        self.save_grammar(compiled_file, stamp)
+
+    def save_grammar(self, compiled_file, stamp):
+        # write to a temporary file first and move it into place so that
+        # concurrent readers never see a partially written grammar file
+        tmp_file = '{}.{}.tmp'.format(compiled_file, os.getpid())
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(stamp, f, 2)
+                pickle.dump((self.name2type, self.grammar), f, 2)
+            if os.path.exists(compiled_file) and sys.platform.startswith('win'):
+                os.remove(compiled_file)
+            os.rename(tmp_file, compiled_file)
+        except (IOError, OSError):
+            # the grammar is simply not cached if the directory is read-only
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
     def make_grammar(self, input_file):
         """
         Build utility grammar from man-page synopsis.
@@ -393,8 +509,6 @@ class BashGrammar(object):
             elif reading_synopsis:
                 self.make_utility(line)
 
-        print('Bashlint grammar set up ({} utilities)'.format(len(self.grammar)))
-        print()
 
     def make_utility(self, line):
         line = line.strip()
@@ -685,5 +799,42 @@ class BashGrammar(object):
         return flag
 
 
-bg = BashGrammar()
-bg.make_grammar(os.path.join(os.path.dirname(__file__), 'grammar', 'grammar100.txt'))
\ No newline at end of file
+grammar_file = os.path.join(os.path.dirname(__file__), 'grammar',
+                            'grammar100.txt')
+
+
+def grammar_stamp():
+    """
+    Identify the utility grammar: the compiled format version and a digest
+    of the content of the grammar file.
+    """
+    with open(grammar_file, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return '{}:{}'.format(COMPILED_GRAMMAR_VERSION, digest)
+
+# the grammar is loaded on first use, see get_grammar
+_bg = None
+_bg_lock = threading.Lock()
+
+
+def get_grammar():
+    """
+    Return the utility grammar, loading it on first use.
+    """
+    global _bg
+    if _bg is None:
+        with _bg_lock:
+            if _bg is None:
+                bg = BashGrammar()
+                bg.load_grammar(grammar_file)
+                _bg = bg
+    return _bg
+
+
+def __getattr__(name):
+    # grammar.bg is kept for the code written when the grammar was loaded
+    # at import time (Python 3.7+)
+    if name == 'bg':
+        return get_grammar()
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
@@ -0,0 +1,135 @@
+"""
+Hash-consed store of Normalized Bash AST subtrees.
+
+Every distinct subtree of the ASTs added to a SubtreeStore is stored once as
+an immutable Subtree tuple whose children are the ids of other subtrees, so
+structurally identical subtrees (e.g. "find . -type f" or "xargs -0 rm")
+occurring anywhere in a corpus share the same id. Work that only depends on
+a subtree can be computed once per id with SubtreeStore.fold.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+from bashlint import nast
+
+# An interned subtree. arg_type, list_separator and index are only set for
+# argument nodes, arg_counts (the arg_dict of the node as sorted tuples) only
+# for utility nodes. children is the tuple of the ids of the child subtrees.
+Subtree = collections.namedtuple(
+    'Subtree', ['kind', 'value', 'arg_type', 'list_separator', 'index',
+                'arg_counts', 'children'])
+
+
+class SubtreeStore(object):
+    def __init__(self, track_occurrences=True):
+        """
+        :member subtrees: list of the distinct subtrees, indexed by id
+        :member ids: maps each Subtree to its id
+        :member roots: id of the root subtree of each added tree, None for
+            the trees which failed to parse
+        :member occurrences: maps each subtree id to the list of
+            (tree id, preorder position) pairs at which it occurs, None if
+            occurrences are not tracked
+        """
+        self.subtrees = []
+        self.ids = {}
+        self.roots = []
+        self.occurrences = collections.defaultdict(list) \
+            if track_occurrences else None
+
+    def intern(self, subtree):
+        try:
+            return self.ids[subtree]
+        except KeyError:
+            self.ids[subtree] = subtree_id = len(self.subtrees)
+            self.subtrees.append(subtree)
+            return subtree_id
+
+    def add(self, node):
+        """
+        Intern all subtrees of an AST.
+
+        :return: id of the tree, i.e. its index in self.roots.
+        """
+        tree_id = len(self.roots)
+        position = [0]
+
+        def intern_fun(node):
+            i = position[0]
+            position[0] += 1
+            children = tuple(intern_fun(child) for child in node.children)
+            if node.kind == 'argument':
+                subtree = Subtree(node.kind, node.value, node.arg_type,
+                                  node.list_separator, node.index, (),
+                                  children)
+            elif node.kind == 'utility':
+                arg_counts = tuple(sorted(
+                    (key, tuple(sorted(counts.items())))
+                    for key, counts in node.arg_dict.items()))
+                subtree = Subtree(node.kind, node.value, None, None, 0,
+                                  arg_counts, children)
+            else:
+                subtree = Subtree(node.kind, node.value, None, None, 0, (),
+                                  children)
+            subtree_id = self.intern(subtree)
+            if self.occurrences is not None:
+                self.occurrences[subtree_id].append((tree_id, i))
+            return subtree_id
+
+        self.roots.append(None if node is None else intern_fun(node))
+        return tree_id
+
+    def tree(self, tree_id):
+        """
+        Materialize the AST of an added tree.
+        """
+        root = self.roots[tree_id]
+        return None if root is None else self.materialize(root)
+
+    def materialize(self, subtree_id, parent=None):
+        """
+        Build a fresh pointer-linked copy of a subtree, attached to parent
+        if given.
+        """
+        subtree = self.subtrees[subtree_id]
+        node = nast.make_node(subtree.kind, subtree.value, subtree.arg_type,
+                              subtree.list_separator)
+        if parent is not None:
+            node.parent = parent
+            node.lsb = parent.get_right_child()
+            parent.add_child(node)
+        for child in subtree.children:
+            self.materialize(child, node)
+
+        # restore the argument counters as they were in the interned tree
+        if subtree.kind == 'argument':
+            node.index = subtree.index
+        elif subtree.kind == 'utility':
+            node.arg_dict = dict(
+                (key, collections.defaultdict(int, counts))
+                for key, counts in subtree.arg_counts)
+        return node
+
+    def fold(self, fun, subtree_id, cache):
+        """
+        Compute fun(subtree, child_results) bottom-up over a subtree, once
+        per distinct subtree.
+
+        :param cache: dictionary from subtree ids to results, shared by the
+            calls which compute the same function.
+        """
+        try:
+            return cache[subtree_id]
+        except KeyError:
+            subtree = self.subtrees[subtree_id]
+            result = fun(subtree, [self.fold(fun, child, cache)
+                                   for child in subtree.children])
+            cache[subtree_id] = result
+            return result
+
+    def __len__(self):
+        return len(self.subtrees)
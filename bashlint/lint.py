@@ -22,7 +22,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import copy
+import hashlib
 import os
 import re
 import sys
@@ -33,91 +33,181 @@ if sys.version_info > (3, 0):
 from bashlint.grammar import *
 
 # bashlex stuff
-from bashlint import bast, errors, tokenizer, bparser
+from bashlint import bast, butils, errors, tokenizer, bparser, state
 from bashlint.nast import *
 
 from nlp_tools import constants
 
 
-def clean_and_normalize(cmd):
-    # special normalization for certain commands
-    ## remove all "sudo"'s
-    cmd = cmd.replace("sudo", "")
-
-    ## normalize utilities called with full path
-    cmd = cmd.replace("/usr/bin/find", "find")
-    cmd = cmd.replace("/bin/find", "find")
-    cmd = cmd.replace("/usr/bin/grep", "grep")
-    cmd = cmd.replace("/bin/rm", "rm")
-    cmd = cmd.replace("/bin/mv", "mv")
-    
-    ## correct common typos
-    cmd = cmd.replace("'{}'", "{}")
-    cmd = cmd.replace("\"{}\"", "{}")
-    cmd = cmd.replace("-i{}", "-I {}")
-    cmd = cmd.replace("-i%", "-I %")
-    cmd = cmd.replace("-I{}", "-I {}")
-    cmd = cmd.replace(" [] ", " {} ")
-    cmd = cmd.replace("-L.", "-L")
-    cmd = cmd.replace("-mitime", "-mtime")
-    cmd = cmd.replace("-dev", "-xdev")
-    cmd = cmd.replace("-regex-type", "-regextype")
-    cmd = cmd.replace(" ( ", " \\( ")
-    cmd = cmd.replace(" ) ", " \\) ")
-    cmd = cmd.replace("-\\(", "\\(")
-    cmd = cmd.replace("-\\)", "\\)")
-    cmd = cmd.replace("\"\\)", " \\)")
-    cmd = cmd.replace("\\(-", "\\( -")
-    cmd = cmd.replace("e\\)", "e \\)")
-    cmd = cmd.replace("-\\!", "!")
+# Version of the normalization of commands. Increase it whenever the output of
+# normalize_ast changes so that the ASTs saved by load_parsed_corpus are
+# rebuilt (the rewrite rules below are accounted for by normalizer_stamp).
+NORMALIZER_VERSION = 1
+
+# Rewrite rules applied by clean_and_normalize, in the order in which they
+# were originally applied one after another.
+rewrite_rules = [
+    # remove all "sudo"'s
+    ("sudo", ""),
+
+    # normalize utilities called with full path
+    ("/usr/bin/find", "find"),
+    ("/bin/find", "find"),
+    ("/usr/bin/grep", "grep"),
+    ("/bin/rm", "rm"),
+    ("/bin/mv", "mv"),
+
+    # correct common typos
+    ("'{}'", "{}"),
+    ("\"{}\"", "{}"),
+    ("-i{}", "-I {}"),
+    ("-i%", "-I %"),
+    ("-I{}", "-I {}"),
+    (" [] ", " {} "),
+    ("-L.", "-L"),
+    ("-mitime", "-mtime"),
+    ("-dev", "-xdev"),
+    ("-regex-type", "-regextype"),
+    (" ( ", " \\( "),
+    (" ) ", " \\) "),
+    ("-\\(", "\\("),
+    ("-\\)", "\\)"),
+    ("\"\\)", " \\)"),
+    ("\\(-", "\\( -"),
+    ("e\\)", "e \\)"),
+    ("-\\!", "!"),
+    ("— ", "-"),
+    ("–", "-"),
+    ("—", "-"),
+    ("“", '"'),
+    ("”", '"'),
+    ("-\xd0\xbe", "-o"),
+    ("\xe2\x80\x93 ", "-"),
+    ('‘', '\''),
+    ('’', '\''),
+
+    # more typo fixes ("-prin" at the end of a command is fixed separately)
+    ("-prin ", "-print"),
+    ("/bin/echo", "echo"),
+    (" exec sed ", " -exec sed "),
+    (" xargs -iname ", " xargs "),
+    (" -chour +1 ", " -cmin 60 "),
+    (" -target-directory ", " --target-directory="),
+    ("- perm", "-perm"),
+    (" perm", " -perm"),
+    ("'-rd\\n' ", ''),
+
+    # the output of one rule completed the pattern of a later one
+    ("-i'{}'", "-I {}"),
+    ("-i\"{}\"", "-I {}"),
+    ("-I'{}'", "-I {}"),
+    ("-I\"{}\"", "-I {}"),
+    (" –target-directory ", " --target-directory="),
+    (" —target-directory ", " --target-directory="),
+    ("– perm", "-perm"),
+]
+
+
+
+def normalizer_stamp():
+    """
+    Identify the normalization of commands: its version and a digest of the
+    rewrite rules.
+    """
+    digest = hashlib.sha1(repr(rewrite_rules).encode('utf-8')).hexdigest()
+    return '{}:{}'.format(NORMALIZER_VERSION, digest)
+
+# remove shell character
+shell_prompt_re = re.compile(r'(?:\$ |# |[$#](?=find ))')
+
+# the first argument of "tar" is always interpreted as an option
+tar_fix_re = re.compile(r' tar (?=\w)')
+
+# bounds the work done to parse a command, so that garbage commands (e.g.
+# decoder outputs with deeply nested or unbalanced brackets) fail fast. the
+# commands of the corpus take less than 600 steps and 5 steps per character.
+parse_budget = state.parsebudget(maxsteps=1000, maxnesting=32,
+                                 maxexpansion=16, stepsperchar=10)
+
+
+def trie_regex(words):
+    """
+    Compile a list of strings into a regular expression which shares the
+    common prefixes of the strings and prefers the longest match.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = None
+
+    def to_regex(node):
+        alternatives = [re.escape(c) + to_regex(child)
+                        for c, child in sorted(node.items()) if c]
+        if not alternatives:
+            return ''
+        if len(alternatives) == 1 and not '' in node:
+            return alternatives[0]
+        regex = '(?:' + '|'.join(alternatives) + ')'
+        if '' in node:
+            regex += '?'
+        return regex
+
+    return to_regex(trie)
+
+
+class rewriter(object):
+    """
+    Apply a list of literal rewrite rules to a string in a single pass.
+
+    The patterns are compiled into one trie-shaped regular expression, so
+    that at every position the longest matching rule is applied and the
+    scan resumes after the replaced text.
+    """
+    def __init__(self, rules):
+        self.replacements = dict(rules)
+        self.regex = re.compile(trie_regex(self.replacements))
+
+    def replace(self, match):
+        return self.replacements[match.group(0)]
+
+    def sub(self, s):
+        return self.regex.sub(self.replace, s)
+
+
+_rewriters = {}
+
+
+def get_rewriter(s):
     try:
-        cmd = cmd.replace("— ", "-")
-        cmd = cmd.replace("–", "-")
-        cmd = cmd.replace("—", "-")
-        cmd = cmd.replace("“", '"')
-        cmd = cmd.replace("”", '"')
-        cmd = cmd.replace("-\xd0\xbe", "-o")
-        cmd = cmd.replace("\xe2\x80\x93 ", "-")
-        cmd = cmd.replace('‘', '\'')
-        cmd = cmd.replace('’', '\'')
-    except UnicodeDecodeError:
-        cmd = cmd.replace("— ".decode('utf-8'), "-")
-        cmd = cmd.replace("–".decode('utf-8'), "-")
-        cmd = cmd.replace("—".decode('utf-8'), "-")
-        cmd = cmd.replace("“".decode('utf-8'), '"')
-        cmd = cmd.replace("”".decode('utf-8'), '"')
-        cmd = cmd.replace("\xd0\xbe".decode('utf-8'), "o")
-        cmd = cmd.replace("\xe2\x80\x93 ".decode('utf-8') , "-")
-        cmd = cmd.replace('‘'.decode('utf-8'), '\'')
-        cmd = cmd.replace('’'.decode('utf-8'), '\'')
-
-    # more typo fixes
-    cmd = re.sub("-prin($| )", '-print', cmd)
-    cmd = cmd.replace("/bin/echo", "echo")
-    cmd = cmd.replace(" exec sed ", " -exec sed ")
-    cmd = cmd.replace(" xargs -iname ", " xargs ")
-    cmd = cmd.replace(" -chour +1 ", " -cmin 60 ")
-    cmd = cmd.replace(" -target-directory ", " --target-directory=")
-    cmd = cmd.replace("- perm", "-perm")
-    cmd = cmd.replace(" perm", " -perm")
-    cmd = cmd.replace("'-rd\\n' ", '')
-
-    ## remove shell character
-    if cmd.startswith("$ "):
-        cmd = re.sub("^\$ ", '', cmd)
-    if cmd.startswith("# "):
-        cmd = re.sub("^\# ", '', cmd)
-    if cmd.startswith("$find "):
-        cmd = re.sub("^\$find ", "find ", cmd)
-    if cmd.startswith("#find "):
-        cmd = re.sub("^\#find ", "find ", cmd)
-
-    ## the first argument of "tar" is always interpreted as an option
-    tar_fix = re.compile(' tar \w')
-    if cmd.startswith('tar'):
-        cmd = ' ' + cmd
-    for w in re.findall(tar_fix, cmd):
-        cmd = cmd.replace(w, w.replace(' tar ', ' tar -'))
+        return _rewriters[type(s)]
+    except KeyError:
+        rules = rewrite_rules
+        if not isinstance(rules[0][0], type(s)):
+            # unicode input in Python 2
+            rules = [(p.decode('utf-8'), r.decode('utf-8')) for p, r in rules]
+        return _rewriters.setdefault(type(s), rewriter(rules))
+
+
+def clean_and_normalize(cmd):
+    """
+    Normalize the surface form of a command before parsing: remove "sudo"
+    and shell prompts, strip the path of common utilities and correct
+    frequent typos.
+    """
+    cmd = get_rewriter(cmd).sub(cmd)
+    if cmd.endswith('-prin'):
+        cmd += 't'
+
+    m = shell_prompt_re.match(cmd)
+    if m:
+        cmd = cmd[m.end():]
+
+    if 'tar' in cmd:
+        if cmd.startswith('tar'):
+            cmd = ' ' + cmd
+        cmd = tar_fix_re.sub(' tar -', cmd)
     cmd = cmd.strip()
 
     return cmd
@@ -143,9 +233,40 @@ def detach_from_tree(node, parent):
     node.lsb = None
 
 
-def safe_bashlex_parse(cmd, start_pos=0, verbose=False):
+# The exceptions bashlex raises on the commands it cannot parse, which
+# safe_bashlex_parse catches. A failure is categorized by the first type of
+# the list it is an instance of.
+bashlex_errors = (
+    errors.ParseBudgetError,
+    tokenizer.MatchedPairError,
+    errors.ParsingError,
+    NotImplementedError,
+    # empty command
+    IndexError,
+    # not a bash command
+    AttributeError,
+    AssertionError,
+    NameError,
+    TypeError
+)
+
+
+def bashlex_error_name(e):
+    """
+    Category of an exception caught by safe_bashlex_parse.
+    """
+    for error_type in bashlex_errors:
+        if isinstance(e, error_type):
+            return error_type.__name__
+    return type(e).__name__
+
+
+def safe_bashlex_parse(cmd, start_pos=0, verbose=False, failure=None):
     """
     Call bashlex with all exceptions properly catched.
+
+    :param failure: if set, a list to which the reason why the command
+        cannot be parsed is appended (see normalize_ast_with_error).
     """
     def increment_bashlex_tree_offset(tree, offset):
         if tree.kind == 'word':
@@ -154,63 +275,238 @@ def safe_bashlex_parse(cmd, start_pos=0, verbose=False):
             for child in tree.parts:
                 increment_bashlex_tree_offset(child, offset)
     try:
-        tree = bparser.parse(cmd)
+        tree = bparser.parse(cmd, budget=parse_budget)
         if start_pos > 0:
             increment_bashlex_tree_offset(tree[0], start_pos)
-    except tokenizer.MatchedPairError:
+    except bashlex_errors as e:
         if verbose:
-            print("Bashlex cannot parse: %s - MatchedPairError" % cmd)
-        return None
-    except errors.ParsingError:
-        if verbose:
-            print("Bashlex cannot parse: %s - ParsingError" % cmd)
-        return None
-    except NotImplementedError:
-        if verbose:
-            print("Bashlex cannot parse: %s - NotImplementedError" % cmd)
-        return None
-    except IndexError:
-        if verbose:
-            print("Bashlex cannot parse: %s - IndexError" % cmd)
-        # empty command
-        return None
-    except AttributeError:
-        if verbose:
-            print("Bashlex cannot parse: %s - AttributeError" % cmd)
-        # not a bash command
-        return None
-    except AssertionError:
-        if verbose:
-            print("Bashlex cannot parse: %s - AssertionError" % cmd)
-        # not a bash command
-        return None
-    except NameError:
-        if verbose:
-            print("Bashlex cannot parse: %s - NameError" % cmd)
-        # not a bash command
-        return None
-    except TypeError:
-        if verbose:
-            print("Bashlex cannot parse: %s - AssertionError" % cmd)
+            print("Bashlex cannot parse: %s - %s" % (cmd, bashlex_error_name(e)))
+        if failure is not None:
+            failure.append(bashlex_error_name(e))
         return None
     if len(tree) > 1:
         if verbose:
             print("Doesn't support command with multiple root nodes: %s" % cmd)
+        if failure is not None:
+            failure.append('MultipleRootNodes')
         return None
     return tree
 
+
+def normalize_ast_with_error(cmd, recover_quotes=True):
+    """
+    Like normalize_ast, but also return why the command was not normalized,
+    which is found out by the same parse. The ast_cache is not used.
+
+    :return: (normalized_tree, None) or (None, error) where error is the
+        category of the exception bashlex raised on the command (see
+        bashlex_errors), or one of "EmptyCommand", "MultipleRootNodes" and
+        "NormalizationError".
+    """
+    failure = []
+    tree = _normalize_ast(cmd, recover_quotes, failure=failure)
+    if tree is not None:
+        return tree, None
+    return None, failure[0] if failure else 'NormalizationError'
+
+# words made of characters bashlex reads literally, which normalize_ast uses
+# as they are
+plain_word_re = re.compile(r'[\w./:+%,@=^*?\[\]!-]+$')
+
+# the reserved words bash recognizes at the start of a command
+reserved_words = {'!', '[[', ']]', 'case', 'do', 'done', 'elif', 'else',
+                  'esac', 'fi', 'for', 'function', 'if', 'in', 'select',
+                  'then', 'time', 'until', 'while', '{', '}', 'coproc'}
+
+
+def _scan_commands(cmd):
+    """
+    Split a command at the pipes and list operators outside of quotes.
+
+    :return: (reason, pipelines) where reason is "UnbalancedQuotes",
+        "UnbalancedParentheses" or None, and pipelines is the list of the
+        pipelines of the command, each a list of commands made of words, or
+        None if the command has parentheses, redirections or substitutions
+        and cannot be split this way.
+    """
+    # constructs whose quotes and parentheses are not matched as in the
+    # rest of the command
+    if '<<' in cmd or '[[' in cmd or '${' in cmd or "$'" in cmd:
+        return None, None
+    pipelines = [[[]]]
+    word = ''
+    simple = True
+    depth = 0
+    i, n = 0, len(cmd)
+    while i < n:
+        c = cmd[i]
+        if c in ' \t':
+            if word:
+                pipelines[-1][-1].append(word)
+                word = ''
+            i += 1
+            continue
+        if c == '#' and not word:
+            # the rest of the command is a comment
+            break
+        if c == '\\':
+            j = i + 2
+        elif c == "'":
+            j = cmd.find("'", i + 1) + 1
+            if j == 0:
+                return 'UnbalancedQuotes', None
+        elif c == '"' or c == '`':
+            j = i + 1
+            while j < n and cmd[j] != c:
+                if cmd[j] == '\\':
+                    j += 1
+                elif c == '"' and (cmd[j] == '`' or cmd.startswith('$(', j)):
+                    # quotes in a substitution nested in the double quotes
+                    return None, None
+                j += 1
+            if j >= n:
+                return 'UnbalancedQuotes', None
+            j += 1
+            if c == '`':
+                simple = False
+        elif c in '|;&':
+            if word:
+                pipelines[-1][-1].append(word)
+                word = ''
+            if c == '|' and cmd[i + 1:i + 2] != '|':
+                # pipe, or |&
+                pipelines[-1].append([])
+                j = i + 2 if cmd[i + 1:i + 2] == '&' else i + 1
+            else:
+                pipelines.append([[]])
+                j = i + 2 if cmd[i + 1:i + 2] == c else i + 1
+            i = j
+            continue
+        else:
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+                if depth < 0:
+                    return 'UnbalancedParentheses', None
+            if c in '()<>{}':
+                simple = False
+            j = i + 1
+        word += cmd[i:j]
+        i = j
+    if word:
+        pipelines[-1][-1].append(word)
+    if depth != 0:
+        return 'UnbalancedParentheses', None
+    if not simple:
+        return None, None
+    return None, [[words for words in pipeline if words]
+                  for pipeline in pipelines
+                  if any(pipeline)]
+
+
+def precheck(cmd):
+    """
+    Cheap grammatical check of a command, to reject most of the commands
+    normalize_ast cannot normalize before running it.
+
+    It never rejects a command normalize_ast normalizes: only the words it
+    can read without parsing (plain words of commands without parentheses,
+    redirections or substitutions) are checked against the grammar.
+
+    :return: None if the command may be grammatical, otherwise the reason
+        why it is not: "EmptyCommand", "UnbalancedQuotes",
+        "UnbalancedParentheses", "MultipleCommands" (normalize_ast only
+        supports a single pipeline), "UnknownUtility" or "UnknownFlag".
+    """
+    cmd = clean_and_normalize(cmd.replace('\n', ' ').strip())
+    if not cmd:
+        return 'EmptyCommand'
+    reason, pipelines = _scan_commands(cmd)
+    if reason is not None or pipelines is None:
+        return reason
+    if len(pipelines) > 1:
+        return 'MultipleCommands'
+
+    utilities = get_grammar().grammar
+    for words in (pipelines[0] if pipelines else []):
+        head = words[0]
+        if not plain_word_re.match(head) or '=' in head or \
+                head in reserved_words:
+            continue
+        if not head in utilities:
+            return 'UnknownUtility'
+        # the flags which directly follow the utility are matched against
+        # its flags, until a word which may be an argument
+        compound_flag = utilities[head].compound_flag
+        for word in words[1:]:
+            if not word.startswith('-') or not plain_word_re.match(word) or \
+                    word in bash.right_associate_unary_logic_operators or \
+                    word in bash.left_associate_unary_logic_operators or \
+                    word in bash.binary_logic_operators:
+                break
+            try:
+                flags, open_argument, argument_only = \
+                    compound_flag.match(word)
+            except ValueError:
+                # including a flag which takes a command, written with its
+                # argument in the same token
+                return 'UnknownFlag'
+            if flags is None or open_argument is not None or argument_only:
+                break
+    return None
+
+# Optional cache of normalized ASTs keyed by (command, recover_quotes), see
+# enable_ast_cache(). Disabled by default.
+ast_cache = None
+_not_cached = object()
+
+
+def enable_ast_cache(maxsize=100000):
+    """
+    Cache the results of normalize_ast in a bounded LRU cache. Callers get a
+    copy of the cached tree, so they are free to modify it.
+    """
+    global ast_cache
+    if ast_cache is None or ast_cache.maxsize != maxsize:
+        ast_cache = butils.lrucache(maxsize)
+    return ast_cache
+
+
+def disable_ast_cache():
+    global ast_cache
+    ast_cache = None
+
+
 def normalize_ast(cmd, recover_quotes=True, verbose=False):
     """
     Convert the bashlex parse tree of a command into the normalized form.
 
+    The result is served from ast_cache if the cache is enabled, except in
+    verbose mode where the command is always parsed to report errors.
+
     :param cmd: bash command to parse
     :param recover_quotes: if set, retain quotation marks in the command
     :param verbose: if set, print error message.
     :return normalized_tree
     """
+    cache = ast_cache
+    if cache is None or verbose:
+        return _normalize_ast(cmd, recover_quotes, verbose)
+    key = (cmd, recover_quotes)
+    tree = cache.get(key, _not_cached)
+    if tree is _not_cached:
+        tree = _normalize_ast(cmd, recover_quotes, verbose)
+        cache.put(key, tree)
+    return copy_tree(tree)
+
+
+def _normalize_ast(cmd, recover_quotes=True, verbose=False, failure=None):
     cmd = cmd.replace('\n', ' ').strip()
     cmd = clean_and_normalize(cmd)
     if not cmd:
+        if failure is not None:
+            failure.append('EmptyCommand')
         return None
 
     def is_unary_logic_op(node, parent):
@@ -261,8 +557,7 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
         return norm_node
 
     def normalize_command(node, current=None):
-        bash_grammar = BashGrammar()
-        bash_grammar.name2type = bg.name2type
+        bash_grammar = get_grammar().cursor()
 
         if not node or not node.parts:
             return
@@ -283,7 +578,7 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
                 current.add_child(head)
 
             # If utility grammar is not known, parse into a simple two-level tree
-            if not bg.consume(token):
+            if not token in bash_grammar.grammar:
                 raise errors.LintParsingError(
                     "Warning: grammar not found - utility {}".format(token), num_tokens, 0)
                 for bast_node in input[1:]:
@@ -302,7 +597,6 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
                 return
 
             current, i = head, 1
-            bash_grammar.grammar = {head.value: copy.deepcopy(bg.grammar[head.value])}
             bash_grammar.consume(head.value)
 
             while i < len(input):
@@ -719,11 +1013,11 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
             # not supported
             raise ValueError("Unsupported: %s" % node.kind)
 
-    tree = safe_bashlex_parse(cmd, verbose=verbose)
+    tree = safe_bashlex_parse(cmd, verbose=verbose, failure=failure)
     if tree is None:
         return tree
 
-    normalized_tree = Node(kind="root")
+    normalized_tree = RootNode()
     try:
         normalize(tree[0], normalized_tree)
     except ValueError as err:
@@ -19,7 +19,71 @@ def make_sibling(lsb, rsb):
     if rsb:
         rsb.lsb = lsb
 
+_slot_names = {}
+
+def slot_names(cls):
+    """
+    Names of the slots of a node class, including the inherited ones.
+    """
+    try:
+        return _slot_names[cls]
+    except KeyError:
+        names = []
+        for c in reversed(cls.__mro__):
+            slots = c.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            for name in slots:
+                if not name in names:
+                    names.append(name)
+        _slot_names[cls] = names = tuple(names)
+        return names
+
+def copy_tree(node):
+    """
+    Copy an AST, a much cheaper alternative to copy.deepcopy.
+
+    Every node of the tree is copied and the parent and sibling pointers are
+    redirected to the copies. Pointers to nodes outside of the tree are kept
+    as they are.
+    """
+    if node is None:
+        return None
+
+    copies = {}
+
+    def copy_node_fun(node):
+        cls = node.__class__
+        new_node = cls.__new__(cls)
+        for name in slot_names(cls):
+            setattr(new_node, name, getattr(node, name))
+        if hasattr(node, '__dict__'):
+            new_node.__dict__.update(node.__dict__)
+        copies[id(node)] = new_node
+        new_node.children = [copy_node_fun(child) for child in node.children]
+        if isinstance(node, UtilityNode):
+            new_node.arg_dict = dict(
+                (key, collections.defaultdict(int, value))
+                for key, value in node.arg_dict.items())
+        elif isinstance(node, ArgumentNode) and node.list_members is not None:
+            new_node.list_members = list(node.list_members)
+        elif isinstance(node, RootNode) and node.hashes is not None:
+            new_node.hashes = dict(node.hashes)
+        return new_node
+
+    new_root = copy_node_fun(node)
+    for new_node in copies.values():
+        new_node.parent = copies.get(id(new_node.parent), new_node.parent)
+        new_node.lsb = copies.get(id(new_node.lsb), new_node.lsb)
+        new_node.rsb = copies.get(id(new_node.rsb), new_node.rsb)
+    return new_root
+
+
 class Node(object):
+    # nodes only carry the members documented in __init__, subclasses which
+    # do not declare __slots__ store additional members in a __dict__
+    __slots__ = ('parent', 'lsb', 'rsb', 'kind', 'value', 'children')
+
     num_child = -1          # number of children taken by node
                             # -1 indicates "any number of"
     children_types = []     # list of compatible types of children
@@ -155,8 +219,25 @@ class Node(object):
     def grandparent(self):
         return self.parent.parent
 
+class RootNode(Node):
+    __slots__ = ('hashes',)
+
+    def __init__(self, value=''):
+        """
+        :member hashes: structural hashes of the tree computed by
+            bashlint.ast_hash, keyed by their options
+        """
+        super(RootNode, self).__init__(kind="root", value=value)
+        self.hashes = None
+
 class UtilityNode(Node):
+    __slots__ = ('arg_dict',)
+
     def __init__(self, value='', parent=None, lsb=None):
+        """
+        :member arg_dict: number of arguments of each type taken by the
+            utility ('') and by each of its flags
+        """
         super(UtilityNode, self).__init__(parent, lsb, "utility", value)
         self.arg_dict = {'': collections.defaultdict(int)}
 
@@ -180,6 +261,8 @@ class UtilityNode(Node):
                 return child
 
 class FlagNode(Node):
+    __slots__ = ()
+
     def __init__(self, value='', parent=None, lsb=None):
         super(FlagNode, self).__init__(parent, lsb, "flag", value)
 
@@ -202,10 +285,19 @@ class FlagNode(Node):
         return self.value.startswith('--')
 
 class ArgumentNode(Node):
+    __slots__ = ('arg_type', 'index', 'list_separator', 'list_members')
+
     num_child = 0
 
     def __init__(self, value='', arg_type='', parent=None, lsb=None,
                  list_members=None, list_separator=None):
+        """
+        :member arg_type: semantic type of the argument
+        :member index: position of the argument among the arguments of the
+            same type taken by its parent
+        :member list_separator: separator of a list argument
+        :member list_members: members of a list argument
+        """
         super(ArgumentNode, self).__init__(parent, lsb, "argument", value)
         self.arg_type = arg_type
         self.index = 1
@@ -247,6 +339,8 @@ class ArgumentNode(Node):
         self.index = ind
 
 class OperatorNode(Node):
+    __slots__ = ()
+
     num_child = 0
 
     def __init__(self, value='', parent=None, lsb=None):
@@ -254,6 +348,8 @@ class OperatorNode(Node):
             parent, lsb, kind='operator', value=value)
 
 class UnaryLogicOpNode(Node):
+    __slots__ = ('associate',)
+
     num_child = 1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
     LEFT = 0
@@ -269,6 +365,8 @@ class UnaryLogicOpNode(Node):
             raise ValueError("Unrecognized unary logic operator: {}".format(value))
 
 class BinaryLogicOpNode(Node):
+    __slots__ = ()
+
     num_child = -1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
 
@@ -276,6 +374,8 @@ class BinaryLogicOpNode(Node):
         super(BinaryLogicOpNode, self).__init__(parent, lsb, 'binarylogicop', value)
 
 class BracketNode(Node):
+    __slots__ = ()
+
     num_child = -1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
 
@@ -283,18 +383,24 @@ class BracketNode(Node):
         super(BracketNode, self).__init__(parent, lsb, 'bracket', '')
 
 class RedirectNode(Node):
+    __slots__ = ()
+
     num_child = 2
 
     def __init__(self, value='', parent=None, lsb=None):
         super(RedirectNode, self).__init__(parent, lsb, 'redirect', value)
 
 class PipelineNode(Node):
+    __slots__ = ()
+
     children_types = [set(['utility'])]
 
     def __init__(self, parent=None, lsb=None):
         super(PipelineNode, self).__init__(parent, lsb, 'pipeline')
 
 class CommandSubstitutionNode(Node):
+    __slots__ = ()
+
     num_child = 1
     children_types = [set(['pipe', 'utility'])]
 
@@ -303,6 +409,8 @@ class CommandSubstitutionNode(Node):
         self.kind = "commandsubstitution"
 
 class ProcessSubstitutionNode(Node):
+    __slots__ = ()
+
     num_child = 1
     children_types = [set(['pipe', 'utility'])]
 
@@ -313,3 +421,41 @@ class ProcessSubstitutionNode(Node):
             self.value = value
         else:
             raise ValueError("Value of a processsubstitution has to be '<' or '>'.")
+
+def make_node(kind, value='', arg_type='', list_separator=None):
+    """
+    Create a detached node of the given kind.
+    """
+    if kind == 'root':
+        node = RootNode()
+    elif kind == 'utility':
+        node = UtilityNode(value)
+    elif kind == 'flag':
+        node = FlagNode(value)
+    elif kind == 'argument':
+        if list_separator is None:
+            node = ArgumentNode(value, arg_type=arg_type)
+        else:
+            node = ArgumentNode(value, arg_type=arg_type,
+                                list_members=value.split(list_separator),
+                                list_separator=list_separator)
+    elif kind == 'operator':
+        node = OperatorNode(value)
+    elif kind == 'unarylogicop':
+        node = UnaryLogicOpNode(value)
+    elif kind == 'binarylogicop':
+        node = BinaryLogicOpNode(value)
+    elif kind == 'bracket':
+        node = BracketNode()
+    elif kind == 'redirect':
+        node = RedirectNode(value)
+    elif kind == 'pipeline':
+        node = PipelineNode()
+    elif kind == 'commandsubstitution':
+        node = CommandSubstitutionNode()
+    elif kind == 'processsubstitution':
+        node = ProcessSubstitutionNode(value)
+    else:
+        node = Node(kind=kind)
+    node.value = value
+    return node
@@ -2,6 +2,62 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from bashlint import flags, butils
+import copy
+
+from bashlint import flags, butils, errors
 
 parserstate = lambda: butils.typedset(flags.parser)
+
+class parsebudget(object):
+    '''limits on the work done to parse one input, shared with the parses of
+    its command substitutions. a parse which goes over them fails at once
+    with an errors.ParseBudgetError, so that garbage input (e.g. a candidate
+    of a beam search) cannot take long or exhaust the stack. a limit of None
+    is not checked.
+
+    maxsteps - the number of tokens plus the number of characters read in
+    matched pairs (quotes, $(..), ${..}, ...) and in expanded words by the
+    parse and the nested parses
+    stepsperchar - steps allowed on top of maxsteps for each character of
+    the input, so that long but ordinary inputs are not rejected
+    maxnesting - the depth of the matched pairs nested in one another
+    maxexpansion - the depth of the parses of command and process
+    substitutions nested in one another, like expansionlimit but failing
+    the parse instead of leaving the substitutions unexpanded
+
+    bparser.parse works on a copy of the budget (see forinput), so a budget
+    can be reused for any number of parses.
+    '''
+    def __init__(self, maxsteps=None, maxnesting=None, maxexpansion=None,
+                 stepsperchar=None):
+        self.maxsteps = maxsteps
+        self.maxnesting = maxnesting
+        self.maxexpansion = maxexpansion
+        self.stepsperchar = stepsperchar
+        self.steps = 0
+
+    def forinput(self, s):
+        '''a fresh copy of the budget for parsing s'''
+        budget = copy.copy(self)
+        if budget.maxsteps is not None and budget.stepsperchar:
+            budget.maxsteps += budget.stepsperchar * len(s)
+        return budget
+
+    def spend(self, steps, s, position):
+        self.steps += steps
+        if self.maxsteps is not None and self.steps > self.maxsteps:
+            raise errors.ParseBudgetError(
+                'parse took more than %d steps' % self.maxsteps, s,
+                position)
+
+    def checknesting(self, depth, s, position):
+        if self.maxnesting is not None and depth > self.maxnesting:
+            raise errors.ParseBudgetError(
+                'more than %d nested quotes or brackets' % self.maxnesting,
+                s, position)
+
+    def checkexpansion(self, depth, s, position):
+        if self.maxexpansion is not None and depth > self.maxexpansion:
+            raise errors.ParseBudgetError(
+                'more than %d nested substitutions' % self.maxexpansion, s,
+                position)
@@ -3,9 +3,14 @@ from __future__ import division
 from __future__ import print_function
 
 import copy
+import re
 
 from bashlint import bast, flags, tokenizer, errors
 
+# characters which start an expansion or a quoted string in a word (double
+# quotes are simply removed)
+_expansionchars = re.compile(r'[<>~$`\\\']')
+
 def _recursiveparse(parserobj, base, sindex, tokenizerargs=None):
     # TODO: fix this hack that prevents mutual import
     from bashlint import bparser
@@ -22,8 +27,12 @@ def _recursiveparse(parserobj, base, sindex, tokenizerargs=None):
     newlimit = parserobj._expansionlimit
     if newlimit is not None:
         newlimit -= 1
+    depth = parserobj._depth + 1
+    if parserobj._budget is not None:
+        parserobj._budget.checkexpansion(depth, base, sindex)
     p = bparser._parser(string, tokenizerargs=tokenizerargs,
-                        expansionlimit=newlimit)
+                        expansionlimit=newlimit, budget=parserobj._budget,
+                        depth=depth)
     node = p.parse()
 
     endp = node.pos[1]
@@ -161,6 +170,9 @@ def _paramexpand(parserobj, string, sindex):
         # XXX 7863
         # TODO not start enough, doesn't consider escaping
         zindex = string.find('}', zindex + 1)
+        if zindex == -1:
+            raise errors.ParsingError('bad substitution: no closing "}"',
+                                      string, sindex)
         node = bast.node(kind='parameter', value=string[sindex + 2:zindex],
                          pos=(sindex, zindex+1))
         # TODO
@@ -197,11 +209,15 @@ def _adjustpositions(node_, base, endlimit):
 
 def _expandwordinternal(parserobj, wordtoken, qheredocument, qdoublequotes, quoted, isexp):
     # bash/subst.c L8132
+    string = wordtoken.value
+    if not _expansionchars.search(string):
+        # nothing to expand
+        return [], string.replace('"', '')
+
     istring = ''
     parts = []
     tindex = [0]
     sindex = [0]
-    string = wordtoken.value
     def nextchar():
         sindex[0] += 1
         if sindex[0] < len(string):
@@ -210,10 +226,13 @@ def _expandwordinternal(parserobj, wordtoken, qheredocument, qdoublequotes, quot
         if sindex[0]+1 < len(string):
             return string[sindex[0]+1]
 
+    budget = parserobj._budget
     while True:
         if sindex[0] == len(string):
             break
             # goto finished_with_string
+        if budget is not None:
+            budget.spend(1, string, sindex[0])
         c = string[sindex[0]]
         if c in '<>':
             if (nextchar() != '(' or qheredocument or qdoublequotes or
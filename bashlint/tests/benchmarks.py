@@ -0,0 +1,642 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Micro-benchmarks for the bash parser.
+
+Usage:
+    python -m bashlint.tests.benchmarks <benchmark> [args]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+
+import bashlint
+from bashlint import bparser, flat, hashcons, lint, nast, state, subst, \
+    tokenizer, yacc
+
+corpus_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data',
+                           'bash', 'all.cm')
+beam_dumps = os.path.join(os.path.dirname(__file__), '..', '..', 'model',
+                          'seq2seq', '*', 'predictions.beam_search.*')
+
+
+def load_corpus(input_file=corpus_path):
+    with open(input_file) as f:
+        return [cmd.rstrip('\n') for cmd in f]
+
+
+def report(name, seconds, repeat):
+    print('{:<40s} {:10.3f} ms'.format(name, seconds / repeat * 1000))
+
+
+def parse_or_none(cmd):
+    try:
+        return bparser.parse(cmd)
+    except Exception:
+        return None
+
+
+def sequential_clean_and_normalize(cmd):
+    """
+    The chain of rewrites clean_and_normalize used to apply one after another.
+    """
+    # special normalization for certain commands
+    ## remove all "sudo"'s
+    cmd = cmd.replace("sudo", "")
+
+    ## normalize utilities called with full path
+    cmd = cmd.replace("/usr/bin/find", "find")
+    cmd = cmd.replace("/bin/find", "find")
+    cmd = cmd.replace("/usr/bin/grep", "grep")
+    cmd = cmd.replace("/bin/rm", "rm")
+    cmd = cmd.replace("/bin/mv", "mv")
+
+    ## correct common typos
+    cmd = cmd.replace("'{}'", "{}")
+    cmd = cmd.replace("\"{}\"", "{}")
+    cmd = cmd.replace("-i{}", "-I {}")
+    cmd = cmd.replace("-i%", "-I %")
+    cmd = cmd.replace("-I{}", "-I {}")
+    cmd = cmd.replace(" [] ", " {} ")
+    cmd = cmd.replace("-L.", "-L")
+    cmd = cmd.replace("-mitime", "-mtime")
+    cmd = cmd.replace("-dev", "-xdev")
+    cmd = cmd.replace("-regex-type", "-regextype")
+    cmd = cmd.replace(" ( ", " \\( ")
+    cmd = cmd.replace(" ) ", " \\) ")
+    cmd = cmd.replace("-\\(", "\\(")
+    cmd = cmd.replace("-\\)", "\\)")
+    cmd = cmd.replace("\"\\)", " \\)")
+    cmd = cmd.replace("\\(-", "\\( -")
+    cmd = cmd.replace("e\\)", "e \\)")
+    cmd = cmd.replace("-\\!", "!")
+    try:
+        cmd = cmd.replace("— ", "-")
+        cmd = cmd.replace("–", "-")
+        cmd = cmd.replace("—", "-")
+        cmd = cmd.replace("“", '"')
+        cmd = cmd.replace("”", '"')
+        cmd = cmd.replace("-\xd0\xbe", "-o")
+        cmd = cmd.replace("\xe2\x80\x93 ", "-")
+        cmd = cmd.replace('‘', '\'')
+        cmd = cmd.replace('’', '\'')
+    except UnicodeDecodeError:
+        cmd = cmd.replace("— ".decode('utf-8'), "-")
+        cmd = cmd.replace("–".decode('utf-8'), "-")
+        cmd = cmd.replace("—".decode('utf-8'), "-")
+        cmd = cmd.replace("“".decode('utf-8'), '"')
+        cmd = cmd.replace("”".decode('utf-8'), '"')
+        cmd = cmd.replace("\xd0\xbe".decode('utf-8'), "o")
+        cmd = cmd.replace("\xe2\x80\x93 ".decode('utf-8') , "-")
+        cmd = cmd.replace('‘'.decode('utf-8'), '\'')
+        cmd = cmd.replace('’'.decode('utf-8'), '\'')
+
+    # more typo fixes
+    cmd = re.sub("-prin($| )", '-print', cmd)
+    cmd = cmd.replace("/bin/echo", "echo")
+    cmd = cmd.replace(" exec sed ", " -exec sed ")
+    cmd = cmd.replace(" xargs -iname ", " xargs ")
+    cmd = cmd.replace(" -chour +1 ", " -cmin 60 ")
+    cmd = cmd.replace(" -target-directory ", " --target-directory=")
+    cmd = cmd.replace("- perm", "-perm")
+    cmd = cmd.replace(" perm", " -perm")
+    cmd = cmd.replace("'-rd\\n' ", '')
+
+    ## remove shell character
+    if cmd.startswith("$ "):
+        cmd = re.sub("^\$ ", '', cmd)
+    if cmd.startswith("# "):
+        cmd = re.sub("^\# ", '', cmd)
+    if cmd.startswith("$find "):
+        cmd = re.sub("^\$find ", "find ", cmd)
+    if cmd.startswith("#find "):
+        cmd = re.sub("^\#find ", "find ", cmd)
+
+    ## the first argument of "tar" is always interpreted as an option
+    tar_fix = re.compile(' tar \w')
+    if cmd.startswith('tar'):
+        cmd = ' ' + cmd
+    for w in re.findall(tar_fix, cmd):
+        cmd = cmd.replace(w, w.replace(' tar ', ' tar -'))
+    cmd = cmd.strip()
+
+    return cmd
+
+
+def bench_rewrite(input_file=corpus_path, repeat=3):
+    """
+    Check that clean_and_normalize rewrites every command of the corpus the
+    same way as the sequential chain of rewrites, and compare their speed.
+    """
+    repeat = int(repeat)
+    cmds = load_corpus(input_file)
+    mismatches = 0
+    for cmd in cmds:
+        expected = sequential_clean_and_normalize(cmd)
+        output = lint.clean_and_normalize(cmd)
+        if output != expected:
+            mismatches += 1
+            print('{}\n  expected: {}\n  output:   {}'.format(
+                cmd, expected, output))
+    print('{} / {} commands rewritten differently'.format(
+        mismatches, len(cmds)))
+
+    def sequential():
+        for cmd in cmds:
+            sequential_clean_and_normalize(cmd)
+
+    def single_pass():
+        for cmd in cmds:
+            lint.clean_and_normalize(cmd)
+
+    report('sequential rewrites', timeit.timeit(sequential, number=repeat),
+           repeat)
+    report('single-pass rewrites', timeit.timeit(single_pass, number=repeat),
+           repeat)
+    return mismatches
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(child) for child in node.children)
+
+
+def bench_memory(input_file=corpus_path):
+    """
+    Measure the memory held by the normalized ASTs of the whole corpus and
+    the time it takes to copy them.
+    """
+    import gc
+    import tracemalloc
+
+    asts = [ast for ast in (lint.normalize_ast(cmd)
+                            for cmd in load_corpus(input_file))
+            if ast is not None]
+    num_nodes = sum(count_nodes(ast) for ast in asts)
+
+    # measure the memory taken by a copy of the ASTs
+    gc.collect()
+    tracemalloc.start()
+    copies = [nast.copy_tree(ast) for ast in asts]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copies
+    print('{} ASTs, {} nodes, {:.1f} MB, {:.0f} bytes per node'.format(
+        len(asts), num_nodes, size / 2**20, size / num_nodes))
+
+    def copy():
+        for ast in asts:
+            nast.copy_tree(ast)
+
+    report('copy {} ASTs'.format(len(asts)), timeit.timeit(copy, number=1), 1)
+
+
+def bench_flat(input_file=corpus_path):
+    """
+    Flatten the normalized ASTs of the corpus into array-backed trees and
+    compare the pickled size of both forms.
+    """
+    import pickle
+
+    asts = [ast for ast in (lint.normalize_ast(cmd)
+                            for cmd in load_corpus(input_file))
+            if ast is not None]
+    strings = flat.StringTable()
+    start = timeit.default_timer()
+    trees = [flat.FlatTree.from_tree(ast, strings) for ast in asts]
+    report('flatten {} ASTs'.format(len(asts)),
+           timeit.default_timer() - start, 1)
+    start = timeit.default_timer()
+    for tree in trees:
+        tree.to_tree()
+    report('rebuild {} ASTs'.format(len(asts)),
+           timeit.default_timer() - start, 1)
+    print('pickled ASTs: {:.1f} MB, pickled flat trees: {:.1f} MB'.format(
+        len(pickle.dumps(asts, 2)) / 2**20,
+        len(pickle.dumps(trees, 2)) / 2**20))
+
+
+def bench_views(input_file=corpus_path, repeat=3):
+    """
+    Compare linearizing every AST of the corpus once per view against
+    producing all views in one traversal.
+    """
+    repeat = int(repeat)
+    asts = [ast for ast in (lint.normalize_ast(cmd)
+                            for cmd in load_corpus(input_file))
+            if ast is not None]
+    views = {
+        'string': {},
+        'template': {'arg_type_only': True},
+        'content': {'arg_type_only': True, 'with_prefix': True,
+                    'with_flag_argtype': True},
+        'sorted': {'ignore_flag_order': True}
+    }
+
+    def one_view_at_a_time():
+        for ast in asts:
+            for options in views.values():
+                bashlint.ast2tokens(ast, loose_constraints=True, **options)
+
+    def all_views():
+        for ast in asts:
+            bashlint.ast2views(ast, views, loose_constraints=True)
+
+    report('{} views, one traversal each'.format(len(views)),
+           timeit.timeit(one_view_at_a_time, number=repeat), repeat)
+    report('{} views, one traversal'.format(len(views)),
+           timeit.timeit(all_views, number=repeat), repeat)
+
+
+def bench_hashcons(input_file=corpus_path):
+    """
+    Intern the normalized ASTs of the corpus in a SubtreeStore and compare
+    the memory held by the store with the memory held by the ASTs.
+    """
+    import gc
+    import tracemalloc
+
+    asts = [lint.normalize_ast(cmd) for cmd in load_corpus(input_file)]
+    num_nodes = sum(count_nodes(ast) for ast in asts if ast is not None)
+
+    gc.collect()
+    tracemalloc.start()
+    copies = [nast.copy_tree(ast) for ast in asts]
+    gc.collect()
+    ast_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copies
+
+    gc.collect()
+    tracemalloc.start()
+    store = hashcons.SubtreeStore(track_occurrences=False)
+    for ast in asts:
+        store.add(ast)
+    gc.collect()
+    store_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print('{} nodes, {} distinct subtrees'.format(num_nodes, len(store)))
+    print('ASTs: {:.1f} MB, subtree store: {:.1f} MB'.format(
+        ast_size / 2**20, store_size / 2**20))
+
+
+def bench_corpus(input_file=corpus_path):
+    """
+    Compare parsing the corpus against building a parsed corpus store once
+    and reopening it.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'all.cm')
+        shutil.copy(input_file, path)
+        cmds = [cmd.strip() for cmd in load_corpus(path)]
+
+        def parse():
+            for cmd in cmds:
+                lint.normalize_ast(cmd)
+
+        report('parse {} commands'.format(len(cmds)),
+               timeit.timeit(parse, number=1), 1)
+        report('build the store', timeit.timeit(
+            lambda: bashlint.load_parsed_corpus(path, workers=1).close(),
+            number=1), 1)
+        start = timeit.default_timer()
+        asts = bashlint.load_parsed_corpus(path)
+        report('open the store', timeit.default_timer() - start, 1)
+        report('read {} ASTs'.format(len(asts)),
+               timeit.timeit(lambda: list(asts), number=1), 1)
+        asts.close()
+        print('store: {:.1f} MB'.format(
+            os.path.getsize(path + '.ast') / 2**20))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def bench_startup(repeat=10):
+    """
+    Compare building the LALR tables from the grammar against loading the
+    prebuilt table file shipped with bashlint.
+    """
+    errorlog = yacc.NullLogger()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        def build():
+            tabfile = os.path.join(tmpdir, 'parsetab.pickle')
+            if os.path.exists(tabfile):
+                os.remove(tabfile)
+            yacc.yacc(module=bparser, picklefile=tabfile, debug=False,
+                      errorlog=errorlog)
+
+        def load():
+            yacc.yacc(module=bparser, picklefile=bparser.tabfile, debug=False,
+                      errorlog=errorlog)
+
+        report('build LALR tables', timeit.timeit(build, number=repeat),
+               repeat)
+        report('load prebuilt LALR tables', timeit.timeit(load, number=repeat),
+               repeat)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_tokenize(input_file=corpus_path, repeat=3):
+    """
+    Tokenize the corpus commands with and without the fast path which reads
+    the inputs made of plain words and operators at once.
+    """
+    repeat = int(repeat)
+    cmds = load_corpus(input_file)
+    plain = [cmd for cmd in cmds
+             if tokenizer.tokenizer(cmd, state.parserstate())._scanplaininput()]
+
+    def tokenize(cmds):
+        def run():
+            for cmd in cmds:
+                try:
+                    list(tokenizer.tokenizer(cmd, state.parserstate()))
+                except Exception:
+                    pass
+        return run
+
+    print('{} of {} commands take the fast path'.format(len(plain), len(cmds)))
+    scan = tokenizer.tokenizer._scanplaininput
+    for name in ('full tokenizer', 'fast path'):
+        if name == 'full tokenizer':
+            tokenizer.tokenizer._scanplaininput = lambda self: False
+        else:
+            tokenizer.tokenizer._scanplaininput = scan
+        report('{}, all commands'.format(name),
+               timeit.timeit(tokenize(cmds), number=repeat), repeat)
+        report('{}, plain commands'.format(name),
+               timeit.timeit(tokenize(plain), number=repeat), repeat)
+
+
+def bench_tokens(input_file=corpus_path):
+    """
+    Measure the memory held by the tokens of the corpus commands and the
+    peak memory allocated while tokenizing them.
+    """
+    import gc
+    import tracemalloc
+
+    cmds = load_corpus(input_file)
+
+    def tokenize():
+        tokens = []
+        for cmd in cmds:
+            try:
+                tokens.append(list(tokenizer.tokenizer(cmd, state.parserstate())))
+            except Exception:
+                pass
+        return tokens
+
+    # compile the regular expressions and fill the caches first
+    tokenize()
+    gc.collect()
+    tracemalloc.start()
+    start = timeit.default_timer()
+    tokens = tokenize()
+    seconds = timeit.default_timer() - start
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    num_tokens = sum(len(t) for t in tokens)
+    report('tokenize {} commands (traced)'.format(len(tokens)), seconds, 1)
+    print('{} tokens: {:.0f} bytes per token, peak {:.1f} MB'.format(
+        num_tokens, size / num_tokens, peak / 2**20))
+
+
+def bench_parse(input_file=corpus_path, repeat=3):
+    """
+    Parse every command of the corpus one at a time, then parse all commands
+    the parser accepts as a single multi-line input.
+    """
+    repeat = int(repeat)
+    cmds = load_corpus(input_file)
+    # keep the commands that still parse as a separate node when followed
+    # by another line
+    script = '\n'.join(cmd for cmd in cmds
+                       if '\n' not in cmd and
+                       len(parse_or_none(cmd + '\nls') or []) == 2)
+
+    def parse_each():
+        for cmd in cmds:
+            parse_or_none(cmd)
+
+    def parse_script():
+        bparser.parse(script)
+
+    report('parse {} commands'.format(len(cmds)),
+           timeit.timeit(parse_each, number=repeat), repeat)
+    report('parse {} line script'.format(script.count('\n') + 1),
+           timeit.timeit(parse_script, number=repeat), repeat)
+
+
+def bench_expand(input_file=corpus_path, repeat=3):
+    """
+    Parse the corpus commands with and without the check which skips the
+    expansion of the words that contain no expansion or quoting character.
+    """
+    repeat = int(repeat)
+    cmds = load_corpus(input_file)
+
+    def parse_each():
+        for cmd in cmds:
+            parse_or_none(cmd)
+
+    # build the parser first
+    parse_each()
+    expansionchars = subst._expansionchars
+    for name in ('expand every word', 'skip plain words'):
+        if name == 'expand every word':
+            # the empty pattern matches every word
+            subst._expansionchars = re.compile('')
+        else:
+            subst._expansionchars = expansionchars
+        report('{}, parse {} commands'.format(name, len(cmds)),
+               timeit.timeit(parse_each, number=repeat), repeat)
+
+
+def adversarial_inputs(seed=0, num_random=500):
+    """
+    Inputs built to make the parser recurse or backtrack: deeply nested and
+    unbalanced quotes, brackets and substitutions, and random sequences of
+    such fragments.
+    """
+    inputs = []
+    for opener, closer in (('$(', ')'), ('"$(', ')"'), ('`', '`'),
+                           ('"`', '`"'), ('${', '}'), ('$[', ']'),
+                           ('(', ')'), ('{ ', ' }'), ('<(', ')'),
+                           ('$(echo ', ')'), ('"$(echo \'', '\')"')):
+        for depth in (10, 100, 1000):
+            inputs.append('echo ' + opener * depth + 'x' + closer * depth)
+            inputs.append('echo ' + opener * depth)
+    # unterminated parameter expansions inside words, which the expansion of
+    # the word (not the tokenizer) reads
+    inputs.extend(["alias h='${history'", 'echo x${y', 'echo "$(echo ${x)"'])
+    fragments = ['$(', ')', '(', '${', '}', '$[', ']', '`', '"', "'", '\\',
+                 '<(', '<<', 'EOF\n', '|', ';', '&&', ' ', 'ls', 'x=']
+    rand = random.Random(seed)
+    for _ in range(num_random):
+        inputs.append(''.join(rand.choice(fragments)
+                              for _ in range(rand.randint(10, 500))))
+    return inputs
+
+
+def bench_fuzz(repeat=3, ceiling=50):
+    """
+    Parse adversarial inputs with the parse budget normalize_ast uses and
+    check that none takes longer than ceiling ms.
+    """
+    repeat, ceiling = int(repeat), float(ceiling)
+    inputs = adversarial_inputs()
+    outcomes = {}
+    worst, worst_input = 0, None
+    for s in inputs:
+        seconds = []
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            try:
+                bparser.parse(s, budget=lint.parse_budget)
+                outcome = 'parsed'
+            except Exception as e:
+                outcome = type(e).__name__
+            seconds.append(timeit.default_timer() - start)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if min(seconds) > worst:
+            worst, worst_input = min(seconds), s
+    for outcome, count in sorted(outcomes.items()):
+        print('{:<40s} {:10d}'.format(outcome, count))
+    report('worst case of {} inputs'.format(len(inputs)), worst, 1)
+    if worst * 1000 > ceiling:
+        print('over the {:.0f} ms ceiling: {!r}'.format(ceiling,
+                                                        worst_input[:80]))
+        sys.exit(1)
+
+
+def load_beam_dumps(pattern=beam_dumps):
+    """
+    The candidates of the saved beam search predictions, "|||"-separated.
+    """
+    candidates = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            for line in f:
+                candidates.extend(c for c in line.rstrip('\n').split('|||')
+                                  if c)
+    return candidates
+
+
+def perturb(cmds, seed=0):
+    """
+    Commands with one word dropped, repeated, swapped or truncated, which
+    look like the ungrammatical candidates of a beam search.
+    """
+    rand = random.Random(seed)
+    perturbed = []
+    for cmd in cmds:
+        words = cmd.split(' ')
+        i, j = rand.randrange(len(words)), rand.randrange(len(words))
+        op = rand.randint(0, 3)
+        if op == 0 and len(words) > 1:
+            del words[i]
+        elif op == 1:
+            words.insert(i, words[j])
+        elif op == 2:
+            words[i], words[j] = words[j], words[i]
+        else:
+            words[i] = words[i][:rand.randint(0, len(words[i]))]
+        perturbed.append(' '.join(words))
+    return perturbed
+
+
+def bench_precheck(input_file=corpus_path, pattern=beam_dumps):
+    """
+    Run lint.precheck and the full normalization on the corpus commands,
+    the saved beam candidates and perturbed corpus commands, and check that
+    precheck never rejects a command the normalization accepts.
+    """
+    cmds = load_corpus(input_file)
+    for name, cmds in (('corpus', cmds),
+                       ('beam candidates', load_beam_dumps(pattern)),
+                       ('perturbed corpus', perturb(cmds))):
+        lint.normalize_ast('true')
+        start = timeit.default_timer()
+        reasons = [lint.precheck(cmd) for cmd in cmds]
+        precheck_seconds = timeit.default_timer() - start
+        start = timeit.default_timer()
+        accepted = [lint.normalize_ast(cmd) is not None for cmd in cmds]
+        normalize_seconds = timeit.default_timer() - start
+
+        counts = {}
+        for reason in reasons:
+            counts[reason] = counts.get(reason, 0) + 1
+        print('{}: {} commands, {} normalized'.format(
+            name, len(cmds), sum(accepted)))
+        for reason, count in sorted(counts.items(), key=lambda x: -x[1]):
+            print('  {:<38s} {:10d}'.format(str(reason), count))
+        report('precheck', precheck_seconds, 1)
+        report('normalize_ast', normalize_seconds, 1)
+        wrong = [cmd for cmd, reason, ok in zip(cmds, reasons, accepted)
+                 if ok and reason is not None]
+        if wrong:
+            print('{} normalized commands rejected, e.g. {!r}'.format(
+                len(wrong), wrong[0]))
+            sys.exit(1)
+
+
+def bench_flags(input_file=corpus_path, repeat=3,
+                utilities='find,tar,rsync'):
+    """
+    Normalize the corpus commands that invoke flag-heavy utilities, which
+    is dominated by matching flag tokens against the grammar.
+    """
+    repeat = int(repeat)
+    utilities = set(utilities.split(','))
+    cmds = [cmd for cmd in load_corpus(input_file)
+            if utilities & set(cmd.split())]
+
+    def normalize():
+        for cmd in cmds:
+            lint.normalize_ast(cmd)
+
+    normalize()
+    report('normalize {} {} commands'.format(
+        len(cmds), '/'.join(sorted(utilities))),
+        timeit.timeit(normalize, number=repeat), repeat)
+
+
+if __name__ == '__main__':
+    benchmarks = {
+        'corpus': bench_corpus,
+        'expand': bench_expand,
+        'flags': bench_flags,
+        'flat': bench_flat,
+        'fuzz': bench_fuzz,
+        'hashcons': bench_hashcons,
+        'memory': bench_memory,
+        'parse': bench_parse,
+        'precheck': bench_precheck,
+        'rewrite': bench_rewrite,
+        'startup': bench_startup,
+        'tokenize': bench_tokenize,
+        'tokens': bench_tokens,
+        'views': bench_views
+    }
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print('Usage: python -m bashlint.tests.benchmarks [{}]'.format(
+            '|'.join(sorted(benchmarks))))
+        sys.exit(1)
+    benchmarks[sys.argv[1]](*sys.argv[2:])
@@ -1,5 +1,12 @@
+import os
+import subprocess
+import sys
+
 from bashlint import *
 
+# seconds spent in "import bashlint", measured with python -X importtime
+IMPORT_TIME_BUDGET = 0.2
+
 
 def batch_parse(input_file):
     """
@@ -54,8 +61,139 @@ def test_bash_tokenizer():
     test(cmd3)
 
 
+def test_import_time():
+    """
+    Check that importing bashlint stays within IMPORT_TIME_BUDGET, prints
+    nothing and neither builds the parser, loads the grammar nor loads NLTK.
+    """
+    check = ('import sys, bashlint; '
+             'assert bashlint.bparser.yaccparser is None; '
+             'assert bashlint.grammar._bg is None; '
+             'assert not "nltk" in sys.modules')
+    root = os.path.join(os.path.dirname(__file__), '..', '..')
+    # compile the modules first so the measure does not include compilation
+    subprocess.check_call([sys.executable, '-c', 'import bashlint'], cwd=root)
+    p = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', check],
+                         cwd=root, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    out, err = p.communicate()
+    assert p.returncode == 0, err
+    assert out == '', out
+    # the last line is the top-level import, "import time: self | cumulative | name"
+    fields = err.strip().splitlines()[-1].split('|')
+    assert fields[-1].strip() == 'bashlint', err
+    seconds = int(fields[1]) / 1e6
+    print('import bashlint: {:.3f} s'.format(seconds))
+    assert seconds < IMPORT_TIME_BUDGET, \
+        'import bashlint took {:.3f} s'.format(seconds)
+
+
+def test_parse_budget():
+    """
+    Check that deeply nested input fails with a ParseBudgetError instead of
+    hitting the recursion limit, and that the budget of normalize_ast does
+    not reject ordinary commands.
+    """
+    from bashlint import bparser, errors, lint, state
+    for s in ('echo ' + '$(' * 2000, 'echo ' + '"$(echo ' * 2000,
+              'echo ' + '$(echo ' * 200 + 'x' + ')' * 200):
+        try:
+            bparser.parse(s, budget=lint.parse_budget)
+        except errors.ParseBudgetError:
+            pass
+        else:
+            assert False, s
+    try:
+        bparser.parse('ls -l | wc -l', budget=state.parsebudget(maxsteps=3))
+    except errors.ParseBudgetError:
+        pass
+    else:
+        assert False
+    cmd = 'find . -name "*.txt" -exec grep -l "$(cat "$(pwd)/pattern")" {} \\;'
+    assert bparser.parse(cmd, budget=lint.parse_budget)
+    # the budget grows with the length of the input
+    for cmd in ('echo $(echo "' + 'a' * 5000 + '")',
+                'find . -name ' + ' '.join(['x'] * 11000)):
+        assert bparser.parse(cmd, budget=lint.parse_budget)
+    assert lint.normalize_ast("alias h='${history'") is None
+
+
+def test_lint_stream():
+    """
+    Check that python -m bashlint writes one record per command, in order.
+    """
+    import io
+    import json
+    from bashlint import batch
+    cmds = ['find . -name "*.txt" | xargs wc -l', 'echo "$(', 'ls -l']
+    out = io.StringIO()
+    errors = batch.lint_stream(io.StringIO(u'\n'.join(cmds) + u'\n'), out,
+                               workers=1)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r['cmd'] for r in records] == cmds
+    assert records[0]['utilities'] == ['find', 'wc', 'xargs']
+    assert records[1]['error'] == 'MatchedPairError'
+    assert errors[None] == 2
+
+
+def test_precheck():
+    """
+    Check the reasons precheck gives and that it lets grammatical commands
+    through (see also the "precheck" benchmark).
+    """
+    for cmd, reason in (('find Path -name Regex | xargs -I {} rm {}', None),
+                        ('ls -Q9', 'UnknownFlag'),
+                        ('sh -cls', 'UnknownFlag'),
+                        ('lss -l', 'UnknownUtility'),
+                        ('echo "a', 'UnbalancedQuotes'),
+                        ('echo $(ls', 'UnbalancedParentheses'),
+                        ('ls && ls', 'MultipleCommands'),
+                        ('echo ${x//(/}', None)):
+        assert precheck(cmd) == reason, cmd
+        if reason is not None:
+            assert bash_parser(cmd) is None, cmd
+
+
+def test_ast_hash():
+    """
+    Check that ast_hash agrees with the template and string comparisons of
+    eval.tree_dist except where the loose templates leave out part of the
+    tree, and that it only ignores the order of the flags.
+    """
+    from eval import tree_dist
+    for cmd1, cmd2 in (('cp a.txt b.txt', 'cp b.txt a.txt'),
+                       ('mv old new', 'mv new old'),
+                       ('grep -r "pat" .', 'grep -r pattern .'),
+                       ('ls -l -a', 'ls -a -l'),
+                       ('find . -type f -name "*.c"',
+                        'find . -name "*.c" -type f')):
+        ast1, ast2 = bash_parser(cmd1), bash_parser(cmd2)
+        for arg_type_only, match in ((False, tree_dist.string_match),
+                                     (True, tree_dist.template_match)):
+            assert (ast_hash(ast1, arg_type_only, ignore_flag_order=False) ==
+                    ast_hash(ast2, arg_type_only, ignore_flag_order=False)) \
+                == match(ast1, ast2), (cmd1, cmd2, arg_type_only)
+    # the template of both is "echo $( pwd )"
+    ast1 = bash_parser('echo `pwd`/`dirname $0`')
+    ast2 = bash_parser('echo "$(pwd)/$(basename "$1")"')
+    assert tree_dist.string_match(ast1, ast2)
+    assert ast_hash(ast1, False) != ast_hash(ast2, False)
+    assert ast_hash(bash_parser('cp a.txt b.txt'), False) != \
+        ast_hash(bash_parser('cp b.txt a.txt'), False)
+    assert ast_hash(bash_parser('grep -r "pat" .')) == \
+        ast_hash(bash_parser('grep -r pattern .'))
+    assert ast_hash(bash_parser('ls -l -a')) == ast_hash(bash_parser('ls -a -l'))
+    assert ast_hash(bash_parser('find . -type f -name "*.c"'), False) == \
+        ast_hash(bash_parser('find . -name "*.c" -type f'), False)
+
+
 if __name__ == "__main__":
     # input_file = sys.argv[1]
     # batch_parse(input_file)
     # test_bash_parser()
-    test_bash_tokenizer()
\ No newline at end of file
+    test_bash_tokenizer()
+    test_import_time()
+    test_parse_budget()
+    test_lint_stream()
+    test_precheck()
+    test_ast_hash()
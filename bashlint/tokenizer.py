@@ -1,4 +1,4 @@
-import re, collections, enum
+import re, collections, enum, types
 
 from bashlint import flags, shutils, butils, errors, heredoc, state
 
@@ -14,6 +14,22 @@ _addsyntax('"`\'', 'quote')
 _addsyntax('$<>', 'exp')
 _addsyntax("()<>;&| \t\n", 'break')
 
+_blanks = re.compile(r'[ \t]*')
+# characters which are neither quotes, expansions, escapes nor word breaks
+_plainchars = re.compile(r'[^\\\'"`$<>();&| \t\n]*')
+# a word made of such characters, followed by a character which ends it
+_plainword = re.compile(r'[^\\\'"`$<>();&| \t\n]+(?=[();&| \t\n]|[<>](?!\())')
+# the lexemes of the inputs which tokenizer._scanplaininput reads at once:
+# blanks, words made of plain characters and quoted strings without escapes
+# or expansions (not comments), newlines and the operators which are read
+# the same whatever the parser state is (no parentheses, heredocs, case
+# terminators or process substitutions)
+_plainlexeme = re.compile(
+    r'(?P<blanks>[ \t]+)|'
+    r'(?P<word>(?!#)(?:[^\\\'"`$<>();&| \t\n]+|\'[^\']*\'|"[^\\"`$]*")+)|'
+    r'(?P<op>&>>?|&&|\|[|&]?|>[>&|]|<[&>]|;(?![;&])|&|<(?![<(])|>(?!\())|'
+    r'(?P<newline>\n)')
+
 def _shellblank(c):
     return c in ' \t'
 
@@ -136,20 +152,31 @@ class MatchedPairError(errors.ParsingError):
 wordflags = flags.word
 parserflags = flags.parser
 
+# the names yacc sees for the token types, our EOF token is its own special
+# one $end
+_typenames = dict((tt, tt.name) for tt in tokentype)
+_typenames[tokentype.EOF] = '$end'
+
+# flags of the tokens which are not words, shared as they are never modified
+_noflags = frozenset()
+
 class token(object):
+    # lexer is set by yacc on the token passed to p_error
+    __slots__ = ('ttype', 'value', 'lexpos', 'endlexpos', 'flags', 'lexer')
+
     def __init__(self, type_, value, pos=None, flags=None):
+        '''pos is the (start, end) pair of the token in the input'''
         if type_ is not None:
             assert isinstance(type_, tokentype)
 
         if flags is None:
-            flags = set()
+            flags = _noflags
 
         self.ttype = type_
 
         self.value = value
         if pos is not None:
-            self.lexpos = pos[0]
-            self.endlexpos = pos[1]
+            self.lexpos, self.endlexpos = pos
             assert self.lexpos < self.endlexpos, (self.lexpos, self.endlexpos)
         else:
             self.lexpos = self.endlexpos = None
@@ -158,12 +185,7 @@ class token(object):
 
     @property
     def type(self):
-        if self.ttype:
-            # make yacc see our EOF token as its own special one $end
-            if self.ttype == tokentype.EOF:
-                return '$end'
-            else:
-                return self.ttype.name
+        return _typenames.get(self.ttype)
 
     def __nonzero__(self):
         return not (self.ttype is None and self.value is None)
@@ -195,22 +217,37 @@ class token(object):
         return self.__class__(self.ttype, self.value, flags=self.flags)
 
 eoftoken = token(tokentype.EOF, None)
+# placeholder for the tokens read before the first one
+_notoken = token(None, None)
 
 class tokenizer(object):
     def __init__(self, s, parserstate, strictmode=True, eoftoken=None,
-                 lastreadtoken=None, tokenbeforethat=None, twotokensago=None):
+                 lastreadtoken=None, tokenbeforethat=None, twotokensago=None,
+                 budget=None):
         self._shell_eof_token = eoftoken
         self._shell_input_line = s
         self._added_newline = False
         if self._shell_input_line and self._shell_input_line[-1] != '\n':
             self._shell_input_line += '\n' # bash/parse.y L2431
             self._added_newline = True
-        self._shell_input_line_index = 0
+        self._strictmode = strictmode
+        # the state.parsebudget of the parse, None if it is not limited
+        self._budget = budget
+
+        self.reset(parserstate, 0, lastreadtoken, tokenbeforethat,
+                   twotokensago)
+
+    def reset(self, parserstate, index=0, lastreadtoken=None,
+              tokenbeforethat=None, twotokensago=None):
+        '''rewind the tokenizer to start reading a new command at index of
+        its input line. positions of the tokens read afterwards are still
+        relative to the start of the input line'''
+        self._shell_input_line_index = index
         # self._shell_input_line_terminator = None
-        self._two_tokens_ago = twotokensago or token(None, None)
-        self._token_before_that = tokenbeforethat or token(None, None)
-        self._last_read_token = lastreadtoken or token(None, None)
-        self._current_token = token(None, None)
+        self._two_tokens_ago = twotokensago or _notoken
+        self._token_before_that = tokenbeforethat or _notoken
+        self._last_read_token = lastreadtoken or _notoken
+        self._current_token = _notoken
 
         # This implements one-character lookahead/lookbehind across physical
         # input lines, to avoid something being lost because it's pushed back
@@ -220,6 +257,11 @@ class tokenizer(object):
         # token waiting to be read
         self._token_to_read = None
 
+        # the tokens of the rest of the input in reverse order if it was read
+        # at once by _scanplaininput, False if it has to be read by
+        # _readtoken, None if not known yet
+        self._plaintokens = None
+
         self._parserstate = parserstate
         self._line_number = 0
         self._open_brace_count = 0
@@ -227,10 +269,8 @@ class tokenizer(object):
 
         self._dstack = []
 
-        # a stack of positions to record the start and end of a token
-        self._positions = []
-
-        self._strictmode = strictmode
+        # the start and end of the token being read
+        self._tokenstart = self._tokenend = None
 
         # hack: the tokenizer needs access to the stack of redirection
         # nodes when it reads heredocs. this instance is shared between
@@ -255,24 +295,25 @@ class tokenizer(object):
 
     def _createtoken(self, type_, value, flags=None):
         '''create a token with position information'''
-        pos = None
-        assert len(self._positions) >= 2, (type_, value)
-        p2 = self._positions.pop()
-        p1 = self._positions.pop()
-        pos = [p1, p2]
-        return token(type_, value, pos, flags)
+        assert self._tokenend is not None, (type_, value)
+        t = token(type_, value, (self._tokenstart, self._tokenend), flags)
+        self._tokenstart = self._tokenend = None
+        return t
 
     def token(self):
         self._two_tokens_ago, self._token_before_that, self._last_read_token = \
             self._token_before_that, self._last_read_token, self._current_token
 
+        if self._budget is not None:
+            self._budget.spend(1, self._shell_input_line,
+                               self._shell_input_line_index)
         self._current_token = self._readtoken()
         if isinstance(self._current_token, tokentype):
-            self._recordpos()
+            self._recordend()
             self._current_token = self._createtoken(self._current_token,
                                                     self._current_token.value)
 
-        if (self._parserstate & parserflags.EOFTOKEN and
+        if (parserflags.EOFTOKEN in self._parserstate and
             self._current_token.ttype == self._shell_eof_token):
             self._current_token = eoftoken
             # bash/parse.y L2626
@@ -289,7 +330,27 @@ class tokenizer(object):
             self._token_to_read = None
             return t
 
+        if self._plaintokens is None:
+            self._plaintokens = self._scanplaininput()
+        if self._plaintokens:
+            t = self._plaintokens.pop()
+            self._shell_input_line_index = t.endlexpos
+            if t.ttype == tokentype.NEWLINE:
+                heredoc.gatherheredocuments(self)
+                self._parserstate.discard(parserflags.ASSIGNOK)
+            elif t.ttype not in (tokentype.WORD, tokentype.NUMBER,
+                                 tokentype.DASH):
+                self._parserstate.discard(parserflags.ASSIGNOK)
+            return t
+        elif self._plaintokens is not False:
+            # all the tokens have been read
+            return eoftoken
+
         # bashlint/parse.y L2989 COND_COMMAND
+        if self._eol_ungetc_lookahead is None:
+            # skip the blanks at once
+            self._shell_input_line_index = _blanks.match(
+                self._shell_input_line, self._shell_input_line_index).end()
         character = self._getc(True)
         while character is not None and _shellblank(character):
             character = self._getc(True)
@@ -302,7 +363,7 @@ class tokenizer(object):
             self._getc(False)
             character = '\n'
 
-        self._recordpos(1)
+        self._recordstart()
 
         if character == '\n':
             # bashlint/parse.y L3034 ALIAS
@@ -311,10 +372,10 @@ class tokenizer(object):
             self._parserstate.discard(parserflags.ASSIGNOK)
             return tokentype(character)
 
-        if self._parserstate & parserflags.REGEXP:
+        if parserflags.REGEXP in self._parserstate:
             return self._readtokenword(character)
 
-        if _shellmeta(character) and not (self._parserstate & parserflags.DBLPAREN):
+        if _shellmeta(character) and not parserflags.DBLPAREN in self._parserstate:
             self._parserstate.discard(parserflags.ASSIGNOK)
             peek_char = self._getc(True)
 
@@ -372,11 +433,11 @@ class tokenizer(object):
                 self._parserstate.add(parserflags.ALLOWOPNBRC)
                 # bashlint/parse.y L3155
 
-            if character == '(' and not self._parserstate & parserflags.CASEPAT:
+            if character == '(' and not parserflags.CASEPAT in self._parserstate:
                 self._parserstate.add(parserflags.SUBSHELL)
-            elif self._parserstate & parserflags.CASEPAT and character == ')':
+            elif parserflags.CASEPAT in self._parserstate and character == ')':
                 self._parserstate.discard(parserflags.CASEPAT)
-            elif self._parserstate & parserflags.SUBSHELL and character == ')':
+            elif parserflags.SUBSHELL in self._parserstate and character == ')':
                 self._parserstate.discard(parserflags.SUBSHELL)
 
             if character not in '<>' or peek_char != '(':
@@ -388,6 +449,14 @@ class tokenizer(object):
         return self._readtokenword(character)
 
     def _readtokenword(self, c):
+        tokenword = self._readplainword(c)
+        if tokenword is not None:
+            # the word is followed by a break character, which is not read
+            c = self._shell_input_line[self._shell_input_line_index]
+            self._recordend()
+            return self._wordtoken(tokenword, c, tokenword.isdigit(),
+                                   False, False, False)
+
         d = {}
         d['all_digit_token'] = c.isdigit()
         d['dollar_present'] = d['quoted'] = d['pass_next_character'] = d['compound_assignment'] = False
@@ -517,6 +586,13 @@ class tokenizer(object):
                         break
                     else:
                         handleescapedchar()
+                        # the characters up to the next quote, expansion,
+                        # escape or break are taken as they are, so consume
+                        # them all at once
+                        run = self._readplainchars()
+                        if run:
+                            tokenword.append(run)
+                            d['all_digit_token'] &= run.isdigit()
 
             # got_character
             # got_escaped_character
@@ -531,11 +607,18 @@ class tokenizer(object):
             c = self._getc(cd != "'" and not d['pass_next_character'])
 
         # got_token
-        self._recordpos()
+        self._recordend()
 
         tokenword = ''.join(tokenword)
-
-        if d['all_digit_token'] and (c in '<>' or self._last_read_token.ttype in (tokentype.LESS_AND, tokentype.GREATER_AND)) and shutils.legal_number(tokenword):
+        return self._wordtoken(tokenword, c, d['all_digit_token'],
+                               d['dollar_present'], d['quoted'],
+                               d['compound_assignment'])
+
+    def _wordtoken(self, tokenword, c, all_digit_token, dollar_present,
+                   quoted, compound_assignment):
+        '''create the token of a word read by _readtokenword, c is the
+        character which follows it'''
+        if all_digit_token and (c in '<>' or self._last_read_token.ttype in (tokentype.LESS_AND, tokentype.GREATER_AND)) and shutils.legal_number(tokenword):
             return self._createtoken(tokentype.NUMBER, int(tokenword))
 
         # bashlint/parse.y L4811
@@ -543,11 +626,11 @@ class tokenizer(object):
         if specialtokentype:
             return self._createtoken(specialtokentype, tokenword)
 
-        if not d['dollar_present'] and not d['quoted'] and self._reserved_word_acceptable(self._last_read_token):
+        if not dollar_present and not quoted and self._reserved_word_acceptable(self._last_read_token):
             if tokenword in valid_reserved_first_command:
                 ttype = valid_reserved_first_command[tokenword]
                 ps = self._parserstate
-                if ps & parserflags.CASEPAT and ttype != tokentype.ESAC:
+                if parserflags.CASEPAT in ps and ttype != tokentype.ESAC:
                     pass
                 elif ttype == tokentype.TIME and not self._time_command_acceptable():
                     pass
@@ -568,22 +651,20 @@ class tokenizer(object):
                 return self._createtoken(ttype, tokenword)
 
         tokenword = self._createtoken(tokentype.WORD, tokenword, butils.typedset(wordflags))
-        if d['dollar_present']:
+        if dollar_present:
             tokenword.flags.add(wordflags.HASDOLLAR)
-        if d['quoted']:
+        if quoted:
             tokenword.flags.add(wordflags.QUOTED)
-        if d['compound_assignment'] and tokenword[-1] == ')':
+        if compound_assignment and tokenword[-1] == ')':
             tokenword.flags.add(wordflags.COMPASSIGN)
-        if self._is_assignment(tokenword.value, bool(self._parserstate & parserflags.COMPASSIGN)):
+        if '=' in tokenword.value and self._is_assignment(tokenword.value, parserflags.COMPASSIGN in self._parserstate):
             tokenword.flags.add(wordflags.ASSIGNMENT)
             if self._assignment_acceptable(self._last_read_token):
                 tokenword.flags.add(wordflags.NOSPLIT)
-                if self._parserstate & parserflags.COMPASSIGN:
+                if parserflags.COMPASSIGN in self._parserstate:
                     tokenword.flags.add(wordflags.NOGLOB)
 
-        # bashlint/parse.y L4865
-        if self._command_token_position(self._last_read_token):
-            pass
+        # bashlint/parse.y L4865 (nothing to do at the command token position)
 
         if tokenword.value[0] == '{' and tokenword.value[-1] == '}' and c in '<>':
             if shutils.legal_identifier(tokenword.value[1:]):
@@ -606,11 +687,69 @@ class tokenizer(object):
 
     def _parse_comsub(self, doublequotes, open, close, parsingcommand=False,
                       dquote=False, firstclose=False):
+        return self._runframes(self._comsubframe(doublequotes, open, close,
+                                                 parsingcommand, dquote,
+                                                 firstclose))
+
+    def _parse_matched_pair(self, doublequotes, open, close, parsingcommand=False, allowesc=False, dquote=False, firstclose=False, dolbrace=False, arraysub=False):
+        return self._runframes(self._matchedpairframe(doublequotes, open, close, parsingcommand, allowesc, dquote, firstclose, dolbrace, arraysub))
+
+    def _runframes(self, frame):
+        '''run the reader of a matched pair or a command substitution.
+
+        the readers are generators: they yield the reader of a nested
+        construct to have it run and its result sent back to them, and yield
+        their own result when they are done. running them off an explicit
+        stack keeps deeply nested (or unbalanced) input from hitting the
+        recursion limit, and lets the parse budget bound the nesting'''
+        budget = self._budget
+        stack = [frame]
+        result = None
+        try:
+            while True:
+                value = stack[-1].send(result)
+                if isinstance(value, types.GeneratorType):
+                    if budget is not None:
+                        budget.checknesting(len(stack) + 1,
+                                            self._shell_input_line,
+                                            self._shell_input_line_index)
+                    stack.append(value)
+                    result = None
+                else:
+                    stack.pop()
+                    if budget is not None:
+                        budget.spend(len(value), self._shell_input_line,
+                                     self._shell_input_line_index)
+                    if not stack:
+                        return value
+                    result = value
+        finally:
+            # run the finally clauses of the readers left on an error
+            while stack:
+                stack.pop().close()
+
+    def _dollarwordframe(self, c, rdquote):
+        '''the reader of the $(..), ${..} or $[..] which c opens'''
+        # bashlint/parse.y L3486
+        if c == '(':
+            return self._comsubframe(None, '(', ')', parsingcommand=True,
+                                     dquote=False)
+        elif c == '{':
+            return self._matchedpairframe(None, '{', '}', firstclose=True,
+                                          dquote=rdquote, dolbrace=True)
+        else:
+            return self._matchedpairframe(None, '[', ']', dquote=rdquote)
+
+    def _comsubframe(self, doublequotes, open, close, parsingcommand=False,
+                     dquote=False, firstclose=False):
+        '''generator frame of _parse_comsub, see _runframes'''
         peekc = self._getc(False)
         self._ungetc(peekc)
 
         if peekc == '(':
-            return self._parse_matched_pair(doublequotes, open, close)
+            nestret = yield self._matchedpairframe(doublequotes, open, close)
+            yield nestret
+            return
 
         count = 1
         dollarok = True
@@ -795,12 +934,12 @@ class tokenizer(object):
                 self._push_delimiter(c)
                 try:
                     if wasdollar and c == "'":
-                        nestret = self._parse_matched_pair(c, c, c,
-                                                           allowesc=True,
-                                                           dquote=True)
+                        nestret = yield self._matchedpairframe(c, c, c,
+                                                               allowesc=True,
+                                                               dquote=True)
                     else:
-                        nestret = self._parse_matched_pair(c, c, c,
-                                                           dquote=True)
+                        nestret = yield self._matchedpairframe(c, c, c,
+                                                               dquote=True)
                 finally:
                     self._pop_delimiter()
 
@@ -819,25 +958,26 @@ class tokenizer(object):
                 if not insidecase and open == c:
                     count -= 1
                 if c == '(':
-                    nestret = self._parse_comsub(None, '(', ')',
-                                                 parsingcommand=True,
-                                                 dquote=False)
+                    nestret = yield self._comsubframe(None, '(', ')',
+                                                      parsingcommand=True,
+                                                      dquote=False)
                 elif c == '{':
-                    nestret = self._parse_matched_pair(None, '{', '}',
-                                                       firstclose=True,
-                                                       dolbrace=True,
-                                                       dquote=True)
+                    nestret = yield self._matchedpairframe(None, '{', '}',
+                                                           firstclose=True,
+                                                           dolbrace=True,
+                                                           dquote=True)
                 elif c == '[':
-                    nestret = self._parse_matched_pair(None, '[', ']',
-                                                       dquote=True)
+                    nestret = yield self._matchedpairframe(None, '[', ']',
+                                                           dquote=True)
 
                 ret += nestret
 
             wasdollar = c == '$'
 
-        return ret
+        yield ret
 
-    def _parse_matched_pair(self, doublequotes, open, close, parsingcommand=False, allowesc=False, dquote=False, firstclose=False, dolbrace=False, arraysub=False):
+    def _matchedpairframe(self, doublequotes, open, close, parsingcommand=False, allowesc=False, dquote=False, firstclose=False, dolbrace=False, arraysub=False):
+        '''generator frame of _parse_matched_pair, see _runframes'''
         count = 1
         dolbracestate = ''
         if dolbrace:
@@ -856,25 +996,6 @@ class tokenizer(object):
 
         ret = ''
 
-        def handledollarword():
-            if open == c:
-                count -= 1
-
-            # bashlint/parse.y L3486
-            if c == '(':
-                return self._parse_comsub(None, '(', ')',
-                                          parsingcommand=True,
-                                          dquote=False)
-            elif c == '{':
-                return self._parse_matched_pair(None, '{', '}',
-                                                firstclose=True,
-                                                dquote=rdquote,
-                                                dolbrace=True)
-            elif c == '[':
-                return self._parse_matched_pair(None, '[', ']', dquote=rdquote)
-            else:
-                assert False # pragma: no cover
-
         while count:
             c = self._getc(doublequotes != "'" and not passnextchar)
             if c is None:
@@ -939,9 +1060,9 @@ class tokenizer(object):
                     self._push_delimiter(c)
                     try:
                         if sawdollar and "'":
-                            nestret = self._parse_matched_pair(c, c, c, parsingcommand=parsingcommand, allowesc=True, dquote=dquote, firstclose=firstclose, dolbrace=dolbrace)
+                            nestret = yield self._matchedpairframe(c, c, c, parsingcommand=parsingcommand, allowesc=True, dquote=dquote, firstclose=firstclose, dolbrace=dolbrace)
                         else:
-                            nestret = self._parse_matched_pair(c, c, c, parsingcommand=parsingcommand, allowesc=allowesc, dquote=dquote, firstclose=firstclose, dolbrace=dolbrace)
+                            nestret = yield self._matchedpairframe(c, c, c, parsingcommand=parsingcommand, allowesc=allowesc, dquote=dquote, firstclose=firstclose, dolbrace=dolbrace)
                     finally:
                         self._pop_delimiter()
 
@@ -954,15 +1075,22 @@ class tokenizer(object):
                     ret += nestret
                 elif arraysub and sawdollar and c in '({[':
                     # goto parse_dollar_word
-                    ret += handledollarword()
+                    if open == c:
+                        count -= 1
+                    nestret = yield self._dollarwordframe(c, rdquote)
+                    ret += nestret
             elif open == '"' and c == '`':
-                ret += self._parse_matched_pair(None, '`', '`', parsingcommand=parsingcommand, allowesc=allowesc, dquote=dquote, firstclose=firstclose, dolbrace=dolbrace)
+                nestret = yield self._matchedpairframe(None, '`', '`', parsingcommand=parsingcommand, allowesc=allowesc, dquote=dquote, firstclose=firstclose, dolbrace=dolbrace)
+                ret += nestret
             elif open != '`' and sawdollar and c in '({[':
-                ret += handledollarword()
+                if open == c:
+                    count -= 1
+                nestret = yield self._dollarwordframe(c, rdquote)
+                ret += nestret
 
             sawdollar = c == '$'
 
-        return ret
+        yield ret
 
 
     def _is_assignment(self, value, iscompassign):
@@ -987,11 +1115,11 @@ class tokenizer(object):
 
     def _command_token_position(self, token):
         return (token.ttype == tokentype.ASSIGNMENT_WORD or
-                self._parserstate & parserflags.REDIRLIST or
+                parserflags.REDIRLIST in self._parserstate or
                 (token.ttype not in (tokentype.SEMI_SEMI, tokentype.SEMI_AND, tokentype.SEMI_SEMI_AND) and self._reserved_word_acceptable(token)))
 
     def _assignment_acceptable(self, token):
-        return self._command_token_position(token) and not self._parserstate & parserflags.CASEPAT
+        return self._command_token_position(token) and not parserflags.CASEPAT in self._parserstate
 
     def _time_command_acceptable(self):
         pass
@@ -1060,10 +1188,15 @@ class tokenizer(object):
         if c is not None:
             self._ungetc(c)
 
-    def _recordpos(self, relativeoffset=0):
-        '''record the current index of the tokenizer into the positions stack
-        while adding relativeoffset from it'''
-        self._positions.append(self._shell_input_line_index - relativeoffset)
+    def _recordstart(self):
+        '''record the index of the character just read as the start of the
+        token being read'''
+        self._tokenstart = self._shell_input_line_index - 1
+
+    def _recordend(self):
+        '''record the current index of the tokenizer as the end of the token
+        being read'''
+        self._tokenend = self._shell_input_line_index
 
     def readline(self, removequotenewline):
         linebuffer = []
@@ -1096,6 +1229,87 @@ class tokenizer(object):
             if c == '\n':
                 return ''.join(linebuffer)
 
+    def _scanplaininput(self):
+        '''if the rest of the input is made of the lexemes matched by
+        _plainlexeme only, tokenize it at once and return the tokens in
+        reverse order. these are the tokens _readtoken would return, given
+        that nothing but the tokens read changes the parser state. return
+        False if the input has to be read by _readtoken'''
+        if (self._shell_eof_token is not None or self._parserstate or
+                self._eol_ungetc_lookahead is not None):
+            return False
+
+        s = self._shell_input_line
+        pos, end = self._shell_input_line_index, len(s)
+        tokens = []
+        last = self._last_read_token.ttype
+        while pos < end:
+            m = _plainlexeme.match(s, pos)
+            if m is None:
+                return False
+            kind = m.lastgroup
+            if kind == 'blanks':
+                pos = m.end()
+                continue
+
+            start, pos = m.span()
+            value = m.group()
+            if kind == 'word':
+                if value[0] == '-' and last in (tokentype.LESS_AND,
+                                                tokentype.GREATER_AND):
+                    if value != '-':
+                        return False
+                    t = token(tokentype.DASH, value, (start, pos))
+                elif (value.isdigit() and
+                      (s[pos] in '<>' or last in (tokentype.LESS_AND,
+                                                  tokentype.GREATER_AND)) and
+                      shutils.legal_number(value)):
+                    t = token(tokentype.NUMBER, int(value), (start, pos))
+                elif (value in valid_reserved_first_command or
+                      ('=' in value and self._is_assignment(value, False)) or
+                      (value[0] == '{' and value[-1] == '}' and
+                       s[pos] in '<>')):
+                    # depends on the parser state
+                    return False
+                else:
+                    t = token(tokentype.WORD, value, (start, pos),
+                              butils.typedset(wordflags))
+                    if "'" in value or '"' in value:
+                        t.flags.add(wordflags.QUOTED)
+            elif kind == 'op':
+                t = token(tokentype(value), value, (start, pos))
+            else:
+                t = token(tokentype.NEWLINE, value, (start, pos))
+            tokens.append(t)
+            last = t.ttype
+
+        tokens.reverse()
+        return tokens
+
+    def _readplainword(self, c):
+        '''if the word starting with c, which has just been read, is made of
+        plain characters only, read it at once and return it. otherwise
+        return None without reading anything'''
+        i = self._shell_input_line_index - 1
+        if (self._eol_ungetc_lookahead is not None or i < 0 or
+                self._shell_input_line[i] != c):
+            return None
+        m = _plainword.match(self._shell_input_line, i)
+        if m is None:
+            return None
+        self._shell_input_line_index = m.end()
+        return m.group()
+
+    def _readplainchars(self):
+        '''read the run of characters starting at the current position which
+        _readtokenword appends to the word without any special handling'''
+        if self._eol_ungetc_lookahead is not None:
+            return ''
+        m = _plainchars.match(self._shell_input_line,
+                              self._shell_input_line_index)
+        self._shell_input_line_index = m.end()
+        return m.group()
+
     def _peekc(self, *args):
         peek_char = self._getc(*args)
         # only unget if we actually read something
@@ -1125,7 +1339,7 @@ class tokenizer(object):
                 self._parserstate.discard(parserflags.CASEPAT)
                 return tokentype.ESAC
 
-        if self._parserstate & parserflags.ALLOWOPNBRC:
+        if parserflags.ALLOWOPNBRC in self._parserstate:
             self._parserstate.discard(parserflags.ALLOWOPNBRC)
             if tokstr == '{':
                 self._open_brace_count += 1
@@ -1153,5 +1367,5 @@ class tokenizer(object):
         if self._last_read_token.ttype == tokentype.TIMEOPT and tokstr == '--':
             return tokentype.TIMEIGN
 
-        if self._parserstate & parserflags.CONDEXPR and tokstr == ']]':
+        if parserflags.CONDEXPR in self._parserstate and tokstr == ']]':
             return tokentype.COND_END
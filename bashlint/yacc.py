@@ -86,9 +86,9 @@ yaccdevel   = 0                # Set to True if developing yacc.  This turns off
 
 resultlimit = 40               # Size limit of results when running in debug mode.
 
-pickle_protocol = 0            # Protocol to use when writing pickle files
+pickle_protocol = 2            # Protocol to use when writing pickle files
 
-import re, types, sys, os.path
+import copy, re, types, sys, os.path
 
 from bashlint import butils
 
@@ -258,6 +258,24 @@ class LRParser:
         self.action      = butils.frozendict(lrtab.lr_action)
         self.goto        = butils.frozendict(lrtab.lr_goto)
         self.errorfunc   = errorf
+        self.statestack  = [ ]
+        self.symstack    = [ ]
+        self.errorok     = 0
+
+    # Return a parser that shares the tables of this one but has its own
+    # parsing stacks, so that both can be used at the same time
+    def clone(self):
+        p = copy.copy(self)
+        p.statestack = [ ]
+        p.symstack   = [ ]
+        p.errorok    = 0
+        return p
+
+    # Empty the parsing stacks so that the parser can be reused
+    def reset(self):
+        del self.statestack[:]
+        del self.symstack[:]
+        self.errorok     = 0
 
     def errok(self):
         self.errorok     = 1
@@ -330,10 +348,9 @@ class LRParser:
 
         # Set up the state and symbol stacks
 
-        statestack = [ ]                # Stack of parsing states
-        self.statestack = statestack
-        symstack   = [ ]                # Stack of grammar symbols
-        self.symstack = symstack
+        self.reset()
+        statestack = self.statestack    # Stack of parsing states
+        symstack   = self.symstack      # Stack of grammar symbols
 
         pslice.stack = symstack         # Put in the production
         errtoken   = None               # Err token
@@ -649,10 +666,9 @@ class LRParser:
 
         # Set up the state and symbol stacks
 
-        statestack = [ ]                # Stack of parsing states
-        self.statestack = statestack
-        symstack   = [ ]                # Stack of grammar symbols
-        self.symstack = symstack
+        self.reset()
+        statestack = self.statestack    # Stack of parsing states
+        symstack   = self.symstack      # Stack of grammar symbols
 
         pslice.stack = symstack         # Put in the production
         errtoken   = None               # Err token
@@ -925,10 +941,9 @@ class LRParser:
 
         # Set up the state and symbol stacks
 
-        statestack = [ ]                # Stack of parsing states
-        self.statestack = statestack
-        symstack   = [ ]                # Stack of grammar symbols
-        self.symstack = symstack
+        self.reset()
+        statestack = self.statestack    # Stack of parsing states
+        symstack   = self.symstack      # Stack of grammar symbols
 
         pslice.stack = symstack         # Put in the production
         errtoken   = None               # Err token
@@ -2704,21 +2719,38 @@ del _lr_goto_items
             import cPickle as pickle
         except ImportError:
             import pickle
-        outf = open(filename,"wb")
-        pickle.dump(__tabversion__,outf,pickle_protocol)
-        pickle.dump(self.lr_method,outf,pickle_protocol)
-        pickle.dump(signature,outf,pickle_protocol)
-        pickle.dump(self.lr_action,outf,pickle_protocol)
-        pickle.dump(self.lr_goto,outf,pickle_protocol)
-
-        outp = []
-        for p in self.lr_productions:
-            if p.func:
-                outp.append((p.str,p.name, p.len, p.func,p.file,p.line))
-            else:
-                outp.append((str(p),p.name,p.len,None,None,None))
-        pickle.dump(outp,outf,pickle_protocol)
-        outf.close()
+        # Write to a temporary file first and move it into place so that
+        # concurrent readers never see a partially written table file.  If
+        # the target directory is not writable the tables are simply not
+        # cached.
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        try:
+            outf = open(tmpname,"wb")
+            pickle.dump(__tabversion__,outf,pickle_protocol)
+            pickle.dump(self.lr_method,outf,pickle_protocol)
+            pickle.dump(signature,outf,pickle_protocol)
+            pickle.dump(self.lr_action,outf,pickle_protocol)
+            pickle.dump(self.lr_goto,outf,pickle_protocol)
+
+            outp = []
+            for p in self.lr_productions:
+                if p.func:
+                    # only keep the base name of the grammar file so the
+                    # table file does not depend on where it was built
+                    outp.append((p.str,p.name, p.len, p.func,os.path.basename(p.file),p.line))
+                else:
+                    outp.append((str(p),p.name,p.len,None,None,None))
+            pickle.dump(outp,outf,pickle_protocol)
+            outf.close()
+            if os.path.exists(filename) and sys.platform.startswith('win'):
+                os.remove(filename)
+            os.rename(tmpname,filename)
+        except (IOError,OSError):
+            e = sys.exc_info()[1]
+            sys.stderr.write("Unable to create '%s'\n" % filename)
+            sys.stderr.write(str(e)+"\n")
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
 
 # -----------------------------------------------------------------------------
 #                            === INTROSPECTION ===
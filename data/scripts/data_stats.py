@@ -11,7 +11,7 @@ import os, sys
 sys.path.append('../../')  # for bashlint
 import re
 
-from bashlint import bash, bash_parser, bash_tokenizer, cmd2template, get_utilities, utility_stats
+from bashlint import bash, bash_parser, bash_tokenizer, ast2template, get_utilities, load_parsed_corpus, utility_stats
 from nlp_tools.tokenizer import basic_tokenizer
 
 
@@ -68,13 +68,14 @@ def compute_cm_stats():
     unique_tokens = set()
     tokens_per_cmd = []
     cmds_per_token = collections.defaultdict(int)
-    with open(input_file) as f:
-        for line in f:
+    asts = load_parsed_corpus(input_file)
+    with open(input_file, encoding='utf-8') as f:
+        for line, ast in zip(f, asts):
             cm = line.strip()
             unique_commands.add(cm)
-            temp = cmd2template(cm, loose_constraints=True)
+            temp = ast2template(ast, loose_constraints=True)
             unique_templates.add(temp)
-            tokens = bash_tokenizer(cm, loose_constraints=True)
+            tokens = bash_tokenizer(ast, loose_constraints=True)
             unique_tokens |= set(tokens)
             tokens_per_cmd.append(len(tokens))
             for token in tokens:
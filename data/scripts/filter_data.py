@@ -10,7 +10,7 @@ from __future__ import print_function
 import collections
 import os, sys
 
-from bashlint import bash, bash_parser, get_utilities
+from bashlint import bash, get_utilities, load_parsed_corpus
 
 data_splits = ['train', 'dev', 'test']
 
@@ -21,14 +21,20 @@ NUM_UTILITIES = 100
 def compute_top_utilities(path, k):
     print('computing top most frequent utilities...') 
     utilities = collections.defaultdict(int)
+    commands = []
     with open(path, encoding='utf-8') as f:
         while (True):
             command = f.readline().strip()
             if not command:
                 break
-            ast = bash_parser(command, verbose=False)
-            for u in get_utilities(ast):
-                utilities[u] += 1
+            commands.append(command)
+    asts = load_parsed_corpus(path)
+    for i in range(len(commands)):
+        ast = asts[i]
+        if ast is None:
+            continue
+        for u in get_utilities(ast):
+            utilities[u] += 1
     top_utilities = []
 
     freq_threshold = -1   
@@ -60,16 +66,17 @@ def filter_by_most_frequent_utilities(data_dir, num_utilities):
         nls = [nl.strip() for nl in f.readlines()]
     with open(cm_path, encoding='utf-8') as f:
         cms = [cm.strip() for cm in f.readlines()]
+    # parsed once by compute_top_utilities
+    asts = load_parsed_corpus(cm_path)
     nl_outfile_path = os.path.join(data_dir, 'all.nl.filtered')
     cm_outfile_path = os.path.join(data_dir, 'all.cm.filtered')
     with open(nl_outfile_path, 'w', encoding='utf-8') as nl_outfile:
         with open(cm_outfile_path, 'w', encoding='utf-8') as cm_outfile:
-            for nl, cm in zip(nls, cms):
+            for nl, cm, ast in zip(nls, cms, asts):
                 if len(nl.split()) > MAX_TEXT_LENGTH:
                     print('lenthy description skipped: {}'.format(nl))
                     continue
-                ast = bash_parser(cm)
-                if ast and select(ast, cm, top_utilities):
+                if ast is not None and select(ast, cm, top_utilities):
                     nl_outfile.write('{}\n'.format(nl))
                     cm_outfile.write('{}\n'.format(cm))
 
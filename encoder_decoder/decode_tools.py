@@ -38,6 +38,13 @@ def demo(sess, model, FLAGS):
     sentence = sys.stdin.readline()
 
     vocabs = data_utils.load_vocabulary(FLAGS)
+    if not FLAGS.explain:
+        # correct the words of the training sentences ahead of time, the
+        # sentences typed in then only pay for the words never seen before
+        train_path = os.path.join(FLAGS.data_dir, 'train.nl.filtered')
+        if os.path.exists(train_path):
+            with open(train_path, encoding='utf-8') as f:
+                tokenizer.spelling_corrector.warm(f)
 
     while sentence:
         if FLAGS.fill_argument_slots:
@@ -236,7 +243,11 @@ def decode(model_outputs, FLAGS, vocabs, sc_fillers=None,
             if FLAGS.grammatical_only and not FLAGS.explain:
                 if FLAGS.dataset.startswith('bash'):
                     target = re.sub('( ;\s+)|( ;$)', ' \\; ', target)
-                    target_ast = bashlint.bash_parser(target, verbose=False)
+                    # reject most ungrammatical candidates before parsing
+                    if bashlint.precheck(target) is None:
+                        target_ast = bashlint.bash_parser(target, verbose=False)
+                    else:
+                        target_ast = None
                 elif FLAGS.dataset.startswith('regex'):
                     # TODO: check if a predicted regular expression is legal
                     target_ast = '__DUMMY_TREE__'
@@ -328,6 +339,8 @@ def decode_set(sess, model, dataset, top_k, FLAGS, verbose=False):
             sc_temp = ' '.join(sc_tokens)
         targets = [dp.target for dp in data_group]
         tg_asts = [bashlint.bash_parser(target) for target in targets]
+        # matched against every prediction of the beam
+        tg_views = [tree_dist.get_eval_views(ast) for ast in tg_asts]
         if verbose:
             print('\nExample {}:'.format(example_id))
             print('Original Source: {}'.format(source.encode('utf-8')))
@@ -376,10 +389,11 @@ def decode_set(sess, model, dataset, top_k, FLAGS, verbose=False):
                         pred_cmd = top_k_pred_cmd
                     pred_file.write('{}|||'.format(pred_cmd.encode('utf-8')))
                     eval_row += '"{}",'.format(pred_cmd.replace('"', '""'))
-                    temp_match = tree_dist.one_match(
-                        tg_asts, top_k_pred_tree, ignore_arg_value=True)
-                    str_match = tree_dist.one_match(
-                        tg_asts, top_k_pred_tree, ignore_arg_value=False)
+                    pred_views = tree_dist.get_eval_views(top_k_pred_tree)
+                    temp_match = tree_dist.one_views_match(
+                        tg_views, pred_views, ignore_arg_value=True)
+                    str_match = tree_dist.one_views_match(
+                        tg_views, pred_views, ignore_arg_value=False)
                     if temp_match:
                         eval_row += 'y,'
                     if str_match:
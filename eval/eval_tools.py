@@ -116,17 +116,20 @@ def get_manual_evaluation_metrics(grouped_dataset, prediction_list, FLAGS, num_e
         sc_key = get_example_nl_key(source)
         command_gts = [dp.target for dp in data_group]
         command_gt_asts = [bashlint.bash_parser(gt) for gt in command_gts]
+        command_gt_views = [tree_dist.get_eval_views(ast)
+                            for ast in command_gt_asts]
         predictions = prediction_list[example_id]
         top_3_s_correct_marked = False
         top_3_f_correct_marked = False
         for i in xrange(min(3, len(predictions))):
             pred_cmd = predictions[i]
             pred_ast = cmd_parser(pred_cmd)
-            pred_temp = bashlint.ast2template(pred_ast, loose_constraints=True)
-            temp_match = tree_dist.one_match(
-                command_gt_asts, pred_ast, ignore_arg_value=True)
-            str_match = tree_dist.one_match(
-                command_gt_asts, pred_ast, ignore_arg_value=False)
+            pred_views = tree_dist.get_eval_views(pred_ast)
+            pred_temp = pred_views['template']
+            temp_match = tree_dist.one_views_match(
+                command_gt_views, pred_views, ignore_arg_value=True)
+            str_match = tree_dist.one_views_match(
+                command_gt_views, pred_views, ignore_arg_value=False)
             # Match ground truths & exisitng judgements
             command_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_cmd)
             structure_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_temp)
@@ -312,8 +315,11 @@ def get_automatic_evaluation_metrics(grouped_dataset, prediction_list, vocabs, F
         command_gts = [dp.target.strip() for dp in data_group]
         command_gt_asts = [cmd_parser(cmd) for cmd in command_gts]
         command_gt_asts_list.append(command_gt_asts)
-        template_gts = [bashlint.cmd2template(cmd, loose_constraints=True) for cmd in command_gts]
-        template_gt_asts = [cmd_parser(temp) for temp in template_gts]
+        command_gt_views = [tree_dist.get_eval_views(ast) for ast in command_gt_asts]
+        command_gt_content_tokens = [token_based.count_content_tokens(views['content'])
+                                     for views in command_gt_views]
+        template_gts = [views['template'] for views in command_gt_views]
+        template_gt_views = [tree_dist.get_eval_views(cmd_parser(temp)) for temp in template_gts]
         if verbose:
             print("Example {}".format(data_id))
             print("Original Source: {}".format(sc_str.encode('utf-8')))
@@ -328,15 +334,16 @@ def get_automatic_evaluation_metrics(grouped_dataset, prediction_list, vocabs, F
             pred_ast = cmd_parser(pred_cmd)
             if i == 0:
                 pred_ast_list.append(pred_ast)
-            pred_temp = bashlint.cmd2template(pred_cmd, loose_constraints=True)
+            pred_views = tree_dist.get_eval_views(pred_ast)
+            pred_temp = pred_views['template']
             # A) Exact match with ground truths & exisitng judgements
             command_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_cmd)
             structure_example_key = '{}<NL_PREDICTION>{}'.format(sc_key, pred_temp)
             # B) Match ignoring flag orders
-            temp_match = tree_dist.one_match(
-                template_gt_asts, pred_ast, ignore_arg_value=True)
-            str_match = tree_dist.one_match(
-                command_gt_asts, pred_ast, ignore_arg_value=False)
+            temp_match = tree_dist.one_views_match(
+                template_gt_views, pred_views, ignore_arg_value=True)
+            str_match = tree_dist.one_views_match(
+                command_gt_views, pred_views, ignore_arg_value=False)
             if command_eval_cache and command_example_key in command_eval_cache:
                 str_match = normalize_judgement(command_eval_cache[command_example_key]) == 'y'
             if structure_eval_cache and structure_example_key in structure_eval_cache:
@@ -345,7 +352,9 @@ def get_automatic_evaluation_metrics(grouped_dataset, prediction_list, vocabs, F
                 top_k_temp_correct[data_id, i] = 1
             if str_match:
                 top_k_str_correct[data_id, i] = 1
-            cms = token_based.command_match_score(command_gt_asts, pred_ast)
+            cms = token_based.max_content_match_score(
+                command_gt_content_tokens,
+                token_based.count_content_tokens(pred_views['content']))
             # if pred_cmd.strip():
             #     bleu = token_based.sentence_bleu_score(command_gt_asts, pred_ast)   
             # else:
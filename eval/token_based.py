@@ -16,10 +16,25 @@ from bashlint import nast
 smoothing = nltk.translate.bleu_score.SmoothingFunction()
 
 
+# ast2tokens options of the tokens compared by CMS
+content_view = {
+    'arg_type_only': True,
+    'with_prefix': True,
+    'with_flag_argtype': True
+}
+
+
 def get_content_tokens(ast):
+    return count_content_tokens(
+        bashlint.ast2tokens(ast, loose_constraints=True, **content_view))
+
+
+def count_content_tokens(tokens):
+    """
+    Count the non-argument tokens of a list produced with content_view.
+    """
     content_tokens = collections.defaultdict(int)
-    for compound_token in bashlint.ast2tokens(ast, loose_constraints=True,
-            arg_type_only=True, with_prefix=True, with_flag_argtype=True):
+    for compound_token in tokens:
         kind_token = compound_token.split(nast.KIND_PREFIX)
         if len(kind_token) == 2:
             kind, token = kind_token
@@ -32,8 +47,11 @@ def get_content_tokens(ast):
 
 
 def CMS(ast1, ast2):
-    token_dict1 = get_content_tokens(ast1)
-    token_dict2 = get_content_tokens(ast2)
+    return content_match_score(get_content_tokens(ast1),
+                               get_content_tokens(ast2))
+
+
+def content_match_score(token_dict1, token_dict2):
     num_overlap = 0.0
     for t in token_dict2:
         if t in token_dict1:
@@ -51,10 +69,16 @@ def CMS(ast1, ast2):
 
 
 def command_match_score(gts, ast):
+    return max_content_match_score([get_content_tokens(gt) for gt in gts],
+                                   get_content_tokens(ast))
+
+
+def max_content_match_score(gt_token_dicts, token_dict):
     max_cms = 0.0
-    for gt in gts:
-        if CMS(ast, gt) > max_cms:
-            max_cms = CMS(ast, gt)
+    for gt_token_dict in gt_token_dicts:
+        cms = content_match_score(token_dict, gt_token_dict)
+        if cms > max_cms:
+            max_cms = cms
     return max_cms
 
 
@@ -2,8 +2,27 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from bashlint import ast2template, bash_parser, nast
-from eval import zss
+from bashlint import ast2template, ast2views, ast_hash, bash_parser, nast
+from eval import token_based, zss
+
+
+# token lists of an AST compared by the evaluation, see get_eval_views
+eval_views = {
+    'template': {'arg_type_only': True},
+    'string': {'arg_type_only': False},
+    'content': token_based.content_view
+}
+
+
+def get_eval_views(ast):
+    """
+    Compute the templates and the content tokens of an AST compared by the
+    evaluation in one traversal.
+    """
+    views = ast2views(ast, eval_views, loose_constraints=True)
+    views['template'] = ' '.join(views['template'])
+    views['string'] = ' '.join(views['string'])
+    return views
 
 
 def local_dist(s1, s2, skip_argument=False):
@@ -80,10 +99,18 @@ def one_match(asts, ast2, rewrite=False, ignore_arg_value=False):
         raise NotImplementedError
     else:
         ast_rewrites = asts
-    cmd2 = ast2template(ast2, loose_constraints=True, arg_type_only=ignore_arg_value)
-    for ast1 in ast_rewrites:
-        cmd1 = ast2template(ast1, loose_constraints=True, arg_type_only=ignore_arg_value)
-        if cmd1 == cmd2:
+    # use get_eval_views and one_views_match to match many predictions
+    # against the same ASTs without linearizing them again
+    return one_views_match([get_eval_views(ast1) for ast1 in ast_rewrites],
+                           get_eval_views(ast2), ignore_arg_value)
+
+def one_views_match(views_list, views2, ignore_arg_value=False):
+    """
+    Same as one_match, on the views of the ASTs computed by get_eval_views.
+    """
+    key = 'template' if ignore_arg_value else 'string'
+    for views1 in views_list:
+        if views1[key] == views2[key]:
             return True
     return False
 
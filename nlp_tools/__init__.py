@@ -1,7 +1,7 @@
-from nlp_tools import tokenizer
-
-
 def canonicalize_text(s):
+    # imported here so that importing the lightweight submodules (e.g.
+    # nlp_tools.constants) does not load NLTK
+    from nlp_tools import tokenizer
     words, _ = tokenizer.basic_tokenizer(s)
     return ' '.join(words)
 
@@ -306,6 +306,8 @@ def remove_quotation(s):
 def with_angle_brackets(s):
     return s.startswith('<') and s.endswith('>')
 
+_ENGLISH_WORD_RE = re.compile('^[a-zA-Z]{1}[a-z]*(-[a-z]+)*$', re.IGNORECASE)
+
 def is_english_word(word):
     """Check if a token is a normal English word."""
     if word in ['i.e', 'i.e.', 'e.g', 'e.g.',
@@ -313,7 +315,7 @@ def is_english_word(word):
         return True
     if word in ['\'s', '\'t']:
         return True
-    return bool(re.match('^[a-zA-Z]{1}[a-z]*(-[a-z]+)*$', word, re.IGNORECASE))
+    return bool(_ENGLISH_WORD_RE.match(word))
 
 def is_stopword(w):
     return w in ENGLISH_STOPWORDS
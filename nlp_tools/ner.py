@@ -17,6 +17,74 @@ def decorate_boundaries(r):
     """
     return constants.include_space(constants.quotation_safe(r))
 
+# -- Size
+_SIZE_RE = re.compile(decorate_boundaries(
+    constants.polarity_safe(r'({}|a\s)\s*'.format(constants._DIGIT_RE)) +
+    constants._SIZE_UNIT))
+
+# -- Timespan
+_time_num_re = r'((24\*|60\*)?{}|{}(\*24|\*60))'.format(
+    constants._DIGIT_RE, constants._DIGIT_RE)
+_DURATION_RE = re.compile(decorate_boundaries(constants.polarity_safe(
+    r'({}|a\s|this\s|next(\s{})?\s|last(\s{})?\s|previous(\s{})?\s)\s*'.format(
+    _time_num_re, _time_num_re, _time_num_re, _time_num_re) + constants._DURATION_UNIT)))
+
+# -- DateTime
+# Credit: time expressions adapted from
+# https://github.com/nltk/nltk_contrib/blob/master/nltk_contrib/timex.py
+_standard_time = r'\d+:\d+:\d+\.?\d*'
+_standard_datetime = r'\d{1,4}[\/-]\d{1,4}[\/-]\d{1,4}([,|\s]' + _standard_time + r')?'
+_textual_datetime = constants._MONTH_RE \
+                    + r'(\s\d{0,2}(st|nd|th)?)?([,|\s]\d{2,4})?([,|\s]' \
+                    + _standard_time + r')?'
+_DATETIME_RE = re.compile(decorate_boundaries(constants.polarity_safe(
+                '(' + constants._REL_DAY_RE + '|' + _standard_time + '|' +
+                _standard_datetime + '|' + _textual_datetime + ')')))
+
+# -- Permission
+_permission_bit = r'(suid|sgid|sticky|sticki)(\sbit)?'
+_permission_bit_set = r'(set)?(uid|gid|sticky|sticki)(=\d+)*'
+_PERMISSION_RE = re.compile(decorate_boundaries(constants.polarity_safe(
+                '(' + constants._PATTERN_PERMISSION_RE + '|' +
+                _permission_bit + '|' + _permission_bit_set + ')')))
+
+# -- Number
+_NUMBER_RE = re.compile(decorate_boundaries(
+    constants.polarity_safe(constants._DIGIT_RE)))
+
+# -- Quoted patterns
+_QUOTED_DIRECTORY_RE = re.compile(constants.include_quotations(r'[^"\']*\/'))
+_QUOTED_FILE_RE = re.compile(constants.include_quotations(r'([^"\']*\.[^ "\']+)|' +
+    r'(([^"\']*\/)+[^"\']*)|' + constants._FILE_EXTENSION_RE))
+_REGEX_QUOTED_RE = re.compile(constants.include_space(constants._QUOTED_RE))
+
+# -- Unquoted patterns
+_DIRECTORY_RE = re.compile(decorate_boundaries(r'[^ "\']*\/'))
+_FILE_RE = re.compile(r'([^ ]*\.[^ ]+|' + r'([^ ]*\/)+[^ ]*)|(' +
+    decorate_boundaries(constants._FILE_EXTENSION_RE) + ')')
+_REGEX_SPECIAL_RE = re.compile(decorate_boundaries(constants._SPECIAL_SYMBOL_RE))
+
+# The entity patterns in the order they are matched. Each pattern is matched
+# against the sentence in which the entities matched by the previous ones
+# are masked. All quoted patterns are matched before the unquoted ones to
+# prevent partial matching within quotations.
+NER_PATTERNS = [
+    (_SIZE_RE, constants._SIZE),
+    (_DURATION_RE, constants._TIMESPAN),
+    (_DATETIME_RE, constants._DATETIME),
+    (_PERMISSION_RE, constants._PERMISSION),
+    (_NUMBER_RE, constants._NUMBER),
+    (_QUOTED_DIRECTORY_RE, constants._DIRECTORY),
+    (_QUOTED_FILE_RE, constants._FILE),
+    (_REGEX_QUOTED_RE, constants._REGEX),
+    (_DIRECTORY_RE, constants._DIRECTORY),
+    (_FILE_RE, constants._FILE),
+    (_REGEX_SPECIAL_RE, constants._REGEX)
+]
+
+_WORD_SPLIT_RE = re.compile(constants._WORD_SPLIT_RESPECT_QUOTES)
+_DIGIT_RE = re.compile(constants._DIGIT_RE)
+
 def annotate(tokens):
     """
     Identify named entities in a (tokenized) sentence and replace them with the
@@ -49,83 +117,13 @@ def annotate(tokens):
     ner_by_category = collections.defaultdict(list)
     entities = (ner_by_char_pos, ner_by_category)
 
-    # -- Size
-    _SIZE_RE = re.compile(decorate_boundaries(
-        constants.polarity_safe(r'({}|a\s)\s*'.format(constants._DIGIT_RE)) +
-        constants._SIZE_UNIT))
-    sentence = annotate_ner(_SIZE_RE, constants._SIZE, sentence, entities)
-
-    # -- Timespan
-    time_num_re = r'((24\*|60\*)?{}|{}(\*24|\*60))'.format(
-        constants._DIGIT_RE, constants._DIGIT_RE)
-    _DURATION_RE = re.compile(decorate_boundaries(constants.polarity_safe(
-        r'({}|a\s|this\s|next(\s{})?\s|last(\s{})?\s|previous(\s{})?\s)\s*'.format(
-        time_num_re, time_num_re, time_num_re, time_num_re) + constants._DURATION_UNIT)))
-    sentence = annotate_ner(
-        _DURATION_RE, constants._TIMESPAN, sentence, entities)
-
-    # -- DateTime
-    # Credit: time expressions adapted from
-    # https://github.com/nltk/nltk_contrib/blob/master/nltk_contrib/timex.py
-    standard_time = r'\d+:\d+:\d+\.?\d*'
-    standard_datetime = r'\d{1,4}[\/-]\d{1,4}[\/-]\d{1,4}([,|\s]' + standard_time + r')?'
-    textual_datetime = constants._MONTH_RE \
-                       + r'(\s\d{0,2}(st|nd|th)?)?([,|\s]\d{2,4})?([,|\s]' \
-                       + standard_time + r')?'
-    _DATETIME_RE = re.compile(decorate_boundaries(constants.polarity_safe(
-                    '(' + constants._REL_DAY_RE + '|' + standard_time + '|' +
-                    standard_datetime + '|' + textual_datetime + ')')))
-    sentence = annotate_ner(_DATETIME_RE, constants._DATETIME, sentence, entities)
-    
-    # -- Permission
-    permission_bit = r'(suid|sgid|sticky|sticki)(\sbit)?'
-    permission_bit_set = r'(set)?(uid|gid|sticky|sticki)(=\d+)*'
-    _PERMISSION_RE = re.compile(decorate_boundaries(constants.polarity_safe(
-                    '(' + constants._PATTERN_PERMISSION_RE + '|' +
-                    permission_bit + '|' + permission_bit_set + ')')))
-    sentence = annotate_ner(
-        _PERMISSION_RE, constants._PERMISSION, sentence, entities)
-
-    # -- Number
-    _NUMBER_RE = re.compile(decorate_boundaries(
-        constants.polarity_safe(constants._DIGIT_RE)))
-    sentence = annotate_ner(_NUMBER_RE, constants._NUMBER, sentence, entities)
-
-    # -- Match all quoted patterns first to prevent partial matching within quotations
-    # -- Directory
-    _DIRECTORY_RE = re.compile(constants.include_quotations(r'[^"\']*\/'))
-    sentence = annotate_ner(
-        _DIRECTORY_RE, constants._DIRECTORY, sentence, entities)
-
-    # -- File
-    _FILE_RE = re.compile(constants.include_quotations(r'([^"\']*\.[^ "\']+)|' +
-        r'(([^"\']*\/)+[^"\']*)|' + constants._FILE_EXTENSION_RE))
-    sentence = annotate_ner(_FILE_RE, constants._FILE, sentence, entities)
-    
-    # -- Other patterns
-    _REGEX_QUOTED_RE = re.compile(constants.include_space(constants._QUOTED_RE))
-    sentence = annotate_ner(_REGEX_QUOTED_RE, constants._REGEX, sentence, entities)
-    
-    # -- Match all unquoted patterns
-    # -- Directory
-    _DIRECTORY_RE = re.compile(decorate_boundaries(r'[^ "\']*\/'))
-    sentence = annotate_ner(
-        _DIRECTORY_RE, constants._DIRECTORY, sentence, entities)
-    
-    # -- File
-    _FILE_RE = re.compile(r'([^ ]*\.[^ ]+|' + r'([^ ]*\/)+[^ ]*)|(' +
-        decorate_boundaries(constants._FILE_EXTENSION_RE) + ')')
-    sentence = annotate_ner(_FILE_RE, constants._FILE, sentence, entities)
-    
-    # -- Other patterns
-    _REGEX_SPECIAL_RE = re.compile(decorate_boundaries(constants._SPECIAL_SYMBOL_RE))
-    sentence = annotate_ner(_REGEX_SPECIAL_RE, constants._REGEX, sentence, entities)
+    for pattern, category in NER_PATTERNS:
+        sentence = annotate_ner(pattern, category, sentence, entities)
 
     # prepare list of tokens
     normalized_words = []
     i = 0
-    for m in re.finditer(
-        re.compile(constants._WORD_SPLIT_RESPECT_QUOTES), sentence):
+    for m in _WORD_SPLIT_RE.finditer(sentence):
         w = m.group(0)
         # exclude isolated quotations
         if w in ['"', '\'']:
@@ -150,8 +148,17 @@ def annotate(tokens):
     return normalized_words, (ner_by_token_id, ner_by_char_pos, ner_by_category)
 
 def annotate_ner(pattern, category, sentence, entities):
+    """
+    Mask the entities matched by pattern in sentence with '-'.
+
+    :return: the masked sentence.
+    """
     ner_by_char_pos, ner_by_category = entities
-    for m in re.finditer(pattern, sentence):
+    # the matches do not overlap, so the masked sentence is assembled once
+    # from the unmasked pieces and the masks
+    pieces = []
+    end = 0
+    for m in pattern.finditer(sentence):
         surface = sentence[m.start(0):m.end(0)].strip()
         if category == constants._DATETIME:
             # TODO: rule-based system is not good at differentiating between
@@ -165,15 +172,19 @@ def annotate_ner(pattern, category, sentence, entities):
                 continue
         # replace recognized entities with placeholders to ensure that entity
         # position calculation is always correct
-        rep_start = m.start(0) + 1 if re.match(r'\s', sentence[m.start(0)]) \
+        rep_start = m.start(0) + 1 if sentence[m.start(0)].isspace() \
             else m.start(0)
-        rep_end = m.end(0) - 1 if re.match(r'\s', sentence[m.end(0)-1]) \
+        rep_end = m.end(0) - 1 if sentence[m.end(0)-1].isspace() \
             else m.end(0)
-        sentence = sentence[:rep_start] + '-' * (rep_end - rep_start) + \
-                   sentence[rep_end:]
+        pieces.append(sentence[end:rep_start])
+        pieces.append('-' * (rep_end - rep_start))
+        end = rep_end
         ner_by_char_pos[(rep_start, rep_end)] = (surface, category)
         ner_by_category[category].append((surface, rep_start, rep_end))
-    return sentence
+    if not pieces:
+        return sentence
+    pieces.append(sentence[end:])
+    return ''.join(pieces)
 
 def normalize_number_in_token(token):
-    return re.sub(re.compile(constants._DIGIT_RE), constants._NUMBER, token)
+    return _DIGIT_RE.sub(constants._NUMBER, token)
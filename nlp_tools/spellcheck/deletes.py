@@ -0,0 +1,432 @@
+"""
+Symmetric delete index of the spelling dictionary.
+
+Every string obtained by deleting up to MAX_DISTANCE characters from a
+dictionary word is hashed and mapped to the word. Two words which are at
+most k edits apart (deletes, transposes, replaces or inserts) always share
+a string obtained by deleting at most k characters from each, so the
+dictionary words close to a word are found by looking up the hashes of its
+own deletes, a few dozen binary searches, instead of generating and testing
+every edit of the word. The words found this way which are not close enough
+(and the hash collisions) are filtered out with an exact edit distance.
+
+The index also stores the words and their counts, so it serves as the
+dictionary of the spelling corrector. It is built once from the dictionary
+file and saved next to it, in "<dictionary>.deletes", then memory-mapped, so
+the processes which use it share its pages instead of loading their own
+copy. It records the modification time and the size of the dictionary file
+and is rebuilt when they change.
+
+Layout (all integers are native int32 except the hashes, which are uint32):
+
+    header                      magic, version, stamp and section sizes
+    for each number of deleted characters, 0 to MAX_DISTANCE:
+      hashes                    num_entries sorted hashes of the deletes
+      word ids                  num_entries ids of the words of the deletes
+    counts                      num_words counts of the words
+    word offsets                num_words + 1 byte offsets
+    words                       UTF-8 encoded words, in dictionary order
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import bisect
+import io
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+INDEX_VERSION = 1
+
+MAGIC = b'SPELLDEL'
+MAX_DISTANCE = 2
+
+# version, dictionary mtime, dictionary size, num_words, num_bytes and
+# num_entries of each number of deleted characters
+HEADER = struct.Struct('<IdQII' + 'I' * (MAX_DISTANCE + 1))
+
+# the characters the spelling corrector inserts and replaces with
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+INT_SIZE = array.array('i').itemsize
+
+
+def index_path(path):
+    return path + '.deletes'
+
+
+def dictionary_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def deletes(word, distance=MAX_DISTANCE):
+    """
+    The strings obtained by deleting up to distance characters from word,
+    as a list of sets indexed by the number of deleted characters.
+    """
+    result = [set([word])]
+    for _ in range(distance):
+        result.append(set(w[:i] + w[i + 1:]
+                          for w in result[-1] for i in range(len(w))))
+    return result
+
+
+def delete_hash(s):
+    return zlib.crc32(s.encode('utf-8')) & 0xffffffff
+
+
+def _to_bytes(a):
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def _from_bytes(typecode, data):
+    a = array.array(typecode)
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    return a
+
+
+def read_dictionary_lines(lines):
+    """
+    :return: the words and the counts of "word<TAB>count" lines in bytes.
+    """
+    words, counts = [], []
+    for line in lines:
+        word, count = line.decode('utf-8').strip().split('\t')
+        words.append(word)
+        counts.append(int(count))
+    return words, counts
+
+
+def read_dictionary(path):
+    """
+    :return: the words and the counts of a "word<TAB>count" file.
+    """
+    with open(path, 'rb') as f:
+        return read_dictionary_lines(f)
+
+
+def write_index(out, stamp, words, counts):
+    """
+    Save the index of a dictionary.
+
+    :param out: binary file object.
+    :param stamp: modification time and size of the dictionary file.
+    """
+    sections = [[] for _ in range(MAX_DISTANCE + 1)]
+    for word_id, word in enumerate(words):
+        for distance, strings in enumerate(deletes(word)):
+            sections[distance].extend(
+                (delete_hash(d), word_id) for d in strings)
+    for entries in sections:
+        entries.sort()
+    encoded = [w.encode('utf-8') for w in words]
+    word_offsets = array.array('i', [0])
+    for w in encoded:
+        word_offsets.append(word_offsets[-1] + len(w))
+
+    out.write(MAGIC)
+    out.write(HEADER.pack(INDEX_VERSION, stamp[0], stamp[1], len(words),
+                          word_offsets[-1], *[len(e) for e in sections]))
+    for entries in sections:
+        out.write(_to_bytes(array.array('I', [h for h, _ in entries])))
+        out.write(_to_bytes(array.array('i', [i for _, i in entries])))
+    out.write(_to_bytes(array.array('i', counts)))
+    out.write(_to_bytes(word_offsets))
+    out.write(b''.join(encoded))
+
+
+def is_edit1(word, w):
+    """
+    True if w is one delete, transpose, replace or insert away from word.
+    """
+    n, m = len(word), len(w)
+    i = 0
+    while i < n and i < m and word[i] == w[i]:
+        i += 1
+    if n == m:
+        if i == n:
+            return False
+        if word[i + 1:] == w[i + 1:]:
+            return w[i] in LETTERS
+        return i + 1 < n and word[i] == w[i + 1] and word[i + 1] == w[i] \
+            and word[i + 2:] == w[i + 2:]
+    if n == m + 1:
+        return word[i + 1:] == w[i:]
+    if m == n + 1:
+        return w[i] in LETTERS and w[i + 1:] == word[i:]
+    return False
+
+
+def edit_distance(word, w, bound=MAX_DISTANCE):
+    """
+    Damerau-Levenshtein distance from word to w in the edits of the
+    spelling corrector, which only inserts and replaces with LETTERS, or
+    bound + 1 if it is larger than bound.
+    """
+    # common prefixes and suffixes are never edited
+    start = 0
+    while start < len(word) and start < len(w) and word[start] == w[start]:
+        start += 1
+    end = 0
+    while end < len(word) - start and end < len(w) - start and \
+            word[-1 - end] == w[-1 - end]:
+        end += 1
+    a = word[start:len(word) - end]
+    b = w[start:len(w) - end]
+    n, m = len(a), len(b)
+    far = bound + 1
+    if abs(n - m) > bound:
+        return far
+
+    # inserted[j]: number of characters of b[:j] which cannot be inserted
+    inserted = [0]
+    for c in b:
+        inserted.append(inserted[-1] + (c not in LETTERS))
+
+    # d[i + 1][j + 1] is the distance from a[:i] to b[:j], row and column
+    # 0 are sentinels for the transpositions
+    d = [[far] * (m + 2) for _ in range(n + 2)]
+    for i in range(n + 1):
+        d[i + 1][1] = i
+    for j in range(1, m + 1):
+        d[1][j + 1] = j if not inserted[j] else far
+    last_row = {}
+    for i in range(1, n + 1):
+        last_col = 0
+        row, prev = d[i + 1], d[i]
+        for j in range(1, m + 1):
+            k, l = last_row.get(b[j - 1], 0), last_col
+            if a[i - 1] == b[j - 1]:
+                best = prev[j]
+                last_col = j
+            else:
+                best = prev[j] + 1 if b[j - 1] in LETTERS else far
+                best = min(best, prev[j + 1] + 1)
+                if b[j - 1] in LETTERS:
+                    best = min(best, row[j] + 1)
+            if k and l and inserted[j - 1] == inserted[l]:
+                # transpose a[k - 1] and a[i - 1], deleting the characters
+                # between them and inserting b[l:j - 1]
+                best = min(best, d[k][l] + (i - k - 1) + 1 + (j - l - 1))
+            if i > 2 and j > 2:
+                # two transpositions moving a character by two places,
+                # the only way to move a character which is not a letter
+                x, y = a[i - 3:i], b[j - 3:j]
+                if y == x[1:] + x[0] or y == x[2] + x[:2]:
+                    best = min(best, d[i - 2][j - 2] + 2)
+            row[j + 1] = min(best, far)
+        last_row[a[i - 1]] = i
+    return d[n + 1][m + 1]
+
+
+class DeleteIndex(object):
+    def __init__(self, buffer, stamp=None):
+        """
+        :param buffer: the content of an index (bytes or mmap).
+        :param stamp: if given, raise a ValueError unless the index was
+            built from a dictionary with this stamp.
+
+        :member sections: for each number of deleted characters, the
+            sorted hashes of the deletes of the words and the id of the
+            word of each hash
+        :member counts: count of each word
+        :member word_offsets: byte offset of each word in the buffer
+        """
+        self.buffer = buffer
+        # views of the buffer, which must be released before it is closed
+        self.views = []
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a spelling index')
+        header = HEADER.unpack_from(buffer, len(MAGIC))
+        version, mtime, size, num_words, _ = header[:5]
+        if version != INDEX_VERSION:
+            raise ValueError('Unsupported spelling index version {}'.format(
+                version))
+        self.stamp = (mtime, size)
+        if stamp is not None and tuple(stamp) != self.stamp:
+            raise ValueError('Stale spelling index')
+
+        position = len(MAGIC) + HEADER.size
+        self.sections = []
+        for num_entries in header[5:]:
+            hashes = self._read('I', position, num_entries)
+            position += num_entries * hashes.itemsize
+            word_ids = self._read('i', position, num_entries)
+            position += num_entries * INT_SIZE
+            self.sections.append((hashes, word_ids))
+        self.counts = self._read('i', position, num_words)
+        position += num_words * INT_SIZE
+        self.word_offsets = self._read('i', position, num_words + 1)
+        position += (num_words + 1) * INT_SIZE
+        self.words_start = position
+        self.words = {}
+        self._total = None
+
+    @classmethod
+    def open(cls, path, stamp=None):
+        """
+        Memory-map a saved index.
+        """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(buffer, stamp)
+        except Exception:
+            buffer.close()
+            raise
+
+    def _read(self, typecode, start, count):
+        size = array.array(typecode).itemsize
+        if not hasattr(memoryview, 'cast'):
+            return _from_bytes(typecode,
+                               self.buffer[start:start + count * size])
+        # a view of the buffer, the mapped pages are not copied
+        view = memoryview(self.buffer)[start:start + count * size].cast(
+            typecode)
+        self.views.append(view)
+        return view
+
+    def word(self, word_id):
+        try:
+            return self.words[word_id]
+        except KeyError:
+            start = self.words_start + self.word_offsets[word_id]
+            end = self.words_start + self.word_offsets[word_id + 1]
+            w = self.buffer[start:end].decode('utf-8')
+            self.words[word_id] = w
+            return w
+
+    def lookup(self, word, distance=MAX_DISTANCE, strings=None):
+        """
+        Ids of the words which share a string obtained by deleting at most
+        distance characters from each with word, in dictionary order.
+        Includes some words more than distance edits away.
+
+        :param strings: the deletes of word, if already computed.
+        """
+        if strings is None:
+            strings = deletes(word, distance)
+        found = set()
+        for hashes, word_ids in self.sections[:distance + 1]:
+            for d in strings[:distance + 1]:
+                for s in d:
+                    h = delete_hash(s)
+                    i = bisect.bisect_left(hashes, h)
+                    while i < len(hashes) and hashes[i] == h:
+                        found.add(word_ids[i])
+                        i += 1
+        return sorted(found)
+
+    def word_id(self, word):
+        """
+        Id of word, None if it is not in the dictionary.
+        """
+        hashes, word_ids = self.sections[0]
+        h = delete_hash(word)
+        i = bisect.bisect_left(hashes, h)
+        while i < len(hashes) and hashes[i] == h:
+            if self.word(word_ids[i]) == word:
+                return word_ids[i]
+            i += 1
+        return None
+
+    def count(self, word):
+        word_id = self.word_id(word)
+        return 0 if word_id is None else self.counts[word_id]
+
+    @property
+    def total(self):
+        """
+        Sum of the counts of the words.
+        """
+        if self._total is None:
+            self._total = sum(self.counts)
+        return self._total
+
+    def __contains__(self, word):
+        return self.word_id(word) is not None
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __iter__(self):
+        for word_id in range(len(self)):
+            yield self.word(word_id)
+
+    def candidates(self, word):
+        """
+        The dictionary words with the fewest edits from word, at most
+        MAX_DISTANCE, in dictionary order, or [] if there are none.
+        """
+        if word in self:
+            return [word]
+        strings = deletes(word)
+        closest = [w for w in (self.word(i)
+                               for i in self.lookup(word, 1, strings))
+                   if is_edit1(word, w)]
+        if not closest:
+            closest = [w for w in (self.word(i)
+                                   for i in self.lookup(word, 2, strings))
+                       if edit_distance(word, w) <= MAX_DISTANCE]
+        return closest
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+
+def save_index(path, stamp, words, counts):
+    """
+    Save an index atomically.
+
+    :return: True if the index was saved.
+    """
+    # write to a temporary file first and move it into place so that
+    # concurrent readers never see a partially written index
+    tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            write_index(f, stamp, words, counts)
+        if os.path.exists(path) and sys.platform.startswith('win'):
+            os.remove(path)
+        os.rename(tmp_file, path)
+        return True
+    except (IOError, OSError):
+        # the index is simply not saved if the directory is read-only
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return False
+
+
+def in_memory_index(stamp, words, counts):
+    out = io.BytesIO()
+    write_index(out, stamp, words, counts)
+    return DeleteIndex(out.getvalue(), stamp)
+
+
+def load_index(dictionary_path):
+    """
+    Open the saved index of a dictionary, building it first if it is
+    missing or stale.
+    """
+    stamp = dictionary_stamp(dictionary_path)
+    path = index_path(dictionary_path)
+    try:
+        return DeleteIndex.open(path, stamp)
+    except (IOError, OSError, ValueError, struct.error):
+        pass
+    words, counts = read_dictionary(dictionary_path)
+    if save_index(path, stamp, words, counts):
+        return DeleteIndex.open(path, stamp)
+    return in_memory_index(stamp, words, counts)
@@ -6,20 +6,53 @@ MIT license: www.opensource.org/licenses/mit-license.php
 
 ################ Spelling Corrector
 
-import os, re, collections
+import os, re
 from collections import Counter
 
+from . import deletes
+
 
 current_folder = os.path.dirname(__file__)
 
+DICTIONARY = os.path.join(current_folder, 'most_common.txt')
+DICTIONARY_TARBALL = os.path.join(current_folder, 'most_common.tar.xz')
+
 def words(text): return re.findall(r'\w+', text.lower())
 
-WORDS = collections.defaultdict(int)
-if os.path.exists(os.path.join(current_folder, "most_common.txt")):
-    with open(os.path.join(current_folder, 'most_common.txt')) as f:
-        for line in f:
-            word, freq = line.strip().split('\t')
-            WORDS[word] = int(freq)
+_dictionary = []
+
+def dictionary():
+    "The dictionary of word counts (a deletes.DeleteIndex), loaded on first use."
+    if not _dictionary:
+        _dictionary.append(load_dictionary())
+    return _dictionary[0]
+
+def load_dictionary():
+    "Memory-map the index of most_common.txt, extracting it from the tarball if it is missing."
+    if not os.path.exists(DICTIONARY) and os.path.exists(DICTIONARY_TARBALL):
+        import tarfile
+        with tarfile.open(DICTIONARY_TARBALL) as tar:
+            member = tar.getmember('most_common.txt')
+            content = tar.extractfile(member).read()
+        # write to a temporary file first and move it into place so that
+        # concurrent processes never index a partially extracted file
+        tmp_file = '{}.{}.tmp'.format(DICTIONARY, os.getpid())
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(content)
+            os.utime(tmp_file, (member.mtime, member.mtime))
+            os.rename(tmp_file, DICTIONARY)
+        except (IOError, OSError):
+            # the words are indexed in memory if the folder is read-only
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return deletes.in_memory_index(
+                (member.mtime, len(content)),
+                *deletes.read_dictionary_lines(content.splitlines()))
+    if not os.path.exists(DICTIONARY):
+        # no dictionary, no corrections
+        return deletes.in_memory_index((0, 0), [], [])
+    return deletes.load_index(DICTIONARY)
 
 def extract_top_frequent_words(input, top_k):
     _words = Counter(words(open(input).read()))
@@ -36,21 +69,28 @@ def extract_top_frequent_words(input, top_k):
             if count >= top_k:
                 break
 
-def P(word, N=sum(WORDS.values())):
+def P(word, N=None):
     "Probability of `word`."
-    return WORDS[word] / (N+0.0)
+    counts = dictionary()
+    return counts.count(word) / ((N or counts.total or 1)+0.0)
 
 def correction(word):
     "Most probable spelling correction for word."
     return max(candidates(word), key=P)
 
 def candidates(word):
-    "Generate possible spelling corrections for word."
-    return (known([word]) or known(edits1(word)) or known(edits2(word)) or [word])
+    "Generate possible spelling corrections for word, in dictionary order."
+    return dictionary().candidates(word) or [word]
+
+def edit_candidates(word, vocabulary=None):
+    "Generate possible spelling corrections for word from all its edits (slow)."
+    return (known([word], vocabulary) or known(edits1(word), vocabulary) or
+            known(edits2(word), vocabulary) or [word])
 
-def known(words):
-    "The subset of `words` that appear in the dictionary of WORDS."
-    return set(w for w in words if w in WORDS)
+def known(words, vocabulary=None):
+    "The subset of `words` that appear in the dictionary (or in vocabulary)."
+    vocabulary = dictionary() if vocabulary is None else vocabulary
+    return set(w for w in words if w in vocabulary)
 
 def edits1(word):
     "All edits that are one edit away from `word`."
@@ -81,9 +121,9 @@ def unit_tests():
     assert words('This is a TEST.') == ['this', 'is', 'a', 'test']
     assert Counter(words('This is a test. 123; A TEST this is.')) == (
            Counter({'123': 1, 'a': 2, 'is': 2, 'test': 2, 'this': 2}))
-    assert len(WORDS) == 32192
-    assert sum(WORDS.values()) == 1115504
-    assert WORDS.most_common(10) == [
+    assert len(dictionary()) == 32192
+    assert dictionary().total == 1115504
+    assert [(w, dictionary().count(w)) for w in list(dictionary())[:10]] == [
      ('the', 79808),
      ('of', 40024),
      ('and', 38311),
@@ -94,7 +134,7 @@ def unit_tests():
      ('he', 12401),
      ('was', 11410),
      ('it', 10681)]
-    assert WORDS['the'] == 79808
+    assert dictionary().count('the') == 79808
     assert P('quintessential') == 0
     assert 0.07 < P('the') < 0.08
     return 'unit_tests pass'
@@ -109,14 +149,33 @@ def spelltest(tests, verbose=False):
         w = correction(wrong)
         good += (w == right)
         if w != right:
-            unknown += (right not in WORDS)
+            unknown += (right not in dictionary())
             if verbose:
                 print('correction({}) => {} ({}); expected {} ({})'
-                      .format(wrong, w, WORDS[w], right, WORDS[right]))
+                      .format(wrong, w, dictionary().count(w), right,
+                              dictionary().count(right)))
     dt = time.clock() - start
     print('{:.0%} of {} correct ({:.0%} unknown) at {:.0f} words per second '
           .format(good / n, n, unknown / n, n / dt))
 
+def indextest(lines, verbose=False):
+    "Check that candidates and edit_candidates agree on the words of lines."
+    import time
+    tested = set(w for line in lines for w in words(line)
+                 if w.isalpha() and len(w) > 2)
+    vocabulary = set(dictionary())
+    start = time.time()
+    for w in tested:
+        candidates(w)
+    dt = time.time() - start
+    for w in tested:
+        expected = edit_candidates(w, vocabulary)
+        assert set(candidates(w)) == set(expected), w
+        if verbose and expected != [w]:
+            print('{} => {}'.format(w, correction(w)))
+    print('{} words agree, {:.0f} microseconds per word'
+          .format(len(tested), dt / len(tested) * 1e6))
+
 def Testset(lines):
     "Parse 'right: wrong1 wrong2' lines into [('right', 'wrong1'), ('right', 'wrong2')] pairs."
     return [(right, wrong)
@@ -125,6 +184,13 @@ def Testset(lines):
 
 
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        # e.g. python -m nlp_tools.spellcheck.spell_check data/bash/all.nl
+        with open(sys.argv[1]) as f:
+            indextest(f)
+        sys.exit()
+
     if not os.path.exists(os.path.join(current_folder, "most_common.txt")):
         # extract most common words from text file
         extract_top_frequent_words(os.path.join(current_folder, "html.txt"), 30000)
@@ -13,6 +13,7 @@ import re, sys
 if sys.version_info > (3, 0):
     from six.moves import xrange
 
+from bashlint import butils
 from . import constants, ner
 from .spellcheck import spell_check as spc
 
@@ -21,6 +22,75 @@ from .spellcheck import spell_check as spc
 from nltk.stem import SnowballStemmer
 stemmer = SnowballStemmer("english")
 
+# the words SpellingCorrector.warm corrects
+_LOWER_WORD_RE = re.compile(r'[a-z]+')
+
+
+class SpellingCorrector(object):
+    """
+    Memoized spelling correction.
+
+    Words of the allow-list and of the dictionary are never corrected, the
+    corrections of the other words are kept in a bounded LRU cache.
+    """
+    def __init__(self, maxsize=100000):
+        self.cache = butils.lrucache(maxsize)
+        self.allow_list = set()
+        # the dictionary words seen so far, bounded by the dictionary size
+        self.known = set()
+        # words returned without looking them up in the cache
+        self.skipped = 0
+
+    def allow(self, words):
+        """
+        Never correct words. They are matched before stemming, so they must
+        be words as they appear in the input (not the stemmed tokens of the
+        model vocabularies).
+        """
+        self.allow_list.update(words)
+
+    def warm(self, sentences):
+        """
+        Correct the words of sentences ahead of time, e.g. of the training
+        sentences of a model, so that later inputs only pay for the words
+        not seen before.
+        """
+        for sentence in sentences:
+            for word in _LOWER_WORD_RE.findall(sentence.lower()):
+                if len(word) > 2:
+                    self.correct(word)
+
+    def correct(self, word):
+        if word in self.allow_list or word in self.known:
+            self.skipped += 1
+            return word
+        if word in spc.dictionary():
+            self.known.add(word)
+            self.skipped += 1
+            return word
+        correction = self.cache.get(word)
+        if correction is None:
+            correction = spc.correction(word)
+            self.cache.put(word, correction)
+        return correction
+
+    def hit_rate(self):
+        """
+        Fraction of the words corrected without running the corrector.
+        """
+        info = self.cache.info()
+        total = self.skipped + info.hits + info.misses
+        return (self.skipped + info.hits) / total if total else 0.0
+
+    def clear(self):
+        self.cache.clear()
+        self.known.clear()
+        self.skipped = 0
+
+
+# shared by all calls of basic_tokenizer in this process
+spelling_corrector = SpellingCorrector()
+
 
 def clean_sentence(sentence):
     """
@@ -120,7 +190,7 @@ def basic_tokenizer(sentence, to_lower_case=True, lemmatization=True,
         if correct_spell:
             if word.isalpha() and word.islower() and len(word) > 2:
                 old_w = word
-                word = spc.correction(word)
+                word = spelling_corrector.correct(word)
                 if word != old_w:
                     if verbose:
                         print("spell correction: {} -> {}".format(old_w, word))